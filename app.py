@@ -1,11 +1,14 @@
 from flask import Flask
 from config import PORT, DEBUG
+from logging_setup import configure_logging
 from routes import main_blueprint
 from langchain_utils.qa_chain import initialize_app  # initialization sets up global variables
 
 app = Flask(__name__, template_folder="templates")
 app.register_blueprint(main_blueprint)
 
+configure_logging()
+
 # Initialize the LangChain vectorstore and QA chain before handling any requests
 initialize_app()
 
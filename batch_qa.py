@@ -0,0 +1,51 @@
+# batch_qa.py
+# Answers a question set for a list of customers in one run, e.g.
+#   python batch_qa.py --questions questions.txt --customers "Simplot Australia,Metcash" --output answers.csv
+# Questions are a text file (one per line) or JSONL ({"id", "question"}). Progress is checkpointed,
+# so re-running the same command after an interruption only answers what is missing.
+import argparse
+import json
+import sys
+
+from config import BATCH_MAX_WORKERS, BATCH_QUESTIONS_PER_MAP
+from langchain_utils.batch_qa import BatchQARunner, load_questions, write_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch question answering over the contract corpus.")
+    parser.add_argument("--questions", required=True, help="Text file (one question per line) or JSONL with id/question.")
+    parser.add_argument("--customers", help="Comma-separated customer names (defaults to every detected customer).")
+    parser.add_argument("--output", required=True, help="Results file.")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Output format (defaults to the output extension).")
+    parser.add_argument("--checkpoint", help="Checkpoint JSONL (defaults to <output>.checkpoint.jsonl).")
+    parser.add_argument("--max-workers", type=int, default=BATCH_MAX_WORKERS, help="Concurrent LLM calls.")
+    parser.add_argument("--questions-per-map", type=int, default=BATCH_QUESTIONS_PER_MAP,
+                        help="Questions answered per chunk map call.")
+    args = parser.parse_args()
+
+    from logging_setup import configure_logging
+    configure_logging()
+    import langchain_utils.qa_chain as qa_module
+    qa_module.initialize_app()
+
+    state = qa_module.get_index_state()
+    questions = load_questions(args.questions)
+    customers = ([c.strip() for c in args.customers.split(",") if c.strip()] if args.customers
+                 else state.customer_names)
+    if not questions or not customers:
+        print("Nothing to do: no questions or no customers.")
+        sys.exit(1)
+
+    runner = BatchQARunner(
+        state.adaptive_retriever, qa_module.map_reduce_chain.llm_chain.llm,
+        qa_module.map_reduce_chain.reduce_documents_chain, facts_index=state.facts_index,
+        max_workers=args.max_workers, questions_per_map=args.questions_per_map,
+        checkpoint_path=args.checkpoint or args.output + ".checkpoint.jsonl",
+    )
+    results = runner.run(questions, customers)
+    write_results(results, args.output, args.format)
+    print(json.dumps({"results": len(results), "output": args.output, **runner.get_stats()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
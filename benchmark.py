@@ -0,0 +1,234 @@
+# benchmark.py
+# End-to-end offline benchmark: ingestion over pdfs/, index build, retrieval and the full
+# MapReduce chain with a deterministic fake LLM. Emits per-stage wall time, throughput, memory
+# peaks and LLM call counts as JSON, and can compare against a stored baseline.
+import argparse
+import contextlib
+import io
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+from config import PDF_DIR, RETRIEVAL_MIN_K, RETRIEVAL_COMPARATIVE_MIN_K, RETRIEVAL_FETCH_K
+from langchain_community.vectorstores import FAISS
+from langchain_utils.customer_matcher import CustomerMatcher
+from langchain_utils.fake_llm import DeterministicFakeChatModel, DeterministicFakeEmbeddings
+import langchain_utils.qa_chain as qa_module
+from langchain_utils.qa_chain import load_all_documents, setup_map_reduce_chain
+from langchain_utils.retrieval import AdaptiveRetriever
+from document_processing.facts import build_facts_index
+
+DEFAULT_QUERIES = [
+    "what is the storage temperature for mccain",
+    "which clause deals with termination in simplot?",
+    "compare termination clauses in simplot and mccain contracts",
+    "what is NewCold's aggregate liability cap",
+    "how much notice is required to extend the initial term",
+    "what happens during a force majeure event",
+]
+
+# A stage regresses when it is slower by more than the relative tolerance AND this many seconds
+MIN_ABSOLUTE_REGRESSION_SECONDS = 0.05
+
+
+def _max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+@contextlib.contextmanager
+def measure_stage(results, name, verbose=False):
+    """Records wall time and traced memory peak of the enclosed block under results[name]."""
+    stage = {}
+    tracemalloc.start()
+    start = time.perf_counter()
+    sink = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with sink:
+            yield stage
+    finally:
+        wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stage["wall_seconds"] = round(wall, 4)
+        stage["peak_traced_mb"] = round(peak / (1024 * 1024), 2)
+        if stage.get("items"):
+            stage["throughput_per_s"] = round(stage["items"] / wall, 2) if wall > 0 else None
+        results[name] = stage
+
+
+def _latency_summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+def run_benchmark(pdf_dir, queries, embeddings_mode="fake", llm_latency_ms=0.0, max_k=15, verbose=False,
+                  extraction_cache=False):
+    """
+    Runs every stage once and returns the report. The ingestion stage extracts each PDF afresh
+    unless extraction_cache is set (then it reads and fills EXTRACTION_CACHE_DIR); it reports
+    the cache's hits and misses either way.
+    """
+    if embeddings_mode == "fake":
+        embedding_model = DeterministicFakeEmbeddings()
+    else:
+        from langchain_utils.vectorstore import base_embeddings
+        embedding_model = base_embeddings
+    fake_llm = DeterministicFakeChatModel(latency_ms=llm_latency_ms)
+    stages = {}
+
+    cache_dir = qa_module.EXTRACTION_CACHE_DIR
+    qa_module.EXTRACTION_CACHE_DIR = cache_dir if extraction_cache else ""
+    qa_module.extraction_cache = None  # a fresh cache object, so its counts cover this run only
+    try:
+        with measure_stage(stages, "ingestion", verbose) as stage:
+            documents = load_all_documents(pdf_dir)
+            stage["items"] = len(documents)
+            stage["unit"] = "chunks"
+            cache = qa_module.extraction_cache
+            stage["extraction_cache"] = {"enabled": cache is not None,
+                                         **(cache.get_stats() if cache else {"hits": 0, "misses": 0})}
+    finally:
+        qa_module.EXTRACTION_CACHE_DIR = cache_dir
+
+    with measure_stage(stages, "facts_extraction", verbose) as stage:
+        facts_index = build_facts_index(documents)
+        stage["items"] = len(documents)
+        stage["unit"] = "chunks"
+        stage["facts"] = len(facts_index)
+
+    with measure_stage(stages, "index_build", verbose) as stage:
+        vectorstore = FAISS.from_documents(documents, embedding=embedding_model)
+        stage["items"] = len(documents)
+        stage["unit"] = "chunks"
+
+    customers = sorted({d.metadata.get("customer") for d in documents if d.metadata.get("customer") != "Unknown Customer"})
+    matcher = CustomerMatcher(customers)
+    retriever = AdaptiveRetriever(vectorstore, embedding_model, min_k=RETRIEVAL_MIN_K, max_k=max_k,
+                                  comparative_min_k=RETRIEVAL_COMPARATIVE_MIN_K, fetch_k=RETRIEVAL_FETCH_K)
+    retrieved = {}
+    latencies = []
+    with measure_stage(stages, "retrieval", verbose) as stage:
+        for query in queries:
+            found = matcher.find_customers(query)
+            start = time.perf_counter()
+            chunks = retriever.retrieve(query, customer=found[0] if len(found) == 1 else None, comparative=len(found) > 1)
+            latencies.append(time.perf_counter() - start)
+            retrieved[query] = [chunk.map_document for chunk in chunks]
+        stage["items"] = len(queries)
+        stage["unit"] = "queries"
+        stage["latency"] = _latency_summary(latencies)
+        stage["chunks_per_query"] = round(statistics.fmean(len(d) for d in retrieved.values()), 2) if retrieved else 0
+
+    chain = setup_map_reduce_chain(llm=fake_llm)
+    latencies = []
+    with measure_stage(stages, "map_reduce", verbose) as stage:
+        for query in queries:
+            docs = retrieved[query]
+            if not docs:
+                continue
+            start = time.perf_counter()
+            chain.invoke({"input_documents": docs, "question": query})
+            latencies.append(time.perf_counter() - start)
+        stage["items"] = len(latencies)
+        stage["unit"] = "queries"
+        stage["latency"] = _latency_summary(latencies)
+        stage["llm_calls"] = fake_llm.call_counts
+        stage["llm_tokens"] = fake_llm.token_counts
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embeddings": embeddings_mode,
+            "llm": "deterministic-fake",
+            "llm_latency_ms": llm_latency_ms,
+            "extraction_cache": bool(extraction_cache and cache_dir),
+            "pdf_dir": pdf_dir,
+            "queries": len(queries),
+        },
+        "stages": stages,
+        "peak_rss_mb": round(_max_rss_mb(), 1),
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """Returns a list of human-readable regressions of report against baseline."""
+    regressions = []
+    for name, stage in report["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base:
+            continue
+        if name == "ingestion" and (stage.get("extraction_cache", {}).get("enabled") !=
+                                    base.get("extraction_cache", {}).get("enabled")):
+            continue  # cached and uncached extraction times are not comparable
+        wall, base_wall = stage["wall_seconds"], base["wall_seconds"]
+        if wall > base_wall * (1 + tolerance) and wall - base_wall > MIN_ABSOLUTE_REGRESSION_SECONDS:
+            regressions.append(f"{name}: wall time {wall:.3f}s vs baseline {base_wall:.3f}s")
+        mem, base_mem = stage["peak_traced_mb"], base["peak_traced_mb"]
+        if mem > base_mem * (1 + tolerance) and mem - base_mem > 1.0:
+            regressions.append(f"{name}: traced memory peak {mem:.1f}MB vs baseline {base_mem:.1f}MB")
+        for kind, count in stage.get("llm_calls", {}).items():
+            base_count = base.get("llm_calls", {}).get(kind)
+            if base_count is not None and count > base_count:
+                regressions.append(f"{name}: {kind} LLM calls {count} vs baseline {base_count}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with a deterministic fake LLM.")
+    parser.add_argument("--pdf-dir", default=PDF_DIR)
+    parser.add_argument("--queries", help="File with one query per line (defaults to a built-in set).")
+    parser.add_argument("--embeddings", choices=["fake", "configured"], default="fake",
+                        help="'fake' uses hash-seeded vectors; 'configured' uses EMBEDDING_BACKEND.")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated latency per fake LLM call.")
+    parser.add_argument("--max-k", type=int, default=15)
+    parser.add_argument("--extraction-cache", action="store_true",
+                        help="Read and fill EXTRACTION_CACHE_DIR during ingestion instead of extracting every PDF.")
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    parser.add_argument("--baseline", help="Baseline JSON report to compare against.")
+    parser.add_argument("--save-baseline", help="Also write this run's report as a new baseline file.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before flagging.")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline output instead of suppressing it.")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    report = run_benchmark(args.pdf_dir, queries, embeddings_mode=args.embeddings,
+                           llm_latency_ms=args.llm_latency_ms, max_k=args.max_k, verbose=args.verbose,
+                           extraction_cache=args.extraction_cache)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        report["baseline"] = {"path": args.baseline, "tolerance": args.tolerance, "regressions": regressions}
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(output)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
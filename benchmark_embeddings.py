@@ -0,0 +1,101 @@
+# benchmark_embeddings.py
+# Compares embedding backends (torch, onnx fp32, onnx int8) on load time, query latency,
+# batch throughput and resident memory. Each backend runs in its own process so RSS is not shared.
+import argparse
+import json
+import multiprocessing
+import resource
+import statistics
+import sys
+import time
+
+from config import EMBEDDING_MODEL_NAME, ONNX_MODEL_DIR
+
+BACKENDS = {
+    "torch": {"backend": "torch", "quantize": False},
+    "onnx": {"backend": "onnx", "quantize": False},
+    "onnx-int8": {"backend": "onnx", "quantize": True},
+}
+
+SAMPLE_QUERIES = [
+    "what is the storage temperature for mccain",
+    "which clause deals with termination in lactalis?",
+    "compare termination clauses in simplot and patties contracts",
+    "what is NewCold's aggregate liability cap",
+    "how much notice is required to extend the initial term",
+    "what are the service credits for missing KPIs",
+]
+
+
+def _max_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _run_backend(name, settings, repeats, batch_size, result_queue):
+    from langchain_utils.vectorstore import create_base_embeddings
+
+    rss_before = _max_rss_mb()
+    start = time.perf_counter()
+    model = create_base_embeddings(settings["backend"], model_name=EMBEDDING_MODEL_NAME,
+                                   onnx_model_dir=ONNX_MODEL_DIR, quantize=settings["quantize"])
+    model.embed_query("warm up")
+    load_s = time.perf_counter() - start
+
+    latencies_ms = []
+    for _ in range(repeats):
+        for query in SAMPLE_QUERIES:
+            t0 = time.perf_counter()
+            model.embed_query(query)
+            latencies_ms.append((time.perf_counter() - t0) * 1000)
+
+    batch = (SAMPLE_QUERIES * ((batch_size // len(SAMPLE_QUERIES)) + 1))[:batch_size]
+    t0 = time.perf_counter()
+    model.embed_documents(batch)
+    batch_s = time.perf_counter() - t0
+
+    latencies_ms.sort()
+    result_queue.put({
+        "backend": name,
+        "load_seconds": round(load_s, 3),
+        "query_latency_ms": {
+            "p50": round(statistics.median(latencies_ms), 2),
+            "p95": round(latencies_ms[int(0.95 * (len(latencies_ms) - 1))], 2),
+            "mean": round(statistics.fmean(latencies_ms), 2),
+        },
+        "batch_throughput_texts_per_s": round(len(batch) / batch_s, 2),
+        "rss_mb_before_load": round(rss_before, 1),
+        "peak_rss_mb": round(_max_rss_mb(), 1),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends.")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--repeats", type=int, default=5, help="Passes over the sample queries.")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--output", help="Write the JSON results to this file as well as stdout.")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for name in args.backends:
+        result_queue = ctx.Queue()
+        proc = ctx.Process(target=_run_backend, args=(name, BACKENDS[name], args.repeats, args.batch_size, result_queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            results.append({"backend": name, "error": f"benchmark process exited with code {proc.exitcode}"})
+        else:
+            results.append(result_queue.get())
+
+    output = json.dumps({"model": EMBEDDING_MODEL_NAME, "results": results}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# build_index.py
+# Standalone index build, decoupled from the Docker image:
+#   python build_index.py --output artifacts/index.tar.gz
+# parses and embeds the PDFs into a snapshot (FAISS index, chunk store, customer list, facts and a
+# manifest with per-file sha256, embedding model and parser version) and packs it as one artifact.
+# Serve it by pointing INDEX_ARTIFACT at the file or at a URL it is uploaded to; the app checks the
+# checksums and that the embedding model and parser version match before loading it.
+import argparse
+import json
+import os
+import tempfile
+
+from config import PDF_DIR, INDEX_ROOT
+from langchain_utils.index_snapshots import install_artifact, pack_snapshot, publish_snapshot, read_manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a self-contained, checksummed index artifact.")
+    parser.add_argument("--pdf-dir", default=PDF_DIR)
+    parser.add_argument("--output", help="Artifact path (defaults to index-<version>.tar.gz).")
+    parser.add_argument("--publish", action="store_true",
+                        help=f"Also install the artifact into {INDEX_ROOT} and make it the current snapshot.")
+    args = parser.parse_args()
+
+    from logging_setup import configure_logging
+    configure_logging()
+    from langchain_utils.qa_chain import build_snapshot_from_pdfs, index_compatibility
+
+    with tempfile.TemporaryDirectory() as build_root:
+        version = build_snapshot_from_pdfs(args.pdf_dir, publish=False, root=build_root)
+        manifest = read_manifest(build_root, version)
+        output = args.output or f"index-{version}.tar.gz"
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        sha256 = pack_snapshot(build_root, version, output)
+
+    if args.publish:
+        publish_snapshot(INDEX_ROOT, install_artifact(INDEX_ROOT, output, expected=index_compatibility(), sha256=sha256))
+    with open(output + ".sha256", "w") as f:
+        f.write(f"{sha256}  {os.path.basename(output)}\n")
+    print(json.dumps({"artifact": output, "sha256": sha256, "published": args.publish,
+                      **{k: v for k, v in manifest.items() if k != "files"}}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,23 +10,129 @@ PORT = int(os.environ.get("PORT", 5000))
 
 # Directory settings
 PDF_DIR = "pdfs"
-PERSIST_DIRECTORY = "faiss_db"
+# Extracted page markdown per PDF (zstd), keyed by PDF hash and extractor/pymupdf4llm versions; "" disables
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", "extraction_cache")
+PERSIST_DIRECTORY = "faiss_db"  # legacy single-directory index, served only when no snapshot exists
+# Versioned index snapshots (<INDEX_ROOT>/snapshots/<version>) with an atomically replaced CURRENT pointer.
+# Workers poll CURRENT and hot-swap to newly published snapshots.
+INDEX_ROOT = os.getenv("INDEX_ROOT", "indexes")
+INDEX_SNAPSHOTS_KEEP = int(os.getenv("INDEX_SNAPSHOTS_KEEP", 3))
+# Snapshots superseded less than this long ago are never pruned, so workers can still switch through them;
+# sharded snapshots a live process still loads shards from are pinned and never pruned either
+INDEX_PRUNE_GRACE_S = float(os.getenv("INDEX_PRUNE_GRACE_S", 900))
+INDEX_HOT_RELOAD = os.getenv("INDEX_HOT_RELOAD", "true").lower() == "true"
+INDEX_WATCH_INTERVAL_S = float(os.getenv("INDEX_WATCH_INTERVAL_S", 5))
+# Prebuilt index artifact (build_index.py) to install at startup: a .tar.gz or snapshot directory path,
+# or an http(s) URL. INDEX_ARTIFACT_SHA256 pins the archive (or a directory's manifest.json) and is
+# required for URLs. Snapshot files are checksummed again on every load.
+INDEX_ARTIFACT = os.getenv("INDEX_ARTIFACT", "")
+INDEX_ARTIFACT_SHA256 = os.getenv("INDEX_ARTIFACT_SHA256", "") or None
+INDEX_VERIFY_CHECKSUMS = os.getenv("INDEX_VERIFY_CHECKSUMS", "true").lower() == "true"
+# Shard new snapshots by "region" or "customer" ("" = one index). Shards load on first use; beyond
+# INDEX_MAX_LOADED_SHARDS the least recently used one is dropped. Queries search their shards in parallel.
+INDEX_SHARD_BY = os.getenv("INDEX_SHARD_BY", "")
+INDEX_MAX_LOADED_SHARDS = int(os.getenv("INDEX_MAX_LOADED_SHARDS", 4))
+RETRIEVAL_SHARD_WORKERS = int(os.getenv("RETRIEVAL_SHARD_WORKERS", 4))
+# Retrieval in-process ("local") or through retrieval_service.py ("remote"), which keeps one copy of the
+# embedding model and index for all web workers. Address: unix:///path/to.sock or http://host:port
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "local")
+RETRIEVAL_SERVICE_ADDRESS = os.getenv("RETRIEVAL_SERVICE_ADDRESS", "unix:///tmp/legal-qa-retrieval.sock")
+RETRIEVAL_SERVICE_TIMEOUT_S = float(os.getenv("RETRIEVAL_SERVICE_TIMEOUT_S", 10))
+RETRIEVAL_SERVICE_MAX_CONNECTIONS = int(os.getenv("RETRIEVAL_SERVICE_MAX_CONNECTIONS", 20))
 
 # Model and API settings
 EMBEDDING_MODEL_NAME = "BAAI/bge-large-en-v1.5"
+# Embedding backend: "torch" (sentence-transformers) or "onnx" (ONNX Runtime, optionally int8-quantized)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join("onnx_models", EMBEDDING_MODEL_NAME.split("/")[-1]))
+ONNX_QUANTIZE_INT8 = os.getenv("ONNX_QUANTIZE_INT8", "false").lower() == "true"
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+QUERY_EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("QUERY_EMBEDDING_BATCH_WINDOW_MS", 5))
+QUERY_EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("QUERY_EMBEDDING_MAX_BATCH_SIZE", 32))
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "https://nec-us2-ai.openai.azure.com/")
 AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview")
 AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o-mini-legal")
 AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Azure OpenAI deployment limits and the client's retry/deadline policy
+AZURE_OPENAI_RPM = float(os.getenv("AZURE_OPENAI_RPM", 300))
+AZURE_OPENAI_TPM = float(os.getenv("AZURE_OPENAI_TPM", 300000))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 20))
+LLM_HTTP_TIMEOUT_S = float(os.getenv("LLM_HTTP_TIMEOUT_S", 60))
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", 4))
+LLM_RETRY_BASE_DELAY_S = float(os.getenv("LLM_RETRY_BASE_DELAY_S", 0.5))
+LLM_RETRY_MAX_DELAY_S = float(os.getenv("LLM_RETRY_MAX_DELAY_S", 20))
+LLM_REQUEST_DEADLINE_S = float(os.getenv("LLM_REQUEST_DEADLINE_S", 120))
 
 # LangChain tracing and callback settings
 PROJECT_NAME = "pr-new-molecule-89"
+# Coalesce identical in-flight queries: "thread" (within a worker) or "sqlite" (also across workers)
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_BACKEND = os.getenv("SINGLE_FLIGHT_BACKEND", "thread")
+SINGLE_FLIGHT_DB_PATH = os.getenv("SINGLE_FLIGHT_DB_PATH", "single_flight.sqlite")
+SINGLE_FLIGHT_LEASE_S = float(os.getenv("SINGLE_FLIGHT_LEASE_S", 300))
+SINGLE_FLIGHT_RESULT_TTL_S = float(os.getenv("SINGLE_FLIGHT_RESULT_TTL_S", 5))
+
+# Traces are exported from a bounded background queue; runs are dropped (and counted) when it is full
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", 1000))
+TRACE_EXPORT_BATCH_SIZE = int(os.getenv("TRACE_EXPORT_BATCH_SIZE", 100))
+TRACE_EXPORT_FLUSH_INTERVAL_S = float(os.getenv("TRACE_EXPORT_FLUSH_INTERVAL_S", 1.0))
 TEMPERATURE = 0.15
 MAX_TOKENS = 1024
 
+# Batch question answering (/batch and batch_qa.py): checkpoints and results, concurrency, questions per map call
+BATCH_JOBS_DIR = os.getenv("BATCH_JOBS_DIR", "batch_jobs")
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", 4))
+BATCH_QUESTIONS_PER_MAP = int(os.getenv("BATCH_QUESTIONS_PER_MAP", 8))
+
+# Uploaded contracts (/ingest) are saved to PDF_DIR and appended to the index by this many background workers
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", 2))
+
+# Rendered answer HTML kept in memory, keyed by the answer markdown
+ANSWER_HTML_CACHE_SIZE = int(os.getenv("ANSWER_HTML_CACHE_SIZE", 1024))
+
+# Answer simple factual questions (temperatures, amounts, durations) from the facts index before any LLM call
+FACTS_LOOKUP_ENABLED = os.getenv("FACTS_LOOKUP_ENABLED", "true").lower() == "true"
+
+# Retrieval: scored search with adaptive k (score-gap/elbow detection bounded by min/max k)
+RETRIEVAL_SEARCH_TYPE = os.getenv("RETRIEVAL_SEARCH_TYPE", "similarity")  # "similarity" or "mmr"
+RETRIEVAL_MIN_K = int(os.getenv("RETRIEVAL_MIN_K", 4))
+RETRIEVAL_COMPARATIVE_MIN_K = int(os.getenv("RETRIEVAL_COMPARATIVE_MIN_K", 10))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", 40))
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", 0.5))
+RETRIEVAL_ELBOW_MIN_GAP = float(os.getenv("RETRIEVAL_ELBOW_MIN_GAP", 0.02))
+RETRIEVAL_RELATIVE_SCORE_FLOOR = float(os.getenv("RETRIEVAL_RELATIVE_SCORE_FLOOR", 0.9))
+# Comparative queries: one filtered retrieval per named customer, run in parallel, each capped at an
+# equal share of top_k (never below RETRIEVAL_MIN_K_PER_CUSTOMER)
+RETRIEVAL_PLANNER_WORKERS = int(os.getenv("RETRIEVAL_PLANNER_WORKERS", 4))
+RETRIEVAL_MIN_K_PER_CUSTOMER = int(os.getenv("RETRIEVAL_MIN_K_PER_CUSTOMER", 2))
+
+# Duplicate chunks (re-signed copies, amendments): exact content hash plus SimHash within DEDUP_MAX_DISTANCE
+# bits, same customer only. Collapsed at ingestion (smaller index) and among retrieval candidates.
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", 6))
+RETRIEVAL_DEDUP = os.getenv("RETRIEVAL_DEDUP", "true").lower() == "true"
+
+# Parent-child index: embed sentence / sub-clause children, return their parent clause chunks.
+# Children outnumber parents, so retrieval fetches RETRIEVAL_CHILD_FETCH_MULTIPLIER x fetch_k child vectors.
+PARENT_CHILD_ENABLED = os.getenv("PARENT_CHILD_ENABLED", "true").lower() == "true"
+RETRIEVAL_CHILD_FETCH_MULTIPLIER = int(os.getenv("RETRIEVAL_CHILD_FETCH_MULTIPLIER", 4))
+
 # Token thresholds for hierarchical parsing
 MAX_TOKENS_THRESHOLD = 350
+# Worker processes chunking the pages of one PDF from the hierarchy checkpoints of a cheap first pass.
+# 1 parses in order in-process; more only pays off with spare cores and long PDFs (see parse_page_documents)
+PARSER_MAX_WORKERS = int(os.getenv("PARSER_MAX_WORKERS", 1))
 # CHUNK_MAX_TOKENS = 200
-# OVERLAP_RATIO = 0.3
\ No newline at end of file
+# OVERLAP_RATIO = 0.3
+
+# Logging: root level, per-module overrides ("routes=DEBUG,document_processing=WARNING") and the
+# fraction of requests whose per-request debug dumps (retrieved metadata, prompts, raw answers) are logged
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_REQUEST_SAMPLE_RATE = float(os.getenv("LOG_REQUEST_SAMPLE_RATE", 1.0))
+# LangChain's global debug mode and verbose chains print full prompts; keep off in production
+LANGCHAIN_DEBUG = os.getenv("LANGCHAIN_DEBUG", "false").lower() == "true"
+LANGCHAIN_VERBOSE = os.getenv("LANGCHAIN_VERBOSE", "false").lower() == "true"
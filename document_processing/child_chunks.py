@@ -0,0 +1,57 @@
+# document_processing/child_chunks.py
+
+import re
+import uuid
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from document_processing.config import CHILD_CHUNK_MAX_WORDS, CHILD_CHUNK_MIN_WORDS
+
+# Sentence ends, and inline sub-clause markers such as "(a)" or "(iv)" that start a new obligation
+CHILD_SPLIT_RE = re.compile(r'(?<=[.;:])\s+(?=[A-Z(\d])|\s+(?=\((?:[a-z]|[ivx]{1,4})\)\s)')
+# Parent metadata carried by each child: what customer filtering and evaluation look at
+CHILD_METADATA_KEYS = ('source', 'page_number', 'customer', 'region', 'clause', 'clause_title', 'hierarchy')
+
+
+def split_child_texts(text: str, max_words: int = CHILD_CHUNK_MAX_WORDS,
+                      min_words: int = CHILD_CHUNK_MIN_WORDS) -> List[str]:
+    """
+    Splits a clause chunk into sentence / sub-clause pieces. Pieces under min_words are merged into
+    the previous one (headings, "(a)" stubs); pieces over max_words are cut into word windows.
+    """
+    pieces: List[List[str]] = []
+    for part in CHILD_SPLIT_RE.split(text):
+        words = part.split()
+        if not words:
+            continue
+        if pieces and (len(words) < min_words or len(pieces[-1]) < min_words):
+            pieces[-1].extend(words)
+        else:
+            pieces.append(words)
+    texts = []
+    for words in pieces:
+        for start in range(0, len(words), max_words):
+            texts.append(" ".join(words[start:start + max_words]))
+    return texts
+
+
+def build_parent_child_documents(parents: List[Document], max_words: int = CHILD_CHUNK_MAX_WORDS,
+                                 min_words: int = CHILD_CHUNK_MIN_WORDS) -> Tuple[List[Document], Dict[str, Document]]:
+    """
+    Returns (child documents to embed, parents by id). Each child carries its parent's id in
+    metadata['parent_id'] and is prefixed with the clause title, so a lone sentence keeps its topic.
+    """
+    children = []
+    parents_by_id = {}
+    for parent in parents:
+        parent_id = str(uuid.uuid4())
+        parents_by_id[parent_id] = Document(id=parent_id, page_content=parent.page_content, metadata=parent.metadata)
+        child_metadata = {k: parent.metadata[k] for k in CHILD_METADATA_KEYS if k in parent.metadata}
+        title = parent.metadata.get('clause_title')
+        for index, text in enumerate(split_child_texts(parent.page_content, max_words, min_words)):
+            children.append(Document(
+                page_content=f"{title}: {text}" if title else text,
+                metadata={**child_metadata, 'parent_id': parent_id, 'child_index': index},
+            ))
+    return children, parents_by_id
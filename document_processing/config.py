@@ -1,4 +1,15 @@
 CHUNK_MAX_TOKENS = 400
 OVERLAP_RATIO = 0.3
 MIN_TITLE_WORDS = 10
-MAX_HEADER_TITLE_WORDS = 40
\ No newline at end of file
+MAX_HEADER_TITLE_WORDS = 40
+
+# Bump whenever parsing, chunk metadata or extracted facts change; indexes built by another parser version are rejected at load
+PARSER_VERSION = "5"
+
+# Parent-child retrieval: sentence / sub-clause vectors of at most CHILD_CHUNK_MAX_WORDS point to their clause chunk
+CHILD_CHUNK_MAX_WORDS = 60
+CHILD_CHUNK_MIN_WORDS = 6
+
+# Bump whenever extract_documents_from_pdf output (page text, customer or region detection) changes;
+# cached extractions of another version are not reused
+EXTRACTOR_VERSION = "1"
@@ -0,0 +1,145 @@
+# document_processing/dedup.py
+
+import hashlib
+import re
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+SIMHASH_BITS = 64
+SHINGLE_WORDS = 3
+# DocuSign envelope ids and page furniture differ between otherwise identical copies of a contract
+VOLATILE_RE = re.compile(r'docusign envelope id:\s*[0-9a-f-]+|\bpage \d+ of \d+\b', re.IGNORECASE)
+WORD_RE = re.compile(r'\w+')
+# Numbers, amounts and durations: chunks that differ in any of these are never duplicates
+# ("thirty (30) days" amended to "sixty (60) days" changes only a few SimHash bits)
+KEY_TERM_RE = re.compile(
+    r'\d+(?:[.,]\d+)*|\b(?:zero|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|'
+    r'(?:thir|four|fif|six|seven|eigh|nine)teen|(?:twen|thir|for|fif|six|seven|eigh|nine)ty|hundred|thousand|'
+    r'million|billion|half|quarter|percent|per\s?cent|business|calendar|hours?|days?|weeks?|months?|years?)\b'
+)
+
+
+def normalized_words(text: str) -> List[str]:
+    """Lowercased words with volatile fragments (envelope ids, page x of y) removed."""
+    return WORD_RE.findall(VOLATILE_RE.sub(' ', text).lower())
+
+
+def content_hash(text: str) -> str:
+    """Exact-duplicate key: sha1 of the normalized word sequence (ignores case, spacing and punctuation)."""
+    return hashlib.sha1(" ".join(normalized_words(text)).encode("utf-8")).hexdigest()
+
+
+def key_terms(text: str) -> str:
+    """Fingerprint of the numbers, amounts and duration words in a chunk, in order."""
+    terms = KEY_TERM_RE.findall(VOLATILE_RE.sub(' ', text).lower())
+    return hashlib.sha1("\x1f".join(terms).encode("utf-8")).hexdigest()[:16]
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word shingles; near-identical texts differ in only a few bits."""
+    words = normalized_words(text)
+    if len(words) >= SHINGLE_WORDS:
+        features = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    else:
+        features = set(words)
+    if not features:
+        return 0
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "big") for f in features],
+        dtype=np.uint64,
+    )
+    bits = (hashes[:, None] >> np.arange(SIMHASH_BITS, dtype=np.uint64)) & np.uint64(1)
+    votes = bits.astype(np.int64).sum(axis=0) * 2 - len(features)
+    return int(sum(1 << i for i in range(SIMHASH_BITS) if votes[i] > 0))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    """
+    Finds stored SimHashes within max_distance bits of a query. Hashes are split into
+    max_distance + 1 bands; two hashes that close must agree exactly on at least one band.
+    """
+
+    def __init__(self, max_distance: int = 6):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = -(-SIMHASH_BITS // self.bands)
+        self._tables: List[Dict[int, List[Tuple[int, object]]]] = [defaultdict(list) for _ in range(self.bands)]
+
+    def _band_keys(self, value: int) -> Iterable[int]:
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.bands):
+            yield (value >> (band * self.band_bits)) & mask
+
+    def add(self, value: int, item):
+        for band, key in enumerate(self._band_keys(value)):
+            self._tables[band][key].append((value, item))
+
+    def find(self, value: int, accept: Optional[Callable[[object], bool]] = None) -> Optional[object]:
+        """The first stored item within max_distance of value (and passing `accept`), or None."""
+        for band, key in enumerate(self._band_keys(value)):
+            for stored, item in self._tables[band].get(key, ()):
+                if hamming_distance(stored, value) <= self.max_distance and (accept is None or accept(item)):
+                    return item
+        return None
+
+
+def add_dedup_keys(docs) -> None:
+    """Stores content_hash, simhash (hex) and key_terms in each chunk's metadata; retrieval reuses them."""
+    for doc in docs:
+        doc.metadata['content_hash'] = content_hash(doc.page_content)
+        doc.metadata['simhash'] = f"{simhash(doc.page_content):016x}"
+        doc.metadata['key_terms'] = key_terms(doc.page_content)
+
+
+def document_simhash(doc) -> int:
+    """The chunk's stored SimHash, computed on the fly for chunks indexed without one."""
+    stored = doc.metadata.get('simhash')
+    return int(stored, 16) if stored else simhash(doc.page_content)
+
+
+def document_key_terms(doc) -> str:
+    """The chunk's stored key_terms fingerprint, computed on the fly for chunks indexed without one."""
+    return doc.metadata.get('key_terms') or key_terms(doc.page_content)
+
+
+def deduplicate_documents(docs, max_distance: int = 6) -> Tuple[List, Dict[str, int]]:
+    """
+    Collapses exact and near-duplicate chunks of the same customer (re-signed copies, amendments
+    repeating unchanged clauses) to the first occurrence. Near duplicates whose numbers, amounts
+    or durations differ (an amended term) are both kept. The representative lists the sources
+    it stands for in metadata['duplicate_sources']. Returns (kept documents, stats).
+    """
+    kept = []
+    exact: Dict[Tuple[str, str], object] = {}
+    near: Dict[str, SimHashIndex] = defaultdict(lambda: SimHashIndex(max_distance))
+    stats = {"input": len(docs), "exact_duplicates": 0, "near_duplicates": 0}
+    for doc in docs:
+        if 'simhash' not in doc.metadata:
+            add_dedup_keys([doc])
+        customer = doc.metadata.get('customer', 'Unknown Customer')
+        representative = exact.get((customer, doc.metadata['content_hash']))
+        if representative is not None:
+            stats["exact_duplicates"] += 1
+        elif max_distance >= 0:
+            terms = document_key_terms(doc)
+            representative = near[customer].find(document_simhash(doc),
+                                                 accept=lambda other: document_key_terms(other) == terms)
+            if representative is not None:
+                stats["near_duplicates"] += 1
+        if representative is not None:
+            duplicate_sources = representative.metadata.setdefault('duplicate_sources', [])
+            location = f"{doc.metadata.get('source')} p.{doc.metadata.get('page_number')}"
+            if location not in duplicate_sources:
+                duplicate_sources.append(location)
+            continue
+        exact[(customer, doc.metadata['content_hash'])] = doc
+        near[customer].add(document_simhash(doc), doc)
+        kept.append(doc)
+    stats["kept"] = len(kept)
+    return kept, stats
@@ -0,0 +1,91 @@
+# document_processing/extraction_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Callable, List, Optional
+
+import pymupdf4llm
+import zstandard
+from langchain_core.documents import Document
+
+from document_processing.config import EXTRACTOR_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def extraction_cache_key(pdf_path: str) -> str:
+    """sha256 of the PDF bytes, the extractor version and the pymupdf4llm version."""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return hashlib.sha256(
+        f"{digest.hexdigest()}\x00{EXTRACTOR_VERSION}\x00{pymupdf4llm.__version__}".encode("utf-8")
+    ).hexdigest()
+
+
+class ExtractionCache:
+    """
+    On-disk cache of extracted pages (markdown plus metadata, including the detected customer and
+    region), one zstd-compressed JSON file per PDF. Re-parsing with new chunking settings then skips
+    pymupdf4llm entirely; editing the PDF, the extractor or pymupdf4llm changes the key.
+    """
+
+    def __init__(self, directory: str, extract: Optional[Callable[[str], List[Document]]] = None, level: int = 10):
+        if extract is None:
+            from document_processing.pdf_extractor import extract_documents_from_pdf as extract
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._extract = extract
+        self.level = level
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json.zst")
+
+    def get(self, key: str) -> Optional[List[Document]]:
+        try:
+            with open(self._path(key), "rb") as f:
+                pages = json.loads(zstandard.ZstdDecompressor().decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except (zstandard.ZstdError, ValueError) as e:
+            logger.warning("Ignoring unreadable extraction cache entry %s: %s", key, e)
+            return None
+        return [Document(page_content=page["page_content"], metadata=page["metadata"]) for page in pages]
+
+    def put(self, key: str, documents: List[Document]):
+        payload = json.dumps([{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents])
+        tmp_path = f"{self._path(key)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zstandard.ZstdCompressor(level=self.level).compress(payload.encode("utf-8")))
+        os.replace(tmp_path, self._path(key))
+
+    def extract(self, pdf_path: str) -> List[Document]:
+        """Extracted pages of the PDF, from the cache when its key matches."""
+        key = extraction_cache_key(pdf_path)
+        documents = self.get(key)
+        with self._lock:
+            if documents is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if documents is not None:
+            logger.info("Using cached extraction of %s", os.path.basename(pdf_path))
+            # The same contract may have been cached under another file name
+            for doc in documents:
+                doc.metadata["source"] = os.path.basename(pdf_path)
+            return documents
+        documents = self._extract(pdf_path)
+        if documents:  # failed extractions are retried next time
+            self.put(key, documents)
+        return documents
+
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses}
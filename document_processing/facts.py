@@ -0,0 +1,247 @@
+# document_processing/facts.py
+
+import json
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from document_processing.parser import LegalDocumentParser
+
+# --- Fact Extraction Patterns ---
+MONEY_RE = re.compile(
+    r'(?P<currency>AUD|USD|A\$|US\$|\$|€|£)\s?(?P<amount>\d{1,3}(?:,\d{3})+|\d+)(?:\.(?P<cents>\d{1,2}))?'
+    r'(?:\s?(?P<scale>million|billion|thousand|m|k)\b)?',
+    re.IGNORECASE
+)
+# "0-4°C", "-18 to -22 °C": matched before single values. A dash is a minus sign only when no
+# digit comes before it, so the "-4" of "0-4°C" is never read as a negative temperature.
+TEMPERATURE_SIGN = r'(?:(?<![\d.])(?<![\d.]\s)[-−–]|minus\s+|negative\s+|\+)'
+TEMPERATURE_UNIT = r'\s?(?:°|º|˚|degrees?\s*)\s?(?P<unit>Celsius|Fahrenheit|C|F)\b'
+TEMPERATURE_RANGE_RE = re.compile(
+    r'(?P<low_sign>' + TEMPERATURE_SIGN + r')?\s?(?P<low>\d+(?:\.\d+)?)\s?(?:°|º|˚)?\s?(?:[-–−]|to)\s?'
+    r'(?P<high_sign>[-−–]|minus\s+|negative\s+)?\s?(?P<high>\d+(?:\.\d+)?)' + TEMPERATURE_UNIT,
+    re.IGNORECASE
+)
+TEMPERATURE_RE = re.compile(
+    r'(?P<sign>' + TEMPERATURE_SIGN + r')?\s?(?P<value>\d+(?:\.\d+)?)' + TEMPERATURE_UNIT,
+    re.IGNORECASE
+)
+DURATION_RE = re.compile(
+    r'(?:\b[a-z-]+\s+\()?\b(?P<value>\d+)\)?\s+(?P<unit>business\s+days?|calendar\s+days?|days?|weeks?|months?|years?|hours?)\b',
+    re.IGNORECASE
+)
+
+MONEY_SCALES = {"thousand": 1_000, "k": 1_000, "million": 1_000_000, "m": 1_000_000, "billion": 1_000_000_000}
+DURATION_DAYS = {"hour": 1 / 24, "day": 1, "business day": 1, "calendar day": 1, "week": 7, "month": 30, "year": 365}
+
+# Words in a question that signal which fact type answers it
+FACT_QUERY_PATTERNS = {
+    "temperature": re.compile(r'\b(?:temperatures?|degrees?|celsius|fahrenheit)\b', re.IGNORECASE),
+    "money": re.compile(r'\b(?:how much|amount|cap|caps|fees?|price|costs?|charges?|payments?|dollars?)\b', re.IGNORECASE),
+    "duration": re.compile(r'\b(?:how long|duration|period|days|months|years|deadline)\b', re.IGNORECASE),
+}
+# Questions answered from the facts index alone; anything else goes through retrieval and the LLM
+FACT_QUESTION_PATTERNS = {
+    "temperature": re.compile(
+        r'\b(?:what|which)\s+(?:(?:is|are)\s+the\s+)?(?:[a-z-]+\s+){0,4}?temperatures?\b|\bhow\s+(?:cold|warm)\b',
+        re.IGNORECASE),
+    "money": re.compile(
+        r'\bhow\s+much\b|\b(?:what|which)\s+(?:is|are)\s+the\s+(?:[a-z-]+\s+){0,4}?'
+        r'(?:fees?|caps?|prices?|rates?|charges?|amounts?|costs?)\b',
+        re.IGNORECASE),
+    "duration": re.compile(
+        r'\bhow\s+long\b|\bhow\s+many\s+(?:business\s+|calendar\s+)?(?:days|weeks|months|years|hours)\b|'
+        r'\b(?:what|which)\s+(?:is|are)\s+the\s+(?:[a-z-]+\s+){0,4}?(?:periods?|deadlines?|durations?|notice)\b',
+        re.IGNORECASE),
+}
+QUERY_STOPWORDS = {
+    "what", "which", "is", "are", "the", "a", "an", "of", "for", "in", "on", "to", "and", "or", "does",
+    "do", "with", "under", "by", "at", "as", "be", "there", "how", "much", "long", "agreement",
+    "contract", "clause", "customer", "newcold", "me", "tell", "give", "about",
+}
+CONTEXT_WINDOW_CHARS = 160
+
+
+def _context_around(text, start, end, window=CONTEXT_WINDOW_CHARS):
+    """Returns the text surrounding a match, collapsed onto one line."""
+    snippet = text[max(0, start - window):min(len(text), end + window)]
+    return re.sub(r'\s+', ' ', snippet).strip()
+
+
+def _normalize_money(match):
+    amount = float(match.group('amount').replace(',', ''))
+    if match.group('cents'):
+        amount += float("0." + match.group('cents'))
+    scale = (match.group('scale') or "").lower()
+    amount *= MONEY_SCALES.get(scale, 1)
+    currency = match.group('currency').upper().replace('A$', 'AUD').replace('US$', 'USD')
+    return amount, currency
+
+
+def _to_celsius(value, sign, unit):
+    if sign and sign.strip().lower() not in ('+',):
+        value = -value
+    if unit.upper().startswith('F'):
+        value = round((value - 32) * 5 / 9, 1)
+    return value
+
+
+def _normalize_temperature(match):
+    return _to_celsius(float(match.group('value')), match.group('sign'), match.group('unit')), "°C"
+
+
+def _normalize_temperature_range(match):
+    """[low, high] in °C."""
+    bounds = [_to_celsius(float(match.group(name)), match.group(name + '_sign'), match.group('unit'))
+              for name in ('low', 'high')]
+    return sorted(bounds), "°C"
+
+
+def _normalize_duration(match):
+    value = int(match.group('value'))
+    unit = re.sub(r'\s+', ' ', match.group('unit').lower()).rstrip('s')
+    return value * DURATION_DAYS.get(unit, 1), unit
+
+
+def extract_facts_from_text(text, metadata=None):
+    """
+    Extracts monetary amounts, temperatures, durations and tables from a chunk of text.
+    Every fact carries the chunk's source, page, customer and clause for attribution.
+    """
+    metadata = metadata or {}
+    attribution = {
+        'customer': metadata.get('customer', 'Unknown Customer'),
+        'source': metadata.get('source', 'Unknown'),
+        'page_number': metadata.get('page_number', 'N/A'),
+        'clause': metadata.get('clause') or 'N/A',
+        'clause_title': metadata.get('clause_title'),
+    }
+    facts = []
+
+    for match in MONEY_RE.finditer(text):
+        value, unit = _normalize_money(match)
+        facts.append({'type': 'money', 'value': value, 'unit': unit, 'text': match.group(0).strip(),
+                      'context': _context_around(text, match.start(), match.end()), **attribution})
+    range_spans = []
+    for match in TEMPERATURE_RANGE_RE.finditer(text):
+        value, unit = _normalize_temperature_range(match)
+        range_spans.append(match.span())
+        facts.append({'type': 'temperature', 'value': value, 'unit': unit, 'text': match.group(0).strip(),
+                      'context': _context_around(text, match.start(), match.end()), **attribution})
+    for match in TEMPERATURE_RE.finditer(text):
+        if any(start <= match.start() < end for start, end in range_spans):
+            continue  # the upper bound of a range
+        value, unit = _normalize_temperature(match)
+        facts.append({'type': 'temperature', 'value': value, 'unit': unit, 'text': match.group(0).strip(),
+                      'context': _context_around(text, match.start(), match.end()), **attribution})
+    for match in DURATION_RE.finditer(text):
+        value, unit = _normalize_duration(match)
+        facts.append({'type': 'duration', 'value': value, 'unit': 'days', 'text': match.group(0).strip(),
+                      'context': _context_around(text, match.start(), match.end()), **attribution})
+
+    financials = LegalDocumentParser().extract_financials(text)
+    for table in financials['tables']:
+        table_attribution = dict(attribution)
+        if table.get('clause'):
+            table_attribution['clause'] = table['clause']
+        facts.append({'type': 'table', 'value': None, 'unit': None, 'text': table['table'],
+                      'context': table['context'], **table_attribution})
+    for formula in financials['formulas']:
+        facts.append({'type': 'formula', 'value': None, 'unit': None, 'text': formula['formula'],
+                      'context': formula['context'], **attribution})
+    return facts
+
+
+class FactsIndex:
+    """Typed store of extracted facts, indexed by (customer, fact type)."""
+
+    def __init__(self, facts=None):
+        self.facts: List[Dict] = []
+        self._by_customer_type = defaultdict(list)
+        self._seen = set()
+        if facts:
+            self.add_facts(facts)
+
+    def __len__(self):
+        return len(self.facts)
+
+    def add_facts(self, facts):
+        for fact in facts:
+            # Overlapping chunks repeat the same text; keep one copy per location
+            key = (fact['customer'], fact['source'], fact['page_number'], fact['clause'], fact['type'], fact['text'])
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            self.facts.append(fact)
+            self._by_customer_type[(fact['customer'], fact['type'])].append(fact)
+
+    def lookup(self, customer, fact_type) -> List[Dict]:
+        return self._by_customer_type.get((customer, fact_type), [])
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.facts, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def answer_query(self, query, customer, max_facts=5) -> Optional[List[Dict]]:
+        """
+        Returns the facts that answer a simple factual question about one customer, or None
+        if the question is not a fact lookup ("how much ...", "what is the ... fee") or nothing
+        relevant was indexed. Query words of three letters or more must appear as whole words in
+        the fact's context or clause title.
+        """
+        if not customer:
+            return None
+        fact_types = [fact_type for fact_type, pattern in FACT_QUESTION_PATTERNS.items() if pattern.search(query)]
+        if len(fact_types) != 1:
+            return None
+        candidates = self.lookup(customer, fact_types[0])
+        if not candidates:
+            return None
+
+        customer_words = set(customer.lower().split())
+        query_terms = {
+            w for w in re.findall(r"[a-z]+", query.lower())
+            if len(w) > 2 and w not in QUERY_STOPWORDS and w not in customer_words and not FACT_QUERY_PATTERNS[fact_types[0]].fullmatch(w)
+        }
+        scored = []
+        for fact in candidates:
+            haystack = set(re.findall(r"[a-z]+", (fact['context'] + " " + (fact.get('clause_title') or "")).lower()))
+            score = len(query_terms & haystack)
+            scored.append((score, fact))
+        if query_terms:
+            scored = [item for item in scored if item[0] > 0]
+        if not scored:
+            return None
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [fact for _, fact in scored[:max_facts]]
+
+
+def build_facts_index(documents) -> FactsIndex:
+    """Extracts facts from every parsed chunk into a FactsIndex."""
+    facts_index = FactsIndex()
+    for doc in documents:
+        facts_index.add_facts(extract_facts_from_text(doc.page_content, doc.metadata))
+    return facts_index
+
+
+def format_facts_answer(facts, customer):
+    """Formats looked-up facts as a markdown answer plus the matching source strings."""
+    lines = [f"From the indexed facts for **{customer}**:", ""]
+    sources = []
+    for fact in facts:
+        location = f"{fact['source']}, Page {fact['page_number']}, Clause {fact['clause']}"
+        lines.append(f"- **{fact['text']}** — \"{fact['context']}\" ({location})")
+        source_str = f"{fact['source']} (Customer: {fact['customer']}) - Page {fact['page_number']}"
+        if fact['clause'] and fact['clause'] != 'N/A':
+            source_str += f" (Clause: {fact['clause']})"
+        if source_str not in sources:
+            sources.append(source_str)
+    return "\n".join(lines), sources
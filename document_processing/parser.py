@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import re
+import bisect
+import logging
 import networkx as nx
 from langchain_core.documents import Document
 import os
 import copy # Needed for deep copying the stack
 
+logger = logging.getLogger(__name__)
+
 # --- Configuration Import ---
 try:
     # Assumes config.py is in the same directory (e.g., document_processing)
@@ -15,18 +19,18 @@ try:
         MIN_TITLE_WORDS,
         MAX_HEADER_TITLE_WORDS,
     )
-    print("--- Successfully imported settings from ./config.py ---")
+    logger.debug("Successfully imported settings from ./config.py")
 except ImportError:
-    print("--- WARNING: Could not import settings from config.py. Using default values. ---")
-    print("--- Ensure config.py exists and defines necessary variables (e.g., CHUNK_MAX_TOKENS). ---")
+    logger.warning("Could not import settings from config.py. Using default values. "
+                   "Ensure config.py exists and defines necessary variables (e.g., CHUNK_MAX_TOKENS).")
     # Adjusted default token limit based on evaluation
     CHUNK_MAX_TOKENS = 400
     OVERLAP_RATIO = 0.3
     MIN_TITLE_WORDS = 10
     MAX_HEADER_TITLE_WORDS = 40
 
-print(f"--- EXECUTING PARSER: {os.path.abspath(__file__)} ---")
-print(f"--- Using Config: CHUNK_MAX_TOKENS={CHUNK_MAX_TOKENS}, OVERLAP_RATIO={OVERLAP_RATIO}, MIN_TITLE_WORDS={MIN_TITLE_WORDS}, MAX_HEADER_TITLE_WORDS={MAX_HEADER_TITLE_WORDS} ---")
+logger.debug("EXECUTING PARSER: %s", os.path.abspath(__file__))
+logger.debug("Using Config: CHUNK_MAX_TOKENS=%s, OVERLAP_RATIO=%s, MIN_TITLE_WORDS=%s, MAX_HEADER_TITLE_WORDS=%s", CHUNK_MAX_TOKENS, OVERLAP_RATIO, MIN_TITLE_WORDS, MAX_HEADER_TITLE_WORDS)
 
 
 # --- Constants and Regular Expressions ---
@@ -148,14 +152,62 @@ def strip_markdown_emphasis(title):
 
 # --- Core Hierarchical Chunking Function ---
 
-def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, extra_metadata=None, initial_stack=None):
+def count_tokens(lines):
+    """Estimates token count based on simple word split."""
+    # Consider a more robust tokenizer if needed (e.g., tiktoken)
+    return sum(len(line.split()) for line in lines)
+
+
+def read_header(lines, i, potential_title):
+    """
+    Merges the continuation lines of the header at lines[i] into its title and cleans it up.
+    Returns the index of the first line after the header and the processed title.
+    """
+    # --- Try to merge subsequent lines for multi-line titles ---
+    header_content_lines = [potential_title]
+    j = i + 1
+    while j < len(lines):
+        next_line_raw = lines[j]; next_line_stripped = next_line_raw.strip()
+        if not next_line_stripped or is_spurious_line(next_line_raw): break
+        if HEADER_RE.match(next_line_raw.strip()): break
+        if LIST_ITEM_RE.match(next_line_stripped): break
+        header_content_lines.append(next_line_stripped)
+        j += 1
+    merged_title = " ".join(header_content_lines).strip()
+
+    # --- Process and Validate Header Title ---
+    processed_title = enrich_title_if_short(merged_title, lines, j, target_word_count=MIN_TITLE_WORDS)
+    if j < len(lines): processed_title = extend_title_if_incomplete(processed_title, lines[j])
+    processed_title = clean_trailing_punctuation(processed_title)
+    title_words = processed_title.split()
+    if len(title_words) > MAX_HEADER_TITLE_WORDS:
+       processed_title = " ".join(title_words[:MAX_HEADER_TITLE_WORDS]) + "..."
+    return j, strip_markdown_emphasis(processed_title)
+
+
+def push_header(hierarchy_stack, clause_id_raw, processed_title):
+    """Pops the stack back to the parent level of the clause and pushes the clause."""
+    clause_id_cleaned = clause_id_raw.rstrip('.')
+    level = clause_id_cleaned.count('.') + clause_id_cleaned.count('(')
+    # Adjust hierarchy stack based on level
+    while hierarchy_stack and hierarchy_stack[-1][2] >= level:
+        hierarchy_stack.pop()
+    hierarchy_stack.append((clause_id_cleaned, processed_title, level))
+
+
+def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, extra_metadata=None, initial_stack=None,
+                                    chunk_max_tokens=None, overlap_ratio=None):
     """
     Parses text, chunks based on clauses/tokens, handles hierarchy state across pages,
     filters out header-only chunks, and prevents false header detection after token splits.
+    chunk_max_tokens/overlap_ratio override the configured CHUNK_MAX_TOKENS/OVERLAP_RATIO.
     """
+    if chunk_max_tokens is None: chunk_max_tokens = CHUNK_MAX_TOKENS
+    if overlap_ratio is None: overlap_ratio = OVERLAP_RATIO
     lines = full_text.splitlines()
     documents = []
     current_chunk_lines = []
+    current_token_count = 0  # words in current_chunk_lines, kept in step with it
     hierarchy_stack = initial_stack if initial_stack is not None else []
     # print(f"DEBUG: Initializing parser for page {page_number}. Initial Stack: {[item[0] for item in hierarchy_stack]}")
 
@@ -166,7 +218,7 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
         Ensures metadata is correctly assigned based on the current hierarchy stack
         or an override stack if provided (for flushing content before a header).
         """
-        nonlocal current_chunk_lines, hierarchy_stack, documents # Ensure documents is modified
+        nonlocal current_chunk_lines, current_token_count, hierarchy_stack, documents # Ensure documents is modified
         if not current_chunk_lines: return
 
         chunk_text = "\n".join(current_chunk_lines).strip()
@@ -188,6 +240,7 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
             # print(f"DEBUG: Skipping header-only chunk: '{chunk_text[:80]}...'")
             current_chunk_lines.clear() # Discard it
             if overlap_lines: current_chunk_lines.extend(overlap_lines) # Keep overlap for next chunk
+            current_token_count = count_tokens(current_chunk_lines)
             return # Don't create the document
         # --- END FILTERING ---
 
@@ -217,11 +270,7 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
         # Reset for next chunk
         current_chunk_lines.clear()
         if overlap_lines: current_chunk_lines.extend(overlap_lines)
-
-    def get_current_token_count():
-        """Estimates token count based on simple word split."""
-        # Consider a more robust tokenizer if needed (e.g., tiktoken)
-        return sum(len(line.split()) for line in current_chunk_lines)
+        current_token_count = count_tokens(current_chunk_lines)
 
     # --- Main Parsing Loop ---
     i = 0
@@ -248,27 +297,7 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
             clause_id_raw = match.group(1)
             potential_title = match.group(2)
             first_header_line_index = i
-
-            # --- Try to merge subsequent lines for multi-line titles ---
-            header_content_lines = [potential_title]
-            j = i + 1
-            while j < len(lines):
-                next_line_raw = lines[j]; next_line_stripped = next_line_raw.strip()
-                if not next_line_stripped or is_spurious_line(next_line_raw): break
-                if HEADER_RE.match(next_line_raw.strip()): break
-                if LIST_ITEM_RE.match(next_line_stripped): break
-                header_content_lines.append(next_line_stripped)
-                j += 1
-            merged_title = " ".join(header_content_lines).strip()
-
-            # --- Process and Validate Header Title ---
-            processed_title = enrich_title_if_short(merged_title, lines, j, target_word_count=MIN_TITLE_WORDS)
-            if j < len(lines): processed_title = extend_title_if_incomplete(processed_title, lines[j])
-            processed_title = clean_trailing_punctuation(processed_title)
-            title_words = processed_title.split()
-            if len(title_words) > MAX_HEADER_TITLE_WORDS:
-               processed_title = " ".join(title_words[:MAX_HEADER_TITLE_WORDS]) + "..."
-            processed_title = strip_markdown_emphasis(processed_title)
+            j, processed_title = read_header(lines, i, potential_title)
 
             # --- Final Validation ---
             is_valid = is_valid_clause(clause_id_raw, processed_title)
@@ -295,36 +324,12 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
                 # **MODIFICATION END**
 
                 # Now update the stack for the *new* header
-                clause_id_cleaned = clause_id_raw.rstrip('.')
-                level = clause_id_cleaned.count('.') + clause_id_cleaned.count('(')
-
-                # --- DEBUG PRINTS for Stack Adjustment ---
-                # print(f"Calculated Level: {level}")
-                # print(f"Stack BEFORE pop check: {[item[0] for item in hierarchy_stack]}")
-                # --- END DEBUG PRINTS ---
-
-                # Adjust hierarchy stack based on level
-                while hierarchy_stack and hierarchy_stack[-1][2] >= level:
-                    # --- DEBUG PRINT for Pop ---
-                    # print(f"  Condition met: Stack top level {hierarchy_stack[-1][2]} >= new level {level}. Popping {hierarchy_stack[-1][0]}")
-                    # --- END DEBUG PRINT ---
-                    hierarchy_stack.pop()
-
-                # --- DEBUG PRINT for Append ---
-                # print(f"Stack BEFORE append: {[item[0] for item in hierarchy_stack]}")
-                # print(f"Appending: ('{clause_id_cleaned}', '{processed_title[:30]}...', {level})")
-                # --- END DEBUG PRINT ---
-
-                hierarchy_stack.append((clause_id_cleaned, processed_title, level))
-
-                # --- DEBUG PRINT for Stack After Append ---
-                # print(f"Stack AFTER append: {[item[0] for item in hierarchy_stack]}")
-                # print(f"--- End Header Check ---")
-                # --- END DEBUG PRINT ---
+                push_header(hierarchy_stack, clause_id_raw, processed_title)
 
                 # Add the original header line(s) to start the new chunk's content
                 # current_chunk_lines should be empty here due to the flush above
                 current_chunk_lines.extend(lines[first_header_line_index:j])
+                current_token_count += count_tokens(lines[first_header_line_index:j])
                 i = j # Move index past the header lines
                 processed_as_real_header = True
             else:
@@ -332,6 +337,7 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
                 # print(f"--- DEBUG: Invalid Header - Treating as Content ---") # DEBUG
                 # Treat the line(s) that matched the pattern as content
                 current_chunk_lines.extend(lines[first_header_line_index:j])
+                current_token_count += count_tokens(lines[first_header_line_index:j])
                 i = j # Move index past these lines
         else:
             # --- Not a header OR immediately after split ---
@@ -339,6 +345,7 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
             #     print(f"--- DEBUG: Header pattern matched but ignored due to just_split_due_to_tokens ---") # DEBUG
             # Treat as content
             current_chunk_lines.append(line)
+            current_token_count += len(line.split())
             i += 1
 
         # --- Reset flag AFTER processing the line(s) for this iteration ---
@@ -346,9 +353,8 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
         just_split_due_to_tokens = False
 
         # --- Check token limit AFTER adding the line(s) ---
-        current_tokens = get_current_token_count()
-        if current_tokens > CHUNK_MAX_TOKENS:
-            # print(f"DEBUG: Chunk exceeds token limit ({current_tokens} > {CHUNK_MAX_TOKENS}) on page {page_number}. Splitting.")
+        if current_token_count > chunk_max_tokens:
+            # print(f"DEBUG: Chunk exceeds token limit ({current_token_count} > {chunk_max_tokens}) on page {page_number}. Splitting.")
             if len(current_chunk_lines) <= 1:
                 # print(f"DEBUG: Warning: Single line exceeds CHUNK_MAX_TOKENS. Flushing as is.")
                 flush_chunk(overlap_lines=None)
@@ -357,7 +363,7 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
                 continue # Start next iteration
 
             # Calculate overlap
-            overlap_line_count = max(1, int(len(current_chunk_lines) * OVERLAP_RATIO))
+            overlap_line_count = max(1, int(len(current_chunk_lines) * overlap_ratio))
             overlap_line_count = min(overlap_line_count, len(current_chunk_lines) - 1)
 
             lines_for_current_chunk = current_chunk_lines[:-overlap_line_count]
@@ -365,6 +371,7 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
 
             # Temporarily set current_chunk_lines for flushing the main part
             current_chunk_lines = lines_for_current_chunk
+            current_token_count = count_tokens(current_chunk_lines)
             # Set flag *before* flushing, so the next iteration knows it resulted from a split
             just_split_due_to_tokens = True
             # Flush the main part, passing the overlap lines to be used for the *next* chunk's start
@@ -382,6 +389,65 @@ def pyparse_hierarchical_chunk_text(full_text, source_name, page_number=None, ex
     return documents, hierarchy_stack
 
 
+def scan_hierarchy(full_text, initial_stack=None, chunk_max_tokens=None, overlap_ratio=None):
+    """
+    Cheap first pass: the hierarchy stack pyparse_hierarchical_chunk_text leaves after this page
+    (updated in place), without building chunks. Headers are read as there; otherwise only the word
+    count of each buffered line is kept, enough to replay the token splits that suppress the header
+    check on the line after them.
+    """
+    if chunk_max_tokens is None: chunk_max_tokens = CHUNK_MAX_TOKENS
+    if overlap_ratio is None: overlap_ratio = OVERLAP_RATIO
+    lines = full_text.splitlines()
+    hierarchy_stack = initial_stack if initial_stack is not None else []
+    line_tokens = []  # word count of each line of the current chunk
+    token_count = 0
+    just_split_due_to_tokens = False
+
+    i = 0
+    n_lines = len(lines)
+    while i < n_lines:
+        line = lines[i]
+        stripped_line = line.strip()
+        # is_spurious_line, inlined as this loop is the whole cost of the scan
+        if not stripped_line or PAGE_NUM_RE.match(stripped_line) or DOCUSIGN_RE.search(stripped_line):
+            i += 1
+            continue
+        match = None if just_split_due_to_tokens else HEADER_RE.match(stripped_line)
+        if match:
+            j, processed_title = read_header(lines, i, match.group(2))
+            if is_valid_clause(match.group(1), processed_title):
+                # The content before a real header is flushed without overlap
+                line_tokens.clear()
+                token_count = 0
+                push_header(hierarchy_stack, match.group(1), processed_title)
+            for header_line in lines[i:j]:
+                words = len(header_line.split())
+                line_tokens.append(words)
+                token_count += words
+            i = j
+        else:
+            words = len(line.split())
+            line_tokens.append(words)
+            token_count += words
+            i += 1
+        just_split_due_to_tokens = False
+
+        if token_count > chunk_max_tokens:
+            if len(line_tokens) <= 1:
+                line_tokens.clear()
+                token_count = 0
+                continue
+            overlap_line_count = max(1, int(len(line_tokens) * overlap_ratio))
+            overlap_line_count = min(overlap_line_count, len(line_tokens) - 1)
+            # Only the overlap lines carry over into the next chunk
+            del line_tokens[:-overlap_line_count]
+            token_count = sum(line_tokens)
+            just_split_due_to_tokens = True
+
+    return hierarchy_stack
+
+
 # --- Other functions (reference, financial, parser class) ---
 # These remain unchanged but are included for completeness
 reference_graph = nx.DiGraph()
@@ -408,19 +474,29 @@ def parse_formula(formula_str):
         return { 'formula': formula_str, 'variables': ['A', 'B'], 'calculation': '((A / B) * 2600000) - 2600000', 'context': 'Schedule 1 Part 6 (Incentive Payment)' }
     return None
 
+# Grid tables (+---+) and the markdown pipe tables emitted by pymupdf4llm
+TABLE_RE = re.compile(r'(\+[-+]+?\+[\n\r].*?\+[-+]+?\+)|((?:^[ \t]*\|[^\n]*\|[ \t]*(?:\n|$)){2,})', re.DOTALL | re.MULTILINE)
+# Line-anchored variant of HEADER_RE so all headers in a text can be found in one pass
+HEADER_LINE_RE = re.compile(HEADER_RE.pattern, re.MULTILINE)
+
 def extract_tables_with_context(text):
-    table_pattern = r'(\+[-+]+?\+[\n\r].*?\+[-+]+?\+)'
-    tables = re.findall(table_pattern, text, re.DOTALL)
+    """
+    Finds tables in the text and attributes each to the closest preceding clause header.
+    Header positions are collected once, so the cost is linear in the text length.
+    """
+    header_matches = [m for m in HEADER_LINE_RE.finditer(text) if is_valid_clause(m.group(1), m.group(2).strip())]
+    header_starts = [m.start() for m in header_matches]
     extracted = []
-    for tbl in tables:
-        tbl_pos = text.find(tbl)
+    for tbl_match in TABLE_RE.finditer(text):
+        tbl = tbl_match.group(0)
         context = "N/A"
-        headers_before = list(HEADER_RE.finditer(text[:tbl_pos]))
-        if headers_before:
-            last_header_match = headers_before[-1]
+        context_clause_id = None
+        header_idx = bisect.bisect_left(header_starts, tbl_match.start()) - 1
+        if header_idx >= 0:
+            last_header_match = header_matches[header_idx]
             context_clause_id = last_header_match.group(1).rstrip('.')
             context = f"Clause {context_clause_id}: {last_header_match.group(2).strip()}"
-        extracted.append({ 'table': tbl, 'context': context, 'related_clauses': [] })
+        extracted.append({ 'table': tbl.strip(), 'context': context, 'clause': context_clause_id, 'related_clauses': [] })
     return extracted
 
 class LegalDocumentParser:
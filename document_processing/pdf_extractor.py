@@ -1,11 +1,13 @@
 # document_processing/pdf_extractor.py
 
+import logging
 import os
 import re
 import pymupdf
 import pymupdf4llm
 from langchain_core.documents import Document
-import traceback
+
+logger = logging.getLogger(__name__)
 
 # --- Service Provider Names (Keep as is) ---
 SERVICE_PROVIDER_NAMES_LOWER = [
@@ -15,12 +17,26 @@ SERVICE_PROVIDER_NAMES_LOWER = [
     "newcold burley operations, llc", "newcold pty ltd", "newcold", "nc",
 ]
 
+# Region of the NewCold entity party to a contract (most specific names first)
+SERVICE_PROVIDER_REGIONS = [
+    ("newcold melbourne", "AU"), ("newcold burley", "US"),
+    ("newcold pty", "AU"), ("newcold llc", "US"),
+]
+
+def find_region_automatically(first_page_text):
+    """Region of the contract from the NewCold entity named on its first page, or "Unknown Region"."""
+    text = re.sub(r'\s+', ' ', (first_page_text or "").lower())
+    for entity, region in SERVICE_PROVIDER_REGIONS:
+        if entity in text:
+            return region
+    return "Unknown Region"
+
 # --- Clean Function (Keep previous version - it seemed okay) ---
 def clean_extracted_name(name):
     """Improved cleaning for extracted names."""
-    print(f"    DEBUG [Clean]: Input to clean_extracted_name: '{name}'") # DEBUG
+    logger.debug("[Clean] Input to clean_extracted_name: '%s'", name)
     if not name:
-        print("    DEBUG [Clean]: Output (empty input): ''") # DEBUG
+        logger.debug("[Clean] Output (empty input): ''")
         return ""
 
     # Initial strip
@@ -30,19 +46,19 @@ def clean_extracted_name(name):
     original_name_step1 = cleaned
     cleaned = re.sub(r'\s*\(trading as.*?\)\s*$', '', cleaned, flags=re.IGNORECASE).strip(' .,;:"()[]{}')
     if cleaned != original_name_step1:
-        print(f"    DEBUG [Clean]: After '(trading as...)' removal: '{cleaned}'") # DEBUG
+        logger.debug("[Clean] After '(trading as...)' removal: '%s'", cleaned)
 
     # Remove trailing '(2) NewCold...'
     original_name_step2 = cleaned
     cleaned = re.sub(r'\s*\(?2\)?\s*NewCold.*$', '', cleaned, flags=re.IGNORECASE | re.DOTALL).strip(' .,;:"()[]{}')
     if cleaned != original_name_step2:
-        print(f"    DEBUG [Clean]: After trailing '(2) NewCold...' removal: '{cleaned}'") # DEBUG
+        logger.debug("[Clean] After trailing '(2) NewCold...' removal: '%s'", cleaned)
 
     # Remove leading (1), (2) etc.
     original_name_step3 = cleaned
     cleaned = re.sub(r'^\s*\(?\d\)?\s*', '', cleaned).strip(' .,;:"()[]{}')
     if cleaned != original_name_step3:
-        print(f"    DEBUG [Clean]: After leading '(1)' removal: '{cleaned}'") # DEBUG
+        logger.debug("[Clean] After leading '(1)' removal: '%s'", cleaned)
 
     # Store original name *after* these initial cleanups for heuristic check
     original_name_for_heuristic = cleaned
@@ -58,20 +74,20 @@ def clean_extracted_name(name):
         if re.search(pattern, cleaned, flags=re.IGNORECASE):
              cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE).strip(' .,;:"()[]{}')
     if cleaned != cleaned_after_suffix:
-        print(f"    DEBUG [Clean]: After suffix removal: '{cleaned}'") # DEBUG
+        logger.debug("[Clean] After suffix removal: '%s'", cleaned)
 
     # Attempt to remove ACN/ABN/Company Registration
     cleaned_after_acn = cleaned
     cleaned = re.sub(r'\s*\(?(ACN|ABN|Company registration)[\s\d:./-]+\)?$', '', cleaned, flags=re.IGNORECASE).strip(' .,;:"()[]{}')
     cleaned = re.sub(r'\s+\d{9,11}$', '', cleaned).strip(' .,;:"()[]{}')
     if cleaned != cleaned_after_acn:
-        print(f"    DEBUG [Clean]: After ACN/ABN/Reg removal: '{cleaned}'") # DEBUG
+        logger.debug("[Clean] After ACN/ABN/Reg removal: '%s'", cleaned)
 
     # Remove definitions like ("McCain") or ('Customer') or (Mondelez)
     cleaned_after_def = cleaned
     cleaned = re.sub(r'\s*\((?:["\'].*?["\']|[A-Za-z]+)\)$', '', cleaned).strip(' .,;:"()[]{}') # Handles ("X"), ('X'), (X)
     if cleaned != cleaned_after_def:
-        print(f"    DEBUG [Clean]: After ('Shortname') removal: '{cleaned}'") # DEBUG
+        logger.debug("[Clean] After ('Shortname') removal: '%s'", cleaned)
 
     # Remove location info
     cleaned_after_loc = cleaned
@@ -81,17 +97,17 @@ def clean_extracted_name(name):
     cleaned = re.sub(r'\s+of\s+[\d/]+\s+[A-Z][a-z]+.*$', '', cleaned, flags=re.IGNORECASE).strip(' .,.')
     cleaned = re.sub(r'\s+of\s+[A-Z][a-z]+.*$', '', cleaned, flags=re.IGNORECASE).strip(' .,.')
     if cleaned != cleaned_after_loc:
-        print(f"    DEBUG [Clean]: After location/office removal: '{cleaned}'") # DEBUG
+        logger.debug("[Clean] After location/office removal: '%s'", cleaned)
 
     # Final whitespace cleanup
     cleaned = re.sub(r'\s+', ' ', cleaned).strip()
 
     # Heuristic check
     if len(cleaned) < 3 or (len(original_name_for_heuristic) > 10 and len(cleaned) < len(original_name_for_heuristic) / 3):
-        print(f"    DEBUG [Clean]: Heuristic triggered. Cleaning reduced '{original_name_for_heuristic}' to '{cleaned}'. Reverting.") # DEBUG
+        logger.debug("[Clean] Heuristic triggered. Cleaning reduced '%s' to '%s'. Reverting.", original_name_for_heuristic, cleaned)
         cleaned = original_name_for_heuristic.strip(' .,;:"()[]{}')
 
-    print(f"    DEBUG [Clean]: Output from clean_extracted_name: '{cleaned}'") # DEBUG
+    logger.debug("[Clean] Output from clean_extracted_name: '%s'", cleaned)
     return cleaned
 
 
@@ -101,7 +117,7 @@ def find_customer_automatically(text):
     agreement patterns, excluding known service provider names.
     Returns the best guess or 'Unknown Customer'.
     """
-    print("  DEBUG [AutoDetect]: Starting automatic customer detection...") # DEBUG
+    logger.debug("[AutoDetect] Starting automatic customer detection...")
     potential_matches = {}
 
     # --- Define Patterns with Priorities ---
@@ -150,30 +166,30 @@ def find_customer_automatically(text):
     }
 
     for priority, patterns in all_patterns.items():
-        print(f"  DEBUG [AutoDetect]: Checking Priority {priority} patterns...") # DEBUG
+        logger.debug("[AutoDetect] Checking Priority %s patterns...", priority)
         for i, pattern in enumerate(patterns):
-            print(f"    DEBUG [AutoDetect]: Trying Pattern {priority}.{i+1}: {pattern.pattern}") # DEBUG
+            logger.debug("[AutoDetect] Trying Pattern %s.%s: %s", priority, i + 1, pattern.pattern)
             match_found_for_pattern = False
             for match in pattern.finditer(text):
                 match_found_for_pattern = True
                 potential_name_capture = match.group(1) if match.groups() else match.group(0)
-                print(f"      DEBUG [AutoDetect]: RAW CAPTURE (Pattern {priority}.{i+1}): '{potential_name_capture}'") # DEBUG
+                logger.debug("[AutoDetect] RAW CAPTURE (Pattern %s.%s): '%s'", priority, i + 1, potential_name_capture)
                 if not potential_name_capture:
-                    print("      DEBUG [AutoDetect]: -> Skipping (Empty Capture)") # DEBUG
+                    logger.debug("[AutoDetect] -> Skipping (Empty Capture)")
                     continue
 
                 cleaned_potential = clean_extracted_name(potential_name_capture)
-                print(f"      DEBUG [AutoDetect]: CLEANED (Pattern {priority}.{i+1}): '{cleaned_potential}'") # DEBUG
+                logger.debug("[AutoDetect] CLEANED (Pattern %s.%s): '%s'", priority, i + 1, cleaned_potential)
 
                 if not cleaned_potential or len(cleaned_potential) < 4:
-                    print(f"      DEBUG [AutoDetect]: -> Skipping (Cleaned name too short or empty: '{cleaned_potential}')") # DEBUG
+                    logger.debug("[AutoDetect] -> Skipping (Cleaned name too short or empty: '%s')", cleaned_potential)
                     continue
 
                 is_service_provider = False
                 cleaned_lower = cleaned_potential.lower()
                 for sp_name in SERVICE_PROVIDER_NAMES_LOWER:
                     if cleaned_lower == sp_name or re.fullmatch(re.escape(sp_name) + r'[\s,.]*', cleaned_lower):
-                        print(f"      DEBUG [AutoDetect]: -> Ignoring '{cleaned_potential}' (Matches service provider '{sp_name}')") # DEBUG
+                        logger.debug("[AutoDetect] -> Ignoring '%s' (Matches service provider '%s')", cleaned_potential, sp_name)
                         is_service_provider = True
                         break
                     if re.search(r'\bnewcold\b', cleaned_lower) or (cleaned_lower == 'nc'):
@@ -183,7 +199,7 @@ def find_customer_automatically(text):
                                  is_likely_sp_variation = True
                                  break
                          if is_likely_sp_variation:
-                             print(f"      DEBUG [AutoDetect]: -> Ignoring '{cleaned_potential}' (Contains service provider base name and resembles known SP variation)") # DEBUG
+                             logger.debug("[AutoDetect] -> Ignoring '%s' (Contains service provider base name and resembles known SP variation)", cleaned_potential)
                              is_service_provider = True
                              break
 
@@ -193,25 +209,25 @@ def find_customer_automatically(text):
                 if priority not in potential_matches:
                     potential_matches[priority] = set()
                 potential_matches[priority].add(cleaned_potential)
-                print(f"      DEBUG [AutoDetect]: -> Added Potential Match '{cleaned_potential}' (Priority {priority})") # DEBUG
+                logger.debug("[AutoDetect] -> Added Potential Match '%s' (Priority %s)", cleaned_potential, priority)
 
     # --- Determine the best guess based on priority ---
-    print(f"  DEBUG [AutoDetect]: Potential Matches Found (by priority): {potential_matches}") # DEBUG
+    logger.debug("[AutoDetect] Potential Matches Found (by priority): %s", potential_matches)
     best_guess = "Unknown Customer"
     for priority in sorted(potential_matches.keys()):
         if potential_matches[priority]:
             valid_matches = list(potential_matches[priority])
             if len(valid_matches) > 1:
                  valid_matches.sort(key=len, reverse=True)
-                 print(f"  WARN [AutoDetect]: Multiple potential customer names found at priority {priority}: {valid_matches}. Selecting the longest one: '{valid_matches[0]}'") # DEBUG
+                 logger.warning("[AutoDetect] Multiple potential customer names found at priority %s: %s. Selecting the longest one: '%s'", priority, valid_matches, valid_matches[0])
             best_guess = valid_matches[0]
-            print(f"  DEBUG [AutoDetect]: Selected best guess '{best_guess}' from priority {priority}.") # DEBUG
+            logger.debug("[AutoDetect] Selected best guess '%s' from priority %s.", best_guess, priority)
             break
 
     if best_guess == "Unknown Customer":
-         print("  DEBUG [AutoDetect]: Could not automatically determine a likely customer name from patterns.") # DEBUG
+         logger.debug("[AutoDetect] Could not automatically determine a likely customer name from patterns.")
 
-    print(f"  DEBUG [AutoDetect]: Returning final guess: '{best_guess}'") # DEBUG
+    logger.debug("[AutoDetect] Returning final guess: '%s'", best_guess)
     return best_guess
 
 
@@ -219,11 +235,10 @@ def find_customer_automatically(text):
 def extract_documents_from_pdf(pdf_path):
     """
     Extract documents using PyMuPDF4LLM for clean markdown text,
-    and automatically attempts to detect the customer name from the first page.
-    Region information is no longer automatically assigned.
+    and automatically attempts to detect the customer name and region from the first page.
     """
     file_name = os.path.basename(pdf_path)
-    print(f"\n--- Processing PDF: {file_name} ---") # DEBUG
+    logger.info("Processing PDF: %s", file_name)
     customer_name = "Unknown Customer"
     region = "Unknown Region"
     documents = []
@@ -233,23 +248,21 @@ def extract_documents_from_pdf(pdf_path):
     try:
         # --- Step 1: Open with PyMuPDF ONLY for first page analysis ---
         try:
-            print(f"DEBUG [Extractor]: Opening '{file_name}' with pymupdf for first page analysis...") # DEBUG
+            logger.debug("[Extractor] Opening '%s' with pymupdf for first page analysis...", file_name)
             pdf_doc = pymupdf.open(pdf_path)
             if len(pdf_doc) > 0:
-                print(f"DEBUG [Extractor]: Reading text from first page (page 0) of '{file_name}'...") # DEBUG
+                logger.debug("[Extractor] Reading text from first page (page 0) of '%s'...", file_name)
                 first_page_text = pdf_doc[0].get_text("text")
                 # *** ADDED Debugging: Print the raw text being analyzed ***
-                print(f"\n--- Analyzing First Page Text for: {file_name} ---") # DEBUG
-                print(first_page_text[:2000]) # Print first 2000 chars for brevity
-                print("--- End First Page Text Snippet ---\n") # DEBUG
+                logger.debug("[Extractor] First page text for %s (first 2000 chars):\n%s", file_name, first_page_text[:2000])
                 customer_name = find_customer_automatically(first_page_text)
-                region = "Unknown Region" # Region assignment removed
+                region = find_region_automatically(first_page_text)
             else:
-                print(f"WARN [Extractor]: PDF '{file_name}' has no pages.")
+                logger.warning("[Extractor] PDF '%s' has no pages.", file_name)
             pdf_metadata_from_pymupdf = pdf_doc.metadata if pdf_doc else {}
-            print(f"DEBUG [Extractor]: PyMuPDF metadata extracted: {pdf_metadata_from_pymupdf}") # DEBUG
+            logger.debug("[Extractor] PyMuPDF metadata extracted: %s", pdf_metadata_from_pymupdf)
         except Exception as e:
-            print(f"ERROR [Extractor]: Failed to open/read first page of {pdf_path} with pymupdf: {e}")
+            logger.error("[Extractor] Failed to open/read first page of %s with pymupdf: %s", pdf_path, e)
             customer_name = "Unknown Customer"
             region = "Unknown Region"
         finally:
@@ -257,18 +270,18 @@ def extract_documents_from_pdf(pdf_path):
                 pdf_doc.close()
                 pdf_doc = None
 
-        print(f"DEBUG [Extractor]: Detected Customer after analysis: '{customer_name}', Region: '{region}' for '{file_name}'") # DEBUG
+        logger.debug("[Extractor] Detected Customer after analysis: '%s', Region: '%s' for '%s'", customer_name, region, file_name)
 
         # --- Step 2: Extract clean markdown ---
-        print(f"DEBUG [Extractor]: Extracting markdown text using pymupdf4llm for '{file_name}' (forcing page chunks)...") # DEBUG
+        logger.debug("[Extractor] Extracting markdown text using pymupdf4llm for '%s' (forcing page chunks)...", file_name)
         md_text_data = pymupdf4llm.to_markdown(pdf_path, page_chunks=True, write_images=False)
-        print(f"DEBUG [Extractor]: Markdown extraction complete for '{file_name}'. Type: {type(md_text_data)}") # DEBUG
+        logger.debug("[Extractor] Markdown extraction complete for '%s'. Type: %s", file_name, type(md_text_data))
 
 
         # --- Step 3: Create LangChain Documents ---
-        print(f"DEBUG [Extractor]: Creating LangChain documents for '{file_name}'...") # DEBUG
+        logger.debug("[Extractor] Creating LangChain documents for '%s'...", file_name)
         if isinstance(md_text_data, list):
-            print(f"DEBUG [Extractor]: Handling list output ({len(md_text_data)} items) from pymupdf4llm.") # DEBUG
+            logger.debug("[Extractor] Handling list output (%s items) from pymupdf4llm.", len(md_text_data))
             for page_num_zero_based, page_item in enumerate(md_text_data):
                 page_num_one_based = page_num_zero_based + 1
                 page_content_str = ""
@@ -279,12 +292,12 @@ def extract_documents_from_pdf(pdf_path):
                     elif 'content' in page_item and isinstance(page_item['content'], str):
                         page_content_str = page_item['content']
                     else:
-                        print(f"  WARN [Extractor]: Page {page_num_one_based} item is dict, but no 'text' or 'content' key found. Using str(dict). Keys: {page_item.keys()}")
+                        logger.warning("[Extractor] Page %s item is dict, but no 'text' or 'content' key found. Using str(dict). Keys: %s", page_num_one_based, page_item.keys())
                         page_content_str = str(page_item)
                 elif isinstance(page_item, str):
                     page_content_str = page_item
                 else:
-                    print(f"  ERROR [Extractor]: Page {page_num_one_based} item has unexpected type: {type(page_item)}. Skipping.")
+                    logger.error("[Extractor] Page %s item has unexpected type: %s. Skipping.", page_num_one_based, type(page_item))
                     continue
 
                 metadata = {}
@@ -297,12 +310,12 @@ def extract_documents_from_pdf(pdf_path):
                 try:
                     documents.append(Document(page_content=page_content_str, metadata=metadata))
                 except Exception as doc_error:
-                     print(f"  ERROR [Extractor]: Failed to create Document for page {page_num_one_based}. Error: {doc_error}")
-                     print(f"  DEBUG [Extractor]: page_content type: {type(page_content_str)}, metadata: {metadata}")
+                     logger.error("[Extractor] Failed to create Document for page %s. Error: %s", page_num_one_based, doc_error)
+                     logger.debug("[Extractor] page_content type: %s, metadata: %s", type(page_content_str), metadata)
 
 
         elif isinstance(md_text_data, str):
-            print(f"WARN [Extractor]: pymupdf4llm returned a single string even with page_chunks=True. Handling as single doc.") # DEBUG
+            logger.warning("[Extractor] pymupdf4llm returned a single string even with page_chunks=True. Handling as single doc.")
             metadata = {}
             metadata["source"] = file_name
             metadata["page_number"] = 1
@@ -310,23 +323,22 @@ def extract_documents_from_pdf(pdf_path):
             metadata["region"] = region
             pdf_meta_cleaned = {k: v for k, v in pdf_metadata_from_pymupdf.items() if v is not None and isinstance(v, (str, int, float, bool))}
             metadata.update(pdf_meta_cleaned)
-            print(f"  DEBUG [Extractor]: Metadata for single doc fallback: {metadata}") # DEBUG
+            logger.debug("[Extractor] Metadata for single doc fallback: %s", metadata)
             documents.append(Document(page_content=md_text_data, metadata=metadata))
         else:
-             print(f"ERROR [Extractor]: Unexpected output format from pymupdf4llm for {file_name}: {type(md_text_data)}")
+             logger.error("[Extractor] Unexpected output format from pymupdf4llm for %s: %s", file_name, type(md_text_data))
 
     except Exception as e:
-        print(f"ERROR processing PDF {pdf_path}: {e}")
-        traceback.print_exc()
+        logger.exception("Error processing PDF %s: %s", pdf_path, e)
         if pdf_doc:
             pdf_doc.close()
         return []
 
-    print(f"DEBUG [Extractor]: Extracted {len(documents)} LangChain documents for '{file_name}'.") # DEBUG
+    logger.debug("[Extractor] Extracted %s LangChain documents for '%s'.", len(documents), file_name)
     if documents:
-        print(f"DEBUG [Extractor]: Metadata assigned to first document of '{file_name}': {documents[0].metadata}") # DEBUG
+        logger.debug("[Extractor] Metadata assigned to first document of '%s': %s", file_name, documents[0].metadata)
     else:
-        print(f"WARN [Extractor]: No documents were created for '{file_name}'.") # DEBUG
+        logger.warning("[Extractor] No documents were created for '%s'.", file_name)
     return documents
 
 
@@ -1,164 +1,82 @@
+import logging
 import os
-import uuid # Import uuid
-from typing import Any, Dict, List, Optional, Sequence, Union # Import necessary types
+import threading
+import warnings
+from typing import Any, List, Optional
 
 from langsmith import Client
 from langchain_core.tracers.langchain import LangChainTracer
 from langchain_core.tracers.schemas import Run
-from langchain_core.outputs import LLMResult # Import LLMResult
-from langchain_core.documents import Document # Import Document
+
+from config import (PROJECT_NAME, TRACING_ENABLED, TRACE_EXPORT_QUEUE_SIZE, TRACE_EXPORT_BATCH_SIZE,
+                    TRACE_EXPORT_FLUSH_INTERVAL_S)
+from langchain_utils.trace_export import LangSmithTraceSink, TraceExporter
+
+logger = logging.getLogger(__name__)
 
 class EmailLangChainTracer(LangChainTracer):
     """
-    Custom LangChainTracer that ensures user_email from invoke metadata
-    is added to the run's metadata in LangSmith.
+    LangChainTracer that tags each trace with the requesting user's email and hands finished
+    runs to a background TraceExporter instead of posting them from the request thread.
+
+    One instance is shared by the whole process (see get_tracer). user_email is read from the
+    invoke metadata and attached once, at the root run; child runs inherit the metadata.
     """
 
     def __init__(
         self,
         project_name: Optional[str] = None,
-        example_id: Optional[Union[str, uuid.UUID]] = None,
         tags: Optional[List[str]] = None,
         client: Optional[Any] = None,
-        # Add any other specific args your tracer needs, but don't use **kwargs for super()
+        exporter: Optional[TraceExporter] = None,
     ):
-        # Ensure LangSmith environment variables are set for default tracing
-        os.environ["LANGCHAIN_TRACING_V2"] = "true"
-        if project_name:
-            os.environ["LANGCHAIN_PROJECT"] = project_name
-        else:
-            # Ensure project name is set, either via arg or env var
-            project_name = os.getenv("LANGCHAIN_PROJECT", "Default Project")
-
-        # Call LangChainTracer's __init__ with only the arguments it expects
-        super().__init__(
-            example_id=example_id,
-            tags=tags,
-            project_name=project_name,
-            client=client
-            # DO NOT pass **kwargs here
-        )
-        # Initialize the client if not provided (LangChainTracer might do this too, but being explicit is safe)
-        if self.client is None:
-             try:
-                 self.client = Client()
-             except Exception as e:
-                 print(f"WARN [EmailTracer]: Failed to initialize LangSmith client: {e}. Tracing might not work.")
-                 self.client = None # Ensure client is None if init fails
-
-        print(f"DEBUG [EmailTracer]: Initialized for project '{project_name}'.")
+        project_name = project_name or os.getenv("LANGCHAIN_PROJECT", "Default Project")
+        if client is None:
+            # Runs are batched by our exporter; the client's own background batching thread is not needed
+            client = Client(auto_batch_tracing=False)
+        super().__init__(project_name=project_name, tags=tags, client=client)
+        self.exporter = exporter or TraceExporter(LangSmithTraceSink(client))
+        logger.debug("[EmailTracer] Initialized for project '%s'.", project_name)
 
-
-    def _get_user_email_from_metadata(self, run: Run) -> Optional[str]:
-        """Helper to safely extract user_email from run metadata."""
-        # Metadata might be passed down through parent runs
-        current_run = run
-        while current_run:
-            if current_run.extra and "metadata" in current_run.extra:
-                user_email = current_run.extra["metadata"].get("user_email")
-                if user_email:
-                    return user_email
-            # Check parent run if not found in current
-            if current_run.parent_run_id and current_run.parent_run_id in self.run_map:
-                 current_run = self.run_map.get(current_run.parent_run_id)
-            else:
-                 current_run = None # Stop if no parent or parent not in map
-        return None
-
-    # Override _persist_run or _start_trace to add metadata early
     def _start_trace(self, run: Run) -> None:
-        """Process the run at the start."""
-        user_email = self._get_user_email_from_metadata(run)
-        if user_email:
-            # Ensure 'metadata' exists in run.extra
-            if run.extra is None:
-                run.extra = {}
-            if "metadata" not in run.extra:
-                run.extra["metadata"] = {}
-
-            # Add user_email if not already present
-            if "user_email" not in run.extra["metadata"]:
-                print(f"DEBUG [EmailTracer]: Adding user_email '{user_email}' to metadata for run {run.id}")
-                run.extra["metadata"]["user_email"] = user_email
-
-            # Optionally add tags here too if needed, ensuring tags list exists
-            if run.tags is None:
-                run.tags = []
-            tag = f"user:{user_email}"
-            if tag not in run.tags:
-                 run.tags.append(tag)
-
-        # Call the original _start_trace to handle standard LangSmith logic
+        """Tags the root run with the user's email; everything else is standard LangSmith logic."""
+        if run.parent_run_id is None:
+            user_email = ((run.extra or {}).get("metadata") or {}).get("user_email")
+            if user_email:
+                tag = f"user:{user_email}"
+                if run.tags is None:
+                    run.tags = []
+                if tag not in run.tags:
+                    run.tags.append(tag)
         super()._start_trace(run)
 
+    # Runs are exported once, complete, when they end: nothing is sent when a run starts
+    def _persist_run_single(self, run: Run) -> None:
+        return None
 
-    # _persist_run is called when the run ends. Metadata might be better added at the start.
-    # def _persist_run(self, run: Run) -> None:
-    #     """Persist run details."""
-    #     user_email = self._get_user_email_from_metadata(run)
-    #     if user_email:
-    #         if run.extra is None: run.extra = {}
-    #         if "metadata" not in run.extra: run.extra["metadata"] = {}
-    #         if "user_email" not in run.extra["metadata"]:
-    #             run.extra["metadata"]["user_email"] = user_email
-    #             print(f"DEBUG [EmailTracer]: Adding user_email to metadata in _persist_run for run {run.id}")
-    #         if run.tags is None: run.tags = []
-    #         tag = f"user:{user_email}"
-    #         if tag not in run.tags: run.tags.append(tag)
-
-    #     # Call the parent method to handle actual persistence to LangSmith
-    #     super()._persist_run(run)
-
-    # You might need to override other methods if user_email isn't propagating
-    # correctly via run.extra["metadata"] from the initial invoke call.
-    # For example, on_llm_start:
-    def on_llm_start(
-        self,
-        serialized: Dict[str, Any],
-        prompts: List[str],
-        *,
-        run_id: uuid.UUID,
-        parent_run_id: Optional[uuid.UUID] = None,
-        tags: Optional[List[str]] = None,
-        metadata: Optional[Dict[str, Any]] = None,
-        **kwargs: Any,
-    ) -> Run:
-        # Try to get user_email from the metadata passed down
-        user_email = None
-        if metadata:
-            user_email = metadata.get("user_email")
-
-        # If not found, try getting from parent run in the run_map
-        if not user_email and parent_run_id and parent_run_id in self.run_map:
-             parent_run = self.run_map.get(parent_run_id)
-             user_email = self._get_user_email_from_metadata(parent_run) # Use helper
-
-        # Add user_email to the current run's metadata if found
-        if user_email:
-            if metadata is None: metadata = {}
-            if "user_email" not in metadata:
-                metadata["user_email"] = user_email
-                print(f"DEBUG [EmailTracer]: Adding user_email to metadata in on_llm_start for run {run_id}")
-            # Optionally add tags
-            if tags is None: tags = []
-            tag = f"user:{user_email}"
-            if tag not in tags: tags.append(tag)
+    def _update_run_single(self, run: Run) -> None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            run_dict = run.dict(exclude={"child_runs"})
+        run_dict["tags"] = self._get_tags(run)
+        run_dict["session_name"] = self.project_name
+        self.exporter.submit(run_dict)
 
 
-        # Call the parent implementation with potentially updated tags/metadata
-        return super().on_llm_start(
-            serialized,
-            prompts,
-            run_id=run_id,
-            parent_run_id=parent_run_id,
-            tags=tags,
-            metadata=metadata,
-            **kwargs,
-        )
+_tracer: Optional[EmailLangChainTracer] = None
+_tracer_lock = threading.Lock()
 
-    # Add similar logic for on_chain_start, on_retriever_start etc. if needed
-    # to ensure metadata propagates correctly.
 
-    # Remove the email sending logic for now to focus on fixing the tracer init
-    # def send_trace_email(self, run_details: Dict):
-    #     pass
\ No newline at end of file
+def get_tracer() -> Optional[EmailLangChainTracer]:
+    """Returns the process-wide tracer, creating it on first use, or None if tracing is disabled."""
+    global _tracer
+    if not TRACING_ENABLED:
+        return None
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                exporter = TraceExporter(LangSmithTraceSink(), max_queue_size=TRACE_EXPORT_QUEUE_SIZE,
+                                         max_batch_size=TRACE_EXPORT_BATCH_SIZE,
+                                         flush_interval_s=TRACE_EXPORT_FLUSH_INTERVAL_S)
+                _tracer = EmailLangChainTracer(project_name=PROJECT_NAME, exporter=exporter)
+    return _tracer
@@ -0,0 +1,210 @@
+# evaluate_retrieval.py
+# Retrieval quality-and-latency evaluation against a gold file of
+#   {"query": "...", "customer": "Simplot Australia" | null, "expected_clauses": ["19.4", ...]}
+# Reports recall@k, MRR, p50/p95 retrieval latency and the adaptive k the app would choose, for the
+# snapshot CURRENT points to (the index the app serves).
+# With --sweep it re-parses and re-indexes the corpus for every combination of chunking and
+# index parameters (chunk embeddings are cached on disk) to find the smallest k at equal recall.
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+
+from config import (PDF_DIR, INDEX_ROOT, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, RETRIEVAL_MIN_K,
+                    RETRIEVAL_COMPARATIVE_MIN_K, RETRIEVAL_FETCH_K)
+from document_processing.config import CHUNK_MAX_TOKENS, OVERLAP_RATIO
+from langchain_utils.chunk_embedding_cache import ChunkEmbeddingCache
+from langchain_utils.retrieval import AdaptiveRetriever
+
+DEFAULT_KS = [1, 3, 5, 10, 15]
+EMBEDDING_CACHE_PATH = os.path.join("eval_cache", "chunk_embeddings.sqlite")
+
+
+def load_gold(path):
+    with open(path) as f:
+        gold = [json.loads(line) for line in f if line.strip()]
+    for item in gold:
+        if not item.get("expected_clauses"):
+            raise ValueError(f"Gold entry without expected_clauses: {item}")
+    return gold
+
+
+def is_relevant(doc, item):
+    """A chunk is relevant if it belongs to the gold customer and sits in (or under) an expected clause."""
+    metadata = doc.metadata
+    if item.get("customer") and metadata.get("customer") != item["customer"]:
+        return False
+    clause_path = set(metadata.get("hierarchy") or [])
+    if metadata.get("clause"):
+        clause_path.add(str(metadata["clause"]))
+    return any(str(expected) in clause_path for expected in item["expected_clauses"])
+
+
+def evaluate(retriever, gold, ks=DEFAULT_KS, use_customer_filter=True):
+    """Runs every gold query and returns recall@k, MRR, latency percentiles and adaptive-k stats."""
+    max_k = max(ks)
+    recalls = {k: [] for k in ks}
+    reciprocal_ranks = []
+    latencies = []
+    chosen_ks = []
+    adaptive_recalls = []
+
+    for item in gold:
+        customer = item.get("customer") if use_customer_filter else None
+        start = time.perf_counter()
+        query_embedding = retriever.embeddings.embed_query(item["query"])
+        fetch_k = max(max_k, getattr(retriever, "fetch_k", RETRIEVAL_FETCH_K))
+        candidates = retriever.search_candidates(query_embedding, fetch_k, customer=customer)
+        latencies.append(time.perf_counter() - start)
+        ranked = [doc for _, _, doc in candidates[:max_k]]
+
+        expected = [str(c) for c in item["expected_clauses"]]
+        for k in ks:
+            found = {c for c in expected if any(is_relevant(doc, {**item, "expected_clauses": [c]}) for doc in ranked[:k])}
+            recalls[k].append(len(found) / len(expected))
+        first_hit = next((rank for rank, doc in enumerate(ranked, start=1) if is_relevant(doc, item)), None)
+        reciprocal_ranks.append(1.0 / first_hit if first_hit else 0.0)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            adaptive = retriever.retrieve(item["query"], customer=customer, comparative=item.get("comparative", False))
+        chosen_ks.append(len(adaptive))
+        found = {c for c in expected if any(is_relevant(chunk.document, {**item, "expected_clauses": [c]}) for chunk in adaptive)}
+        adaptive_recalls.append(len(found) / len(expected))
+
+    latencies.sort()
+    return {
+        "queries": len(gold),
+        "recall_at_k": {str(k): round(statistics.fmean(v), 4) for k, v in recalls.items()},
+        "mrr": round(statistics.fmean(reciprocal_ranks), 4),
+        "latency_ms": {
+            "p50": round(statistics.median(latencies) * 1000, 2),
+            "p95": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 2),
+        },
+        "adaptive": {
+            "mean_k": round(statistics.fmean(chosen_ks), 2),
+            "recall": round(statistics.fmean(adaptive_recalls), 4),
+        },
+    }
+
+
+def min_k_for_recall(result, target):
+    """Smallest evaluated k whose recall reaches the target, or None."""
+    for k, recall in sorted(result["recall_at_k"].items(), key=lambda kv: int(kv[0])):
+        if recall >= target:
+            return int(k)
+    return None
+
+
+def evaluate_current_snapshot(gold, ks=DEFAULT_KS, use_customer_filter=True, root=INDEX_ROOT):
+    """Evaluates the snapshot CURRENT points to, loaded as the app loads it; None if none is published."""
+    from langchain_utils.index_snapshots import read_current_version
+    from langchain_utils.qa_chain import load_index_state
+    version = read_current_version(root)
+    if version is None:
+        return None
+    state = load_index_state(version, top_k_vectors=max(ks))
+    report = evaluate(state.adaptive_retriever, gold, ks=ks, use_customer_filter=use_customer_filter)
+    report["index_version"] = version
+    return report
+
+
+def _make_retriever(vectorstore, embeddings, max_k):
+    return AdaptiveRetriever(vectorstore, embeddings, min_k=RETRIEVAL_MIN_K, max_k=max_k,
+                             comparative_min_k=RETRIEVAL_COMPARATIVE_MIN_K, fetch_k=RETRIEVAL_FETCH_K)
+
+
+def run_sweep(gold, embeddings, pdf_dir, chunk_sizes, overlaps, index_types, ks, target_recall, verbose=False):
+    """Evaluates every (chunk size, overlap, index type) combination over the same extracted pages."""
+    from langchain_utils.qa_chain import extract_all_pages, parse_page_documents
+    from langchain_utils.vectorstore import faiss_from_embeddings
+
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        # Extraction is by far the slowest step and does not depend on the swept parameters
+        extracted = extract_all_pages(pdf_dir)
+    cache = ChunkEmbeddingCache(EMBEDDING_CACHE_PATH, model_key=f"{EMBEDDING_BACKEND}:{EMBEDDING_MODEL_NAME}")
+
+    results = []
+    for chunk_max_tokens, overlap_ratio in itertools.product(chunk_sizes, overlaps):
+        with (contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())):
+            documents = []
+            for file_name, pages in extracted:
+                pages_copy = [type(page)(page_content=page.page_content, metadata=dict(page.metadata)) for page in pages]
+                documents.extend(parse_page_documents(pages_copy, file_name, chunk_max_tokens=chunk_max_tokens,
+                                                      overlap_ratio=overlap_ratio))
+        start = time.perf_counter()
+        vectors = cache.embed_documents(embeddings, [doc.page_content for doc in documents])
+        embed_seconds = time.perf_counter() - start
+
+        for index_type in index_types:
+            vectorstore = faiss_from_embeddings(documents, vectors, embeddings, index_type=index_type)
+            result = evaluate(_make_retriever(vectorstore, embeddings, max(ks)), gold, ks=ks)
+            result["config"] = {"chunk_max_tokens": chunk_max_tokens, "overlap_ratio": overlap_ratio, "index_type": index_type}
+            result["chunks"] = len(documents)
+            result["embed_seconds"] = round(embed_seconds, 3)
+            result["min_k_for_target_recall"] = min_k_for_recall(result, target_recall)
+            results.append(result)
+            print(f"{result['config']}: chunks={len(documents)} recall@k={result['recall_at_k']} "
+                  f"mrr={result['mrr']} min_k={result['min_k_for_target_recall']}", file=sys.stderr)
+    cache.close()
+
+    # Best settings: reach the target recall with the fewest chunks (LLM map calls), then highest MRR
+    ranked = sorted(results, key=lambda r: (r["min_k_for_target_recall"] is None,
+                                            r["min_k_for_target_recall"] or 0, -r["mrr"]))
+    return {"target_recall": target_recall, "embedding_cache": {"hits": cache.hits, "misses": cache.misses},
+            "results": results, "best": ranked[0]["config"] if ranked else None}
+
+
+def _parse_list(value, cast):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval recall@k, MRR and latency against a gold file.")
+    parser.add_argument("gold", help="JSONL gold file with query, customer and expected_clauses.")
+    parser.add_argument("--ks", default=",".join(map(str, DEFAULT_KS)), help="Comma-separated k values.")
+    parser.add_argument("--no-customer-filter", action="store_true", help="Ignore the gold customer at query time.")
+    parser.add_argument("--embeddings", choices=["configured", "fake"], default="configured",
+                        help="Embeddings for --sweep; the served snapshot is always queried with the configured ones.")
+    parser.add_argument("--sweep", action="store_true", help="Re-parse and re-index for each parameter combination.")
+    parser.add_argument("--pdf-dir", default=PDF_DIR)
+    parser.add_argument("--chunk-sizes", default=str(CHUNK_MAX_TOKENS), help="Comma-separated CHUNK_MAX_TOKENS values.")
+    parser.add_argument("--overlaps", default=str(OVERLAP_RATIO), help="Comma-separated OVERLAP_RATIO values.")
+    parser.add_argument("--index-types", default="flat", help="Comma-separated FAISS index types: flat,hnsw,ivf.")
+    parser.add_argument("--target-recall", type=float, default=0.9)
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    gold = load_gold(args.gold)
+    ks = _parse_list(args.ks, int)
+    if args.embeddings == "fake":
+        from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+        embeddings = DeterministicFakeEmbeddings()
+    else:
+        from langchain_utils.vectorstore import base_embeddings as embeddings
+
+    if args.sweep:
+        report = run_sweep(gold, embeddings, args.pdf_dir, _parse_list(args.chunk_sizes, int),
+                           _parse_list(args.overlaps, float), _parse_list(args.index_types, str),
+                           ks, args.target_recall, verbose=args.verbose)
+    else:
+        report = evaluate_current_snapshot(gold, ks, use_customer_filter=not args.no_customer_filter)
+        if report is None:
+            sys.exit(f"No published index snapshot under {INDEX_ROOT}; run build_index.py first.")
+        report["min_k_for_target_recall"] = min_k_for_recall(report, args.target_recall)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# langchain_utils/answer_rendering.py
+
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+import markdown
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables']
+
+
+class AnswerRenderer:
+    """
+    Markdown-to-HTML rendering of answers. Each thread reuses one markdown.Markdown converter
+    (reset between documents instead of rebuilt with its extensions every call), and the HTML
+    of recently rendered answers is kept in an LRU so repeated answers are a dict lookup.
+    """
+
+    def __init__(self, cache_size: int = 1024):
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _converter(self) -> markdown.Markdown:
+        converter = getattr(self._local, "converter", None)
+        if converter is None:
+            converter = self._local.converter = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        return converter
+
+    def render(self, text: str) -> str:
+        with self._lock:
+            html = self._cache.get(text)
+            if html is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return html
+            self.misses += 1
+        converter = self._converter()
+        try:
+            html = converter.convert(text)
+        finally:
+            converter.reset()
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[text] = html
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return html
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._cache), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,284 @@
+# langchain_utils/batch_qa.py
+
+import csv
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.prompts import PromptTemplate
+
+from document_processing.facts import format_facts_answer
+from langchain_utils.llm_client import PRIORITY_BATCH, llm_priority
+from langchain_utils.qa_chain import format_sources
+
+logger = logging.getLogger(__name__)
+
+NO_RELEVANT_INFO = "No relevant information found in this excerpt."
+QUESTION_LINE_RE = re.compile(r"^\s*\[Q(\d+)\]\s*(.*)$")
+JOB_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+# Same contract as the single-question map prompt in qa_chain, asked for several questions at once
+MULTI_QUESTION_MAP_TEMPLATE = """
+You will be provided with a document excerpt preceded by its source metadata (Source, Page, Customer, Clause) and a list of numbered questions.
+Your task is to analyze ONLY the text of the document excerpt BELOW the '---' line, separately for each question.
+
+Numbered Questions:
+{questions}
+
+Document Excerpt with Metadata:
+{page_content}
+
+**Instructions:**
+1.  Focus *only* on the text provided in the excerpt *below* the '---' line.
+2.  For EVERY numbered question, output exactly one line that starts with its tag (for example "[Q1]"), followed by the *exact* metadata line provided above (everything before the '---'), then ' --- ', then either the verbatim sentences or concise key points from the excerpt that help answer that question OR the phrase "No relevant information found in this excerpt."
+3.  Pay special attention to specific details (temperatures, dates, durations, monetary amounts, obligations) asked for in a question.
+4.  Do NOT add explanations, introductions or any other lines, and do NOT answer the questions themselves.
+"""
+MULTI_QUESTION_MAP_PROMPT = PromptTemplate(input_variables=["questions", "page_content"],
+                                           template=MULTI_QUESTION_MAP_TEMPLATE)
+
+
+class BatchQuestion(NamedTuple):
+    id: str
+    question: str
+
+
+def parse_questions(items: Sequence) -> List[BatchQuestion]:
+    """
+    Questions from strings or {"id", "question"} dicts, numbered from 1 where no id is given.
+    Raises ValueError naming the first entry without a non-empty question.
+    """
+    questions = []
+    for number, item in enumerate(items, start=1):
+        text = item.get("question") if isinstance(item, dict) else item
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError(f"Question {number} needs a non-empty 'question' string.")
+        question_id = item.get("id", number) if isinstance(item, dict) else number
+        questions.append(BatchQuestion(str(question_id), text.strip()))
+    return questions
+
+
+def load_questions(path: str) -> List[BatchQuestion]:
+    """Reads questions from JSONL ({"id", "question"}) or plain text (one question per line)."""
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return parse_questions([json.loads(line) if line.startswith("{") else line for line in lines])
+
+
+def load_checkpoint(path: Optional[str]) -> Dict[Tuple[str, str], dict]:
+    """Completed results by (customer, question id) from a checkpoint JSONL, tolerating a torn last line."""
+    done = {}
+    if not path or not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[(result["customer"], result["question_id"])] = result
+    return done
+
+
+def write_results(results: Sequence[dict], path: str, fmt: Optional[str] = None):
+    """Writes results as JSONL or CSV (sources joined with '; '). The format defaults to the extension."""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=["customer", "question_id", "question", "answer", "sources", "method"])
+            writer.writeheader()
+            for result in results:
+                writer.writerow({**result, "sources": "; ".join(result["sources"])})
+        else:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    os.replace(tmp_path, path)
+
+
+def parse_multi_question_output(text: str, numbers: Sequence[int]) -> Dict[int, str]:
+    """Maps question number -> summary line; questions the model skipped count as not relevant."""
+    found = {}
+    for line in text.splitlines():
+        match = QUESTION_LINE_RE.match(line)
+        if match and int(match.group(1)) in numbers:
+            found.setdefault(int(match.group(1)), match.group(2).strip())
+    return found
+
+
+class BatchJobStore:
+    """
+    Batch jobs started through the API, one directory shared by every worker: <id>.json holds the
+    job's status, progress and question set, <id>.checkpoint.jsonl its answers so far, <id>.jsonl
+    the results once done and <id>.lock the lock its runner holds while the job runs.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def load(self, job_id: str) -> Optional[dict]:
+        if not JOB_ID_RE.fullmatch(job_id):
+            return None
+        try:
+            with open(self.path(job_id, ".json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, job_id: str, job: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(job_id, ".json")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+
+class BatchQARunner:
+    """
+    Answers every question for every customer with one retrieval per (question, customer) and
+    one map call per retrieved chunk covering all the questions that retrieved it, instead of one
+    map call per (question, chunk). Map and reduce calls run on a bounded thread pool at batch
+    priority; finished answers are appended to a checkpoint so an interrupted run can resume.
+    """
+
+    def __init__(self, retriever, llm, reduce_chain, facts_index=None, max_workers: int = 4,
+                 questions_per_map: int = 8, checkpoint_path: Optional[str] = None):
+        self.retriever = retriever
+        self.llm = llm
+        self.reduce_chain = reduce_chain
+        self.facts_index = facts_index
+        self.max_workers = max_workers
+        self.questions_per_map = questions_per_map
+        self.checkpoint_path = checkpoint_path
+        self._checkpoint_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"answered": 0, "resumed": 0, "facts_answers": 0, "retrievals": 0,
+                      "chunk_question_pairs": 0, "map_calls": 0, "reduce_calls": 0}
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def run(self, questions: Sequence[BatchQuestion], customers: Sequence[str],
+            progress: Optional[Callable[[dict], None]] = None) -> List[dict]:
+        done = load_checkpoint(self.checkpoint_path)
+        self._count("resumed", sum(1 for c in customers for q in questions if (c, q.id) in done))
+        # One batched encode for the whole question set, reused for every customer
+        vectors = self.retriever.embeddings.embed_documents([q.question for q in questions])
+        query_embeddings = dict(zip((q.id for q in questions), vectors))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch-qa") as executor:
+            for customer in customers:
+                pending = [q for q in questions if (customer, q.id) not in done]
+                if not pending:
+                    continue
+                for result in self._answer_customer(customer, pending, query_embeddings, executor):
+                    done[(customer, result["question_id"])] = result
+                    if progress:
+                        progress(result)
+                logger.info("[BatchQA] %s: answered %d questions (%s)", customer, len(pending), self.get_stats())
+        return [done[(c, q.id)] for c in customers for q in questions if (c, q.id) in done]
+
+    def _checkpoint(self, result: dict):
+        self._count("answered")
+        if not self.checkpoint_path:
+            return
+        with self._checkpoint_lock, open(self.checkpoint_path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+
+    def _answer_customer(self, customer, questions, query_embeddings, executor):
+        results = []
+        retrieved: Dict[str, List[Document]] = {}
+        for question in questions:
+            facts = self.facts_index.answer_query(question.question, customer) if self.facts_index else None
+            if facts:
+                answer, sources = format_facts_answer(facts, customer)
+                result = self._result(customer, question, answer, sources, "facts")
+                self._count("facts_answers")
+                self._checkpoint(result)
+                results.append(result)
+                continue
+            chunks = self.retriever.retrieve(question.question, customer=customer,
+                                             query_embedding=query_embeddings[question.id])
+            self._count("retrievals")
+            retrieved[question.id] = chunks
+
+        # Invert question -> chunks into chunk -> questions so each chunk is mapped once
+        chunk_questions: Dict[str, List[BatchQuestion]] = {}
+        chunk_docs: Dict[str, Document] = {}
+        for question in questions:
+            for chunk in retrieved.get(question.id, []):
+                chunk_docs.setdefault(chunk.chunk_id, chunk.map_document)
+                chunk_questions.setdefault(chunk.chunk_id, []).append(question)
+        self._count("chunk_question_pairs", sum(len(qs) for qs in chunk_questions.values()))
+
+        map_jobs = []
+        for chunk_id, doc in chunk_docs.items():
+            group = chunk_questions[chunk_id]
+            for start in range(0, len(group), self.questions_per_map):
+                map_jobs.append(executor.submit(self._map_chunk, chunk_id, doc,
+                                                group[start:start + self.questions_per_map]))
+        summaries: Dict[Tuple[str, str], str] = {}
+        for job in map_jobs:
+            summaries.update(job.result())
+
+        reduce_jobs = []
+        for question in questions:
+            if question.id not in retrieved:
+                continue
+            chunks = retrieved[question.id]
+            docs = [chunk.document for chunk in chunks]
+            question_summaries = [summaries[(chunk.chunk_id, question.id)] for chunk in chunks]
+            reduce_jobs.append(executor.submit(self._reduce, customer, question, docs, question_summaries))
+        for job in reduce_jobs:
+            result = job.result()
+            self._checkpoint(result)
+            results.append(result)
+        return results
+
+    def _map_chunk(self, chunk_id: str, map_document: Document,
+                   questions: Sequence[BatchQuestion]) -> Dict[Tuple[str, str], str]:
+        metadata_line = map_document.page_content.split("\n---\n", 1)[0]
+        numbered = "\n".join(f"[Q{n}] {q.question}" for n, q in enumerate(questions, start=1))
+        prompt = MULTI_QUESTION_MAP_PROMPT.format(questions=numbered, page_content=map_document.page_content)
+        with llm_priority(PRIORITY_BATCH):
+            response = self.llm.invoke(prompt)
+        self._count("map_calls")
+        parsed = parse_multi_question_output(getattr(response, "content", str(response)), range(1, len(questions) + 1))
+        return {
+            (chunk_id, q.id): parsed.get(n) or f"{metadata_line} --- {NO_RELEVANT_INFO}"
+            for n, q in enumerate(questions, start=1)
+        }
+
+    def _reduce(self, customer, question, docs, question_summaries):
+        if not docs:
+            return self._result(customer, question, "Could not find relevant documents for this question.", [], "none")
+        with llm_priority(PRIORITY_BATCH):
+            output = self.reduce_chain.invoke({
+                "input_documents": [Document(page_content=summary) for summary in question_summaries],
+                "question": question.question,
+            })
+        self._count("reduce_calls")
+        return self._result(customer, question, output.get("output_text", ""), format_sources(docs), "map_reduce")
+
+    @staticmethod
+    def _result(customer, question, answer, sources, method):
+        return {"customer": customer, "question_id": question.id, "question": question.question,
+                "answer": answer, "sources": sources, "method": method}
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["map_calls_saved"] = stats["chunk_question_pairs"] - stats["map_calls"]
+        return stats
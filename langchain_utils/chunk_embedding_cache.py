@@ -0,0 +1,65 @@
+# langchain_utils/chunk_embedding_cache.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import List
+
+import numpy as np
+
+
+class ChunkEmbeddingCache:
+    """
+    On-disk cache of chunk embeddings in SQLite, keyed by (model, text hash). Parameter sweeps
+    that produce the same chunk text under several configurations only embed it once.
+    """
+
+    def __init__(self, path: str, model_key: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.model_key = model_key
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dim INTEGER, vector BLOB)"
+            )
+            self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1((self.model_key + "\x00" + text).encode("utf-8")).hexdigest()
+
+    def embed_documents(self, embeddings, texts: List[str], batch_size: int = 64) -> List[List[float]]:
+        """Returns embeddings for texts, computing (in batches) and storing only the missing ones."""
+        keys = [self._key(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+        missing = [(key, text) for key, text in dict(zip(keys, texts)).items() if key not in found]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            vectors = embeddings.embed_documents([text for _, text in batch])
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)",
+                    [(key, len(vec), np.asarray(vec, dtype=np.float32).tobytes()) for (key, _), vec in zip(batch, vectors)],
+                )
+                self._conn.commit()
+            for (key, _), vec in zip(batch, vectors):
+                found[key] = list(vec)
+        return [found[key] for key in keys]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
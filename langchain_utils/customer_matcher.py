@@ -0,0 +1,84 @@
+# langchain_utils/customer_matcher.py
+
+import re
+from typing import Dict, Iterable, List, Optional
+
+
+def generate_keyword(customer_name):
+    if not customer_name: return None
+    name_cleaned = customer_name
+    suffixes = [' Pty Ltd', ' Pty Limited', ' Ltd', ' Limited', ' Inc']
+    for suffix in suffixes:
+        if name_cleaned.endswith(suffix):
+            name_cleaned = name_cleaned[:-len(suffix)]
+            break
+    parts = name_cleaned.split()
+    return parts[0].lower() if parts else None
+
+
+def build_customer_keyword_map(customer_names: Iterable[str]) -> Dict[str, str]:
+    """Maps every query keyword (first word, and full name without spaces) to its customer name."""
+    customer_keywords_map = {}
+    for name in customer_names:
+        keyword = generate_keyword(name)
+        if keyword:
+            customer_keywords_map[keyword] = name
+            full_name_keyword = name.lower().replace(" ", "")
+            if full_name_keyword != keyword:
+                customer_keywords_map[full_name_keyword] = name
+    return customer_keywords_map
+
+
+def _trie_to_pattern(node) -> str:
+    """Turns a character trie into a regex where every alternative starts with a distinct character."""
+    is_terminal = "" in node
+    branches = [re.escape(char) + _trie_to_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    if len(branches) == 1:
+        body = branches[0]
+    else:
+        body = "(?:" + "|".join(branches) + ")"
+    # Greedy optional group: the longest keyword is tried first, shorter ones on backtrack.
+    if is_terminal:
+        return "(?:" + body + ")?"
+    return body
+
+
+def build_keyword_regex(keywords: Iterable[str]) -> Optional[re.Pattern]:
+    """
+    Compiles all keywords into a single word-bounded regex built from a trie, so a query is
+    scanned once regardless of how many customers are known.
+    """
+    trie = {}
+    for keyword in keywords:
+        if not keyword:
+            continue
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = True
+    if not trie:
+        return None
+    return re.compile(r"\b(" + _trie_to_pattern(trie) + r")\b")
+
+
+class CustomerMatcher:
+    """Precompiled matcher that finds customer names mentioned in a query."""
+
+    def __init__(self, customer_names: List[str]):
+        # Kept by reference so callers can cheaply check whether the list was replaced.
+        self.customer_names = customer_names
+        self.keyword_map = build_customer_keyword_map(self.customer_names)
+        self.regex = build_keyword_regex(self.keyword_map.keys())
+
+    def find_customers(self, query: str) -> List[str]:
+        """Returns the distinct customer names mentioned in the query, in order of appearance."""
+        if not query or self.regex is None:
+            return []
+        found_original_names = []
+        for match in self.regex.finditer(query.lower()):
+            original_name = self.keyword_map[match.group(1)]
+            if original_name not in found_original_names:
+                found_original_names.append(original_name)
+        return found_original_names
@@ -0,0 +1,116 @@
+# langchain_utils/fake_llm.py
+
+import hashlib
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+MAP_PROMPT_MARKER = "Document Excerpt with Metadata:"
+MULTI_QUESTION_MARKER = "Numbered Questions:"
+NO_RELEVANT_INFO = "No relevant information found in this excerpt."
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, int(len(text.split()) * 1.3))
+
+
+class DeterministicFakeChatModel(BaseChatModel):
+    """
+    Offline stand-in for AzureChatOpenAI used by benchmarks and tests.
+
+    The output depends only on the prompt: map prompts echo the excerpt's metadata line plus its
+    first sentence (or the "no relevant information" phrase), reduce prompts return a digest of
+    the summaries. Call counts and estimated token usage are recorded per prompt kind.
+    """
+
+    latency_ms: float = 0.0
+
+    def model_post_init(self, __context: Any) -> None:
+        self._lock = threading.Lock()
+        self._call_counts: Dict[str, int] = {"map": 0, "reduce": 0}
+        self._token_counts: Dict[str, int] = {"prompt_tokens": 0, "completion_tokens": 0}
+
+    @property
+    def _llm_type(self) -> str:
+        return "deterministic-fake-chat"
+
+    @property
+    def call_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._call_counts)
+
+    @property
+    def token_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._token_counts)
+
+    def reset_counts(self):
+        with self._lock:
+            self._call_counts = {"map": 0, "reduce": 0}
+            self._token_counts = {"prompt_tokens": 0, "completion_tokens": 0}
+
+    def _respond(self, prompt: str):
+        if MAP_PROMPT_MARKER in prompt:
+            excerpt = prompt.split(MAP_PROMPT_MARKER, 1)[1].split("**Instructions:**", 1)[0].strip()
+            metadata_line, _, body = excerpt.partition("\n---\n")
+            if MULTI_QUESTION_MARKER in prompt:
+                return "map", self._respond_multi_question(prompt, metadata_line.strip(), body)
+            # Roughly a third of excerpts are "irrelevant", chosen by content hash
+            if int(hashlib.sha1(body.encode("utf-8")).hexdigest(), 16) % 3 == 0:
+                return "map", f"{metadata_line.strip()} --- {NO_RELEVANT_INFO}"
+            first_sentence = body.strip().split(". ")[0][:300]
+            return "map", f"{metadata_line.strip()} --- {first_sentence}"
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+        summaries = prompt.count(" --- ")
+        return "reduce", f"Deterministic answer {digest} synthesized from {summaries} summaries."
+
+    def _respond_multi_question(self, prompt: str, metadata_line: str, body: str) -> str:
+        """One "[Qn] metadata --- extract" line per numbered question, relevance chosen by hash."""
+        questions_block = prompt.split(MULTI_QUESTION_MARKER, 1)[1].split(MAP_PROMPT_MARKER, 1)[0]
+        first_sentence = body.strip().split(". ")[0][:300]
+        lines = []
+        for number in re.findall(r"^\[Q(\d+)\]", questions_block, re.M):
+            seed = hashlib.sha1(f"{number}|{body}".encode("utf-8")).hexdigest()
+            text = NO_RELEVANT_INFO if int(seed, 16) % 3 == 0 else first_sentence
+            lines.append(f"[Q{number}] {metadata_line} --- {text}")
+        return "\n".join(lines)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        prompt = "\n".join(str(m.content) for m in messages)
+        kind, text = self._respond(prompt)
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        usage = {"prompt_tokens": _estimate_tokens(prompt), "completion_tokens": _estimate_tokens(text)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        with self._lock:
+            self._call_counts[kind] += 1
+            self._token_counts["prompt_tokens"] += usage["prompt_tokens"]
+            self._token_counts["completion_tokens"] += usage["completion_tokens"]
+        message = AIMessage(content=text, response_metadata={"token_usage": usage})
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": usage})
+
+
+class DeterministicFakeEmbeddings(Embeddings):
+    """Hash-seeded, unit-length random vectors: same text, same vector, no model download."""
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).normal(size=self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
@@ -0,0 +1,22 @@
+# langchain_utils/file_lock.py
+
+import fcntl
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True):
+    """
+    Exclusive advisory lock on `path` (created if missing), held across processes: gunicorn
+    workers and CLI scripts sharing a directory take turns. Released when the block exits or
+    the process dies. With blocking=False a lock held elsewhere raises BlockingIOError at once.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,461 @@
+# langchain_utils/index_snapshots.py
+#
+# Layout of an index root:
+#   <root>/snapshots/<version>/{index.faiss, index.pkl, customers.txt, facts_index.json, manifest.json}
+#   <root>/CURRENT   -> the version workers should serve
+# A sharded snapshot (one index per region or customer group) stores shard-<name>.faiss/.pkl
+# instead of index.faiss/.pkl; the manifest's "shards" lists each shard's customers and regions.
+# A snapshot appended to a sharded one hard-links the shards it leaves unchanged.
+# A snapshot is written to a staging directory and renamed into place once complete, and CURRENT
+# is replaced atomically, so a reader never sees a half-written index.
+# The manifest records a sha256 per file and what the index is compatible with (embedding model,
+# parser version). pack_snapshot turns a snapshot into a portable .tar.gz artifact that
+# install_artifact verifies and unpacks from a local path or an http(s) URL.
+# A process still reading a snapshot from disk (a sharded one loads shards on demand) pins it with
+# a file under <version>/.pins/, and prune_snapshots leaves pinned snapshots alone.
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+
+from document_processing.facts import FactsIndex
+from langchain_utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_DIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+CUSTOMERS_FILE = "customers.txt"
+FACTS_FILE = "facts_index.json"
+SHARD_PREFIX = "shard-"
+STAGING_PREFIX = ".staging-"
+PINS_DIR = ".pins"
+ARTIFACT_FORMAT_VERSION = 1
+
+INDEX_SWAPS = REGISTRY.counter(
+    "legal_qa_index_swaps_total", "Index snapshot hot swaps by result (ok, error).", ["result"]
+)
+
+
+class IncompatibleIndexError(ValueError):
+    """The snapshot was built with a different embedding model or parser version, or failed its checksums."""
+
+
+class IndexState(NamedTuple):
+    """Everything a request needs from one index snapshot. Requests hold on to one state until they finish."""
+    version: str
+    vectorstore: Any
+    adaptive_retriever: Any
+    customer_names: List[str]
+    customer_matcher: Any
+    facts_index: FactsIndex
+
+
+def new_version() -> str:
+    """Sortable, unique snapshot version: UTC timestamp (microseconds) plus a random suffix."""
+    now = time.time()
+    return f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now))}.{int(now * 1e6) % 1000000:06d}Z-{uuid.uuid4().hex[:6]}"
+
+
+def snapshot_path(root: str, version: str) -> str:
+    return os.path.join(root, SNAPSHOTS_DIR, version)
+
+
+def write_snapshot(root: str, vectorstore, customer_names: List[str], facts_index: FactsIndex,
+                   manifest_extra: Optional[Dict[str, Any]] = None, shards: Optional[Dict[str, Any]] = None,
+                   base_version: Optional[str] = None) -> str:
+    """
+    Saves a complete snapshot under a new version and returns it. Does not publish it.
+    Pass shards ({name: vectorstore}) instead of vectorstore to write a sharded snapshot; with
+    base_version, the shards of that snapshot not in `shards` are carried over unchanged.
+    """
+    version = new_version()
+    staging = os.path.join(root, SNAPSHOTS_DIR, STAGING_PREFIX + version)
+    os.makedirs(staging)
+    try:
+        carried_files, carried_shards, sources = {}, {}, set()
+        if shards:
+            for name, shard in shards.items():
+                shard.save_local(staging, index_name=SHARD_PREFIX + name)
+            vectorstores = list(shards.values())
+            if base_version is not None:
+                carried_files, carried_shards, sources = _carry_shards(root, base_version, staging, shards)
+        else:
+            vectorstore.save_local(staging)
+            vectorstores = [vectorstore]
+        sources |= {doc.metadata.get("source") for vs in vectorstores for doc in vs.docstore._dict.values()}
+        sources.discard(None)
+        with open(os.path.join(staging, CUSTOMERS_FILE), "w") as f:
+            for name in sorted(customer_names):
+                f.write(name + "\n")
+        facts_index.save(os.path.join(staging, FACTS_FILE))
+        manifest = {
+            "version": version,
+            "format_version": ARTIFACT_FORMAT_VERSION,
+            "created_at": time.time(),
+            "chunks": (sum(len(vs.index_to_docstore_id) for vs in vectorstores) +
+                       sum(entry["chunks"] for entry in carried_shards.values())),
+            "embedding_dim": vectorstores[0].index.d,
+            "customers": len(customer_names),
+            "facts": len(facts_index),
+            **(manifest_extra or {}),
+            "sources": sorted(sources),
+            "files": dict(sorted({**file_checksums(staging, skip=carried_files), **carried_files}.items())),
+        }
+        if shards:
+            manifest["shards"] = dict(sorted({**carried_shards,
+                                              **{name: describe_shard(shard) for name, shard in shards.items()}}.items()))
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging, snapshot_path(root, version))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    logger.info("Wrote index snapshot %s (%s chunks%s)", version, manifest["chunks"],
+                f" in {len(manifest['shards'])} shards" if shards else "")
+    return version
+
+
+def _carry_shards(root: str, base_version: str, staging: str, written: Dict[str, Any]):
+    """
+    Hard-links (copies, across filesystems) the shards of base_version that `written` does not
+    replace into staging. Returns their checksums, manifest entries and base_version's sources.
+    """
+    base = read_manifest(root, base_version)
+    base_path = snapshot_path(root, base_version)
+    files, entries = {}, {}
+    for name, entry in (base.get("shards") or {}).items():
+        if name in written:
+            continue
+        for suffix in (".faiss", ".pkl"):
+            file_name = SHARD_PREFIX + name + suffix
+            try:
+                os.link(os.path.join(base_path, file_name), os.path.join(staging, file_name))
+            except OSError:
+                shutil.copy2(os.path.join(base_path, file_name), os.path.join(staging, file_name))
+            files[file_name] = (base.get("files") or {}).get(file_name) or {
+                "sha256": _sha256(os.path.join(staging, file_name)),
+                "bytes": os.path.getsize(os.path.join(staging, file_name)),
+            }
+        entries[name] = entry
+    return files, entries, set(base.get("sources") or [])
+
+
+def describe_shard(vectorstore) -> Dict[str, Any]:
+    """Manifest entry of one shard: vector count and the customers and regions it holds."""
+    customers, regions = set(), set()
+    for doc in vectorstore.docstore._dict.values():
+        customers.add(doc.metadata.get("customer", "Unknown Customer"))
+        regions.add(doc.metadata.get("region", "Unknown Region"))
+    return {"chunks": len(vectorstore.index_to_docstore_id), "customers": sorted(customers), "regions": sorted(regions)}
+
+
+def publish_snapshot(root: str, version: str):
+    """Points CURRENT at a written snapshot with an atomic replace."""
+    if not os.path.exists(os.path.join(snapshot_path(root, version), MANIFEST_FILE)):
+        raise FileNotFoundError(f"Snapshot {version} is missing or incomplete under {root}")
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+    logger.info("Published index snapshot %s", version)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_checksums(directory: str, skip=()) -> Dict[str, Dict[str, Any]]:
+    """sha256 and size of every file of a snapshot except the manifest (and the `skip` names)."""
+    return {
+        name: {"sha256": _sha256(os.path.join(directory, name)), "bytes": os.path.getsize(os.path.join(directory, name))}
+        for name in sorted(os.listdir(directory)) if name != MANIFEST_FILE and name not in skip
+    }
+
+
+def verify_checksums(directory: str, manifest: Dict[str, Any]):
+    """Raises IncompatibleIndexError if a file listed in the manifest is missing or differs."""
+    for name, expected in (manifest.get("files") or {}).items():
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            raise IncompatibleIndexError(f"Snapshot {manifest.get('version')} is missing {name}")
+        if os.path.getsize(path) != expected["bytes"] or _sha256(path) != expected["sha256"]:
+            raise IncompatibleIndexError(f"Checksum mismatch for {name} in snapshot {manifest.get('version')}")
+
+
+def check_compatibility(manifest: Dict[str, Any], expected: Dict[str, Any]):
+    """
+    Raises IncompatibleIndexError if the manifest disagrees with any expected value (e.g.
+    embedding_model, parser_version). Values the manifest does not record are only logged.
+    """
+    for key, value in expected.items():
+        if key not in manifest:
+            logger.warning("Snapshot %s does not record %s; assuming it matches %r", manifest.get("version"), key, value)
+        elif manifest[key] != value:
+            raise IncompatibleIndexError(
+                f"Snapshot {manifest.get('version')} was built with {key}={manifest[key]!r}, this app expects {value!r}"
+            )
+
+
+def read_current_version(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(root: str, version: str) -> Dict[str, Any]:
+    with open(os.path.join(snapshot_path(root, version), MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def list_snapshots(root: str) -> List[str]:
+    """Complete snapshot versions, oldest first."""
+    directory = os.path.join(root, SNAPSHOTS_DIR)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory)
+                  if not name.startswith(STAGING_PREFIX) and os.path.exists(os.path.join(directory, name, MANIFEST_FILE)))
+
+
+def pin_snapshot(root: str, version: str) -> str:
+    """
+    Marks the snapshot as read by this process, so prune_snapshots keeps it, until unpin_snapshot
+    is called with the returned pin (or the process dies). Every call adds its own pin.
+    """
+    directory = os.path.join(snapshot_path(root, version), PINS_DIR)
+    os.makedirs(directory, exist_ok=True)
+    pin = os.path.join(directory, f"{os.getpid()}.{uuid.uuid4().hex[:8]}@{socket.gethostname()}")
+    open(pin, "w").close()
+    return pin
+
+
+def unpin_snapshot(pin: str):
+    try:
+        os.remove(pin)
+    except FileNotFoundError:
+        pass
+
+
+def is_pinned(root: str, version: str) -> bool:
+    """Whether a live process pinned the snapshot. Pins from other hosts are trusted as they cannot be checked."""
+    try:
+        pins = os.listdir(os.path.join(snapshot_path(root, version), PINS_DIR))
+    except FileNotFoundError:
+        return False
+    host = socket.gethostname()
+    for pin in pins:
+        owner, _, pin_host = pin.rpartition("@")
+        if pin_host != host:
+            return True
+        try:
+            os.kill(int(owner.split(".", 1)[0]), 0)
+        except ProcessLookupError:
+            continue  # left behind by a process that died
+        except (ValueError, PermissionError):
+            pass
+        return True
+    return False
+
+
+def prune_snapshots(root: str, keep: int, grace_s: float = 0.0):
+    """
+    Deletes the oldest snapshots beyond `keep`, never the current one, a pinned one (still read by
+    a live process) nor one superseded less than grace_s ago (by the snapshot written after it),
+    so workers that have not switched yet can still load it.
+    """
+    current = read_current_version(root)
+    versions = list_snapshots(root)
+    old = [version for version in versions if version != current]
+    now = time.time()
+    for version in old[:max(0, len(old) - max(keep - 1, 0))]:
+        successor = versions[versions.index(version) + 1] if version != versions[-1] else version
+        if grace_s and now - os.path.getmtime(snapshot_path(root, successor)) < grace_s:
+            continue
+        if is_pinned(root, version):
+            logger.info("Keeping pinned index snapshot %s", version)
+            continue
+        shutil.rmtree(snapshot_path(root, version), ignore_errors=True)
+        logger.info("Pruned index snapshot %s", version)
+
+
+def load_snapshot(root: str, version: str, embeddings, expected: Optional[Dict[str, Any]] = None,
+                  verify: bool = False, load_vectors: bool = True) -> Tuple[Any, List[str], FactsIndex, Dict[str, Any]]:
+    """
+    Loads (vectorstore, customer names, facts index, manifest) of one snapshot, after checking it
+    against the `expected` compatibility values and, with verify=True, its file checksums.
+    The vectorstore is None for a sharded snapshot (its shards are loaded on demand with load_shard)
+    and with load_vectors=False (processes that query a retrieval service instead).
+    """
+    path = snapshot_path(root, version)
+    manifest = read_manifest(root, version)
+    check_compatibility(manifest, expected or {})
+    if verify:
+        verify_checksums(path, manifest)
+    vectorstore = None
+    if load_vectors and not manifest.get("shards"):
+        vectorstore = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    with open(os.path.join(path, CUSTOMERS_FILE)) as f:
+        customer_names = [line.strip() for line in f if line.strip() and line.strip() != "Unknown Customer"]
+    try:
+        facts_index = FactsIndex.load(os.path.join(path, FACTS_FILE))
+    except FileNotFoundError:
+        facts_index = FactsIndex()
+    return vectorstore, customer_names, facts_index, manifest
+
+
+def load_shard(root: str, version: str, name: str, embeddings):
+    """Loads one shard of a sharded snapshot (checksums were verified with the snapshot)."""
+    return FAISS.load_local(snapshot_path(root, version), embeddings, index_name=SHARD_PREFIX + name,
+                            allow_dangerous_deserialization=True)
+
+
+def pack_snapshot(root: str, version: str, output_path: str) -> str:
+    """Writes a snapshot as a self-contained .tar.gz artifact (files at the top level). Returns its sha256."""
+    path = snapshot_path(root, version)
+    tmp_path = output_path + ".tmp"
+    with tarfile.open(tmp_path, "w:gz") as tar:
+        for name in sorted(os.listdir(path)):
+            if name == PINS_DIR:
+                continue
+            tar.add(os.path.join(path, name), arcname=name)
+    os.replace(tmp_path, output_path)
+    return _sha256(output_path)
+
+
+def _display_source(source: str) -> str:
+    """The artifact path or URL without its query string, so SAS tokens stay out of logs."""
+    return source.split("?", 1)[0]
+
+
+def _fetch_artifact(source: str, directory: str) -> str:
+    """Local path of the artifact, downloading it into `directory` first if `source` is an http(s) URL."""
+    if source.startswith("file://"):
+        return source[len("file://"):]
+    if not source.startswith(("http://", "https://")):
+        return source
+    import httpx
+    local_path = os.path.join(directory, "artifact.tar.gz")
+    logger.info("Downloading index artifact from %s", _display_source(source))
+    with httpx.stream("GET", source, follow_redirects=True, timeout=httpx.Timeout(60.0, connect=10.0)) as response:
+        response.raise_for_status()
+        with open(local_path, "wb") as f:
+            for block in response.iter_bytes(1 << 20):
+                f.write(block)
+    return local_path
+
+
+def install_artifact(root: str, source: str, expected: Optional[Dict[str, Any]] = None,
+                     sha256: Optional[str] = None) -> str:
+    """
+    Installs an index artifact (a .tar.gz from pack_snapshot, or an unpacked snapshot directory)
+    given by path or URL as a snapshot under `root`, verifying the sha256, every file checksum and
+    compatibility first. Returns the version; installing it again is a no-op. sha256 is that of the
+    archive, or of manifest.json for a directory (its file checksums cover the rest); it is required
+    for URLs, whose manifest alone cannot vouch for the pickles loaded from them.
+    """
+    if not sha256 and source.startswith(("http://", "https://")):
+        raise IncompatibleIndexError(f"Index artifact {_display_source(source)} is a URL; its sha256 is required")
+    os.makedirs(os.path.join(root, SNAPSHOTS_DIR), exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=os.path.join(root, SNAPSHOTS_DIR), prefix=STAGING_PREFIX) as staging:
+        local = _fetch_artifact(source, staging)
+        if os.path.isdir(local):
+            if sha256 and _sha256(os.path.join(local, MANIFEST_FILE)) != sha256:
+                raise IncompatibleIndexError(f"Index artifact {_display_source(source)} manifest does not match the expected sha256")
+            unpacked = local
+        else:
+            if sha256 and _sha256(local) != sha256:
+                raise IncompatibleIndexError(f"Index artifact {_display_source(source)} does not match the expected sha256")
+            unpacked = os.path.join(staging, "unpacked")
+            with tarfile.open(local, "r:*") as tar:
+                for member in tar.getmembers():
+                    if not (member.isfile() and os.path.basename(member.name) == member.name):
+                        raise IncompatibleIndexError(f"Unexpected entry {member.name!r} in index artifact")
+                tar.extractall(unpacked)
+        with open(os.path.join(unpacked, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        version = manifest["version"]
+        check_compatibility(manifest, expected or {})
+        verify_checksums(unpacked, manifest)
+        if os.path.exists(os.path.join(snapshot_path(root, version), MANIFEST_FILE)):
+            logger.info("Index artifact %s is already installed", version)
+            return version
+        target = os.path.join(staging, "snapshot")
+        if unpacked == local:
+            shutil.copytree(unpacked, target)
+        else:
+            os.rename(unpacked, target)
+        try:
+            os.rename(target, snapshot_path(root, version))
+        except OSError:
+            # Another worker installed the same version first
+            if not os.path.exists(os.path.join(snapshot_path(root, version), MANIFEST_FILE)):
+                raise
+    logger.info("Installed index artifact %s from %s", version, _display_source(source))
+    return version
+
+
+class SnapshotWatcher:
+    """
+    Polls CURRENT every interval_s on a daemon thread and calls on_change(version) when it
+    points somewhere new. A failed on_change is retried on the next poll. check() may also be
+    called from other threads (ingestion); concurrent checks activate a new version once.
+    """
+
+    def __init__(self, root: str, current_version: Optional[str], on_change: Callable[[str], None],
+                 interval_s: float = 5.0):
+        self.root = root
+        self.version = current_version
+        self.on_change = on_change
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def check(self) -> bool:
+        """Polls once. Returns True if a new version was activated."""
+        with self._lock:
+            version = read_current_version(self.root)
+            if not version or version == self.version:
+                return False
+            try:
+                self.on_change(version)
+            except Exception as e:
+                INDEX_SWAPS.inc(result="error")
+                logger.exception("Could not switch to index snapshot %s; still serving %s: %s", version, self.version, e)
+                return False
+            INDEX_SWAPS.inc(result="ok")
+            logger.info("Switched index snapshot %s -> %s", self.version, version)
+            self.version = version
+            return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.check()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="index-snapshot-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
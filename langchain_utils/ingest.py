@@ -0,0 +1,312 @@
+# langchain_utils/ingest.py
+#
+# Background ingestion of uploaded contracts. Each job runs extract -> parse -> embed -> index on a
+# local worker pool; the index stage loads a fresh copy of the CURRENT snapshot, appends the new
+# chunks with their precomputed vectors and publishes the result as a new snapshot. Requests keep
+# being served from the snapshot they started on, and workers hot-swap to the new one.
+# Extraction, parsing and embedding of several uploads run in parallel; appends are serialized
+# across processes by a file lock under the index root, so each new snapshot builds on the one
+# before it. Under the lock, an append is checked against the snapshot it extends: sources it
+# already holds are rejected and (with dedup) chunks duplicating its clauses are dropped; of a
+# sharded snapshot only the shards receiving chunks are loaded. Job status is written next to the
+# snapshots, so any worker can report it.
+
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from document_processing.child_chunks import build_parent_child_documents
+from document_processing.dedup import (SimHashIndex, content_hash, deduplicate_documents, document_key_terms,
+                                       document_simhash)
+from document_processing.facts import extract_facts_from_text
+from langchain_utils.file_lock import file_lock
+from langchain_utils.index_snapshots import (load_shard, load_snapshot, prune_snapshots, publish_snapshot,
+                                             read_current_version, read_manifest, write_snapshot)
+from langchain_utils.metrics import REGISTRY
+from langchain_utils.shards import shard_name
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("extract", "parse", "embed", "index")
+INGEST_LOCK_FILE = ".ingest.lock"
+INGEST_JOBS_DIR = "ingest_jobs"
+JOB_ID_RE = re.compile(r'[0-9a-f]{32}')
+# Uploads wait here (one subdirectory each, keeping the file name) until their snapshot is published
+UPLOAD_STAGING_DIR = ".uploads"
+# Manifest fields write_snapshot computes itself; everything else carries over to the appended snapshot
+GENERATED_MANIFEST_KEYS = {"version", "format_version", "created_at", "chunks", "embedding_dim", "customers",
+                           "facts", "files", "shards", "sources"}
+
+INGEST_JOBS = REGISTRY.counter("legal_qa_ingest_jobs_total", "Ingestion jobs by result (done, error).", ["status"])
+INGEST_STAGE_DURATION = REGISTRY.histogram(
+    "legal_qa_ingest_stage_duration_seconds", "Wall time of each ingestion stage.", ["stage"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+
+class IndexLayoutChanged(ValueError):
+    """The snapshot being appended to no longer matches how the new chunks were embedded (parent_child)."""
+
+
+def _empty_vectorstore(embeddings, dim: int):
+    import faiss
+    return FAISS(embeddings, faiss.IndexFlatL2(dim), InMemoryDocstore(), {})
+
+
+def _new_positions(vectorstore, chunks, positions: List[int], parents: Dict[str, Any], max_distance: int) -> List[int]:
+    """
+    Positions of the chunks whose clause (the chunk, or its parent) is neither an exact nor a near
+    duplicate of a clause of the same customer already in `vectorstore`.
+    """
+    exact = set()
+    near: Dict[str, SimHashIndex] = defaultdict(lambda: SimHashIndex(max_distance))
+    for doc in vectorstore.docstore._dict.values():
+        if 'parent_id' in doc.metadata:
+            continue  # a child; its parent clause is in the docstore too
+        customer = doc.metadata.get('customer', 'Unknown Customer')
+        exact.add((customer, doc.metadata.get('content_hash') or content_hash(doc.page_content)))
+        if max_distance >= 0:
+            near[customer].add(document_simhash(doc), document_key_terms(doc))
+    kept = []
+    for i in positions:
+        parent_id = chunks[i].metadata.get('parent_id')
+        clause = parents[parent_id] if parent_id else chunks[i]
+        customer = clause.metadata.get('customer', 'Unknown Customer')
+        if (customer, clause.metadata.get('content_hash') or content_hash(clause.page_content)) in exact:
+            continue
+        if max_distance >= 0 and customer in near:
+            terms = document_key_terms(clause)
+            if near[customer].find(document_simhash(clause), accept=lambda other: other == terms) is not None:
+                continue
+        kept.append(i)
+    return kept
+
+
+def append_to_snapshot(root: str, chunks, vectors, embeddings, parents: Optional[Dict[str, Any]] = None,
+                       parent_child: bool = False, expected: Optional[Dict[str, Any]] = None, keep: int = 3,
+                       prune_grace_s: float = 0.0, dedup_max_distance: Optional[int] = None) -> str:
+    """
+    Publishes CURRENT plus `chunks` (embedded as `vectors`; with parent_child, children of
+    `parents`) as a new snapshot and returns its version. Sharded snapshots get each chunk appended
+    to its region or customer shard, creating the shard if needed. Raises IndexLayoutChanged if
+    CURRENT's parent_child layout differs, and ValueError if it already holds a source of the
+    chunks or (with dedup_max_distance) already holds every clause. Appends from every process on
+    this index root take turns on a file lock, so none is lost to a concurrent one.
+    """
+    with file_lock(os.path.join(root, INGEST_LOCK_FILE)):
+        return _append_to_snapshot(root, chunks, vectors, embeddings, parents or {}, parent_child, expected, keep,
+                                   prune_grace_s, dedup_max_distance)
+
+
+def _append_to_snapshot(root, chunks, vectors, embeddings, parents, parent_child, expected, keep, prune_grace_s,
+                        dedup_max_distance):
+    current = read_current_version(root)
+    if current is None:
+        raise ValueError(f"No current index snapshot under {root} to append to")
+    vectorstore, customer_names, facts_index, manifest = load_snapshot(root, current, embeddings, expected=expected)
+    if bool(manifest.get("parent_child")) != parent_child:
+        raise IndexLayoutChanged(f"Snapshot {current} has parent_child={bool(manifest.get('parent_child'))}; "
+                                 f"the chunks were embedded for parent_child={parent_child}")
+    sources = {doc.metadata.get('source') for doc in (parents.values() if parent_child else chunks)} - {None}
+    indexed = sources & (set(manifest.get("sources") or []) | set(manifest.get("appended_sources") or []))
+    if indexed:
+        raise ValueError(f"Snapshot {current} already holds {', '.join(sorted(indexed))}")
+    matrix = np.asarray(vectors, dtype=np.float32)
+
+    # Only the shards the new chunks route to are loaded; write_snapshot carries the others over
+    if manifest.get("shards"):
+        groups: Dict[str, List[int]] = {}
+        for i, chunk in enumerate(chunks):
+            groups.setdefault(shard_name(chunk.metadata.get(manifest.get("shard_by") or "region")), []).append(i)
+        targets = {name: load_shard(root, current, name, embeddings) if name in manifest["shards"]
+                   else _empty_vectorstore(embeddings, matrix.shape[1]) for name in groups}
+    else:
+        groups, targets = {"": list(range(len(chunks)))}, {"": vectorstore}
+    if dedup_max_distance is not None:
+        groups = {name: _new_positions(targets[name], chunks, positions, parents, dedup_max_distance)
+                  for name, positions in groups.items()}
+        groups = {name: positions for name, positions in groups.items() if positions}
+        if not groups:
+            raise ValueError(f"Snapshot {current} already holds every clause of {', '.join(sorted(sources))}")
+
+    for name, positions in groups.items():
+        targets[name].add_embeddings([(chunks[i].page_content, list(matrix[i])) for i in positions],
+                                     metadatas=[chunks[i].metadata for i in positions])
+        parent_ids = {chunks[i].metadata.get('parent_id') for i in positions} - {None}
+        if parent_ids:
+            targets[name].docstore.add({parent_id: parents[parent_id] for parent_id in parent_ids})
+
+    # Facts and customers come from the full clause chunks (the parents, in a parent-child index)
+    positions = sorted(i for group in groups.values() for i in group)
+    if parent_child:
+        parent_ids = dict.fromkeys(chunks[i].metadata['parent_id'] for i in positions)
+        documents = [parents[parent_id] for parent_id in parent_ids]
+    else:
+        documents = [chunks[i] for i in positions]
+    for doc in documents:
+        facts_index.add_facts(extract_facts_from_text(doc.page_content, doc.metadata))
+    customers = set(customer_names) | {doc.metadata.get('customer', 'Unknown Customer') for doc in documents}
+    customers.discard("Unknown Customer")
+
+    manifest_extra = {key: value for key, value in manifest.items() if key not in GENERATED_MANIFEST_KEYS}
+    manifest_extra["parents"] = (manifest.get("parents") or 0) + len(documents)
+    manifest_extra["appended_to"] = current
+    manifest_extra["appended_sources"] = sorted(set(manifest.get("appended_sources", [])) | sources)
+    if manifest.get("shards"):
+        version = write_snapshot(root, None, sorted(customers), facts_index, manifest_extra=manifest_extra,
+                                 shards={name: targets[name] for name in groups}, base_version=current)
+    else:
+        version = write_snapshot(root, vectorstore, sorted(customers), facts_index, manifest_extra=manifest_extra)
+    publish_snapshot(root, version)
+    prune_snapshots(root, keep, grace_s=prune_grace_s)
+    return version
+
+
+class IngestQueue:
+    """
+    Local worker pool of ingestion jobs. extract(pdf_path) returns page documents and
+    parse(pages, file_name) chunks (the app passes qa_chain.extract_pages and
+    parse_page_documents). on_published(version) runs after each new snapshot is published.
+    With corpus_dir set, submitted PDFs are staged uploads: moved into corpus_dir once their
+    snapshot is published, deleted if the job fails.
+    """
+
+    def __init__(self, root: str, embeddings, extract: Callable, parse: Callable, expected: Optional[Dict] = None,
+                 max_workers: int = 2, keep: int = 3, prune_grace_s: float = 0.0,
+                 dedup_max_distance: Optional[int] = None, on_published: Optional[Callable[[str], None]] = None,
+                 corpus_dir: Optional[str] = None):
+        self.root = root
+        self.embeddings = embeddings
+        self.extract = extract
+        self.parse = parse
+        self.expected = expected
+        self.keep = keep
+        self.prune_grace_s = prune_grace_s
+        self.dedup_max_distance = dedup_max_distance
+        self.on_published = on_published
+        self.corpus_dir = corpus_dir
+        self.jobs_dir = os.path.join(root, INGEST_JOBS_DIR)
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+
+    def submit(self, pdf_path: str) -> str:
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = {"status": "queued", "file": os.path.basename(pdf_path), "stage": None,
+                             "stage_seconds": {}, "submitted_at": time.time()}
+        self._save(job_id)
+        self._executor.submit(self._run, job_id, pdf_path)
+        logger.info("Queued ingestion job %s for %s", job_id, pdf_path)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job's status, from this process or, for jobs other workers run, from its status file."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return {**job, "stage_seconds": dict(job["stage_seconds"])}
+        if not JOB_ID_RE.fullmatch(job_id):
+            return None
+        try:
+            with open(os.path.join(self.jobs_dir, f"{job_id}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save(self, job_id: str):
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        path = os.path.join(self.jobs_dir, f"{job_id}.json")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.get(job_id), f)
+        os.replace(tmp_path, path)
+
+    def _stage(self, job_id, stage, fn, *args):
+        job = self.jobs[job_id]
+        job["stage"] = stage
+        self._save(job_id)
+        start = time.perf_counter()
+        result = fn(*args)
+        seconds = time.perf_counter() - start
+        job["stage_seconds"][stage] = round(seconds, 3)
+        INGEST_STAGE_DURATION.observe(seconds, stage=stage)
+        return result
+
+    def _finish_upload(self, pdf_path: str, published: bool):
+        """Moves a staged upload into the corpus once it is indexed, or drops it, so it can be uploaded again."""
+        if self.corpus_dir is None:
+            return
+        try:
+            if published:
+                os.makedirs(self.corpus_dir, exist_ok=True)
+                os.replace(pdf_path, os.path.join(self.corpus_dir, os.path.basename(pdf_path)))
+            else:
+                os.remove(pdf_path)
+            os.rmdir(os.path.dirname(pdf_path))
+        except OSError as e:
+            logger.warning("Could not clean up staged upload %s: %s", pdf_path, e)
+
+    def _embed(self, chunks):
+        current = read_current_version(self.root)
+        # Match how the current index was built: sentence children of each chunk, or the chunks themselves
+        parent_child = bool(current and read_manifest(self.root, current).get("parent_child"))
+        if parent_child:
+            children, parents = build_parent_child_documents(chunks)
+        else:
+            children, parents = chunks, {}
+        vectors = self.embeddings.embed_documents([doc.page_content for doc in children])
+        return children, vectors, parents, parent_child
+
+    def _index(self, chunks, embedded):
+        try:
+            return self._append(*embedded)
+        except IndexLayoutChanged as e:
+            # A snapshot with the other layout was published while this job was embedding
+            logger.info("Re-embedding %s chunks: %s", len(chunks), e)
+            return self._append(*self._embed(chunks))
+
+    def _append(self, children, vectors, parents, parent_child):
+        return append_to_snapshot(self.root, children, vectors, self.embeddings, parents=parents,
+                                  parent_child=parent_child, expected=self.expected, keep=self.keep,
+                                  prune_grace_s=self.prune_grace_s, dedup_max_distance=self.dedup_max_distance)
+
+    def _run(self, job_id: str, pdf_path: str):
+        job = self.jobs[job_id]
+        job.update(status="running", started_at=time.time())
+        try:
+            pages = self._stage(job_id, "extract", self.extract, pdf_path)
+            if not pages:
+                raise ValueError(f"No pages extracted from {os.path.basename(pdf_path)}")
+            chunks = self._stage(job_id, "parse", self.parse, pages, os.path.basename(pdf_path))
+            if self.dedup_max_distance is not None:
+                chunks, _ = deduplicate_documents(chunks, max_distance=self.dedup_max_distance)
+            job.update(pages=len(pages), chunks=len(chunks),
+                       customers=sorted({c.metadata.get('customer', 'Unknown Customer') for c in chunks}))
+            embedded = self._stage(job_id, "embed", self._embed, chunks)
+            version = self._stage(job_id, "index", self._index, chunks, embedded)
+        except Exception as e:
+            logger.exception("Ingestion job %s failed in stage %s: %s", job_id, job["stage"], e)
+            self._finish_upload(pdf_path, published=False)
+            job.update(status="error", error=str(e), finished_at=time.time())
+            self._save(job_id)
+            INGEST_JOBS.inc(status="error")
+            return
+        self._finish_upload(pdf_path, published=True)
+        job.update(status="done", stage=None, version=version, finished_at=time.time())
+        self._save(job_id)
+        INGEST_JOBS.inc(status="done")
+        logger.info("Ingestion job %s published snapshot %s (%s chunks from %s)",
+                    job_id, version, len(chunks), job["file"])
+        if self.on_published is not None:
+            try:
+                self.on_published(version)
+            except Exception as e:
+                logger.exception("Could not activate ingested snapshot %s: %s", version, e)
@@ -0,0 +1,223 @@
+# langchain_utils/llm_client.py
+
+import contextlib
+import contextvars
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Any, List, Optional
+
+import httpx
+import openai
+from langchain_openai import AzureChatOpenAI
+
+from langchain_utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+LLM_RETRIES = REGISTRY.counter("legal_qa_llm_retries_total", "LLM call retries, by reason.", ["reason"])
+LLM_RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "legal_qa_llm_rate_limit_wait_seconds", "Time spent waiting for rate-limit budget, by priority.", ["priority"]
+)
+
+# Priority and absolute deadline (time.monotonic()) of the LLM calls made in the current context
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The request deadline passed while waiting for rate-limit budget or between retries."""
+
+
+class LLMRateLimited(RuntimeError):
+    """The deployment kept answering 429 until the retry budget was spent."""
+
+
+@contextlib.contextmanager
+def llm_priority(priority: int):
+    """Runs the enclosed LLM calls at the given priority (PRIORITY_INTERACTIVE or PRIORITY_BATCH)."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@contextlib.contextmanager
+def llm_deadline(seconds: Optional[float]):
+    """Bounds the total time the enclosed LLM calls may spend waiting and retrying."""
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class TokenBucketScheduler:
+    """
+    Admits LLM calls against the deployment's requests-per-minute and tokens-per-minute limits.
+    Both budgets refill continuously. Waiting interactive calls are always admitted before
+    waiting batch calls.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        self._waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60.0)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60.0)
+
+    def _seconds_until_available(self, tokens: float) -> float:
+        missing_requests = max(0.0, 1.0 - self._requests)
+        missing_tokens = max(0.0, tokens - self._tokens)
+        return max(missing_requests * 60.0 / self.requests_per_minute,
+                   missing_tokens * 60.0 / self.tokens_per_minute)
+
+    def acquire(self, tokens: float, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None):
+        """Blocks until one request and `tokens` tokens are available. Raises LLMDeadlineExceeded."""
+        tokens = min(tokens, self.tokens_per_minute)  # an oversized call still runs once the bucket is full
+        start = time.monotonic()
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    self._refill()
+                    blocked_by_priority = priority == PRIORITY_BATCH and self._waiting[PRIORITY_INTERACTIVE] > 0
+                    if not blocked_by_priority and self._requests >= 1.0 and self._tokens >= tokens:
+                        self._requests -= 1.0
+                        self._tokens -= tokens
+                        break
+                    wait = self._seconds_until_available(tokens) if not blocked_by_priority else 0.05
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or remaining < wait and not blocked_by_priority:
+                            raise LLMDeadlineExceeded("Deadline exceeded while waiting for LLM rate-limit budget")
+                        wait = min(wait, remaining)
+                    self._condition.wait(timeout=max(wait, 0.001))
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+        LLM_RATE_LIMIT_WAIT.observe(time.monotonic() - start,
+                                    priority="interactive" if priority == PRIORITY_INTERACTIVE else "batch")
+
+    def settle(self, estimated_tokens: float, actual_tokens: float):
+        """Corrects the token budget once the real usage of an admitted call is known."""
+        with self._condition:
+            self._refill()
+            self._tokens = min(self.tokens_per_minute, self._tokens + estimated_tokens - actual_tokens)
+            self._condition.notify_all()
+
+    def penalize(self, seconds: float):
+        """Empties the request budget for `seconds` after the server signalled a rate limit."""
+        with self._condition:
+            self._refill()
+            self._requests = min(self._requests, -seconds * self.requests_per_minute / 60.0 + 1.0)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Reads retry-after-ms / retry-after (seconds or HTTP date) from an OpenAI API error, if present."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def _retry_reason(error: Exception) -> Optional[str]:
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limited"
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return "connection"
+    if isinstance(error, openai.InternalServerError):
+        return "server_error"
+    return None
+
+
+def create_http_client(max_connections: int = 20, timeout_s: float = 60.0) -> httpx.Client:
+    """Pooled, keep-alive HTTP client shared by every LLM instance in the process."""
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(timeout_s, connect=10.0),
+    )
+
+
+def _estimate_prompt_tokens(messages) -> int:
+    return sum(len(str(message.content)) for message in messages) // 4 + 4 * len(messages)
+
+
+class ScheduledAzureChatOpenAI(AzureChatOpenAI):
+    """
+    AzureChatOpenAI whose calls are admitted by a TokenBucketScheduler and retried with full
+    jitter on 429/5xx/connection errors, honouring Retry-After and the context deadline.
+    The OpenAI SDK's own retries are disabled (max_retries=0) so only this policy applies.
+    """
+
+    scheduler: Optional[Any] = None
+    retry_attempts: int = 4
+    retry_base_delay_s: float = 0.5
+    retry_max_delay_s: float = 20.0
+
+    def _generate(self, messages: List[Any], stop=None, run_manager=None, **kwargs: Any):
+        priority = _priority.get()
+        deadline = _deadline.get()
+        estimated = _estimate_prompt_tokens(messages) + (self.max_tokens or 0)
+        attempt = 0
+        while True:
+            if self.scheduler is not None:
+                self.scheduler.acquire(estimated, priority=priority, deadline=deadline)
+            try:
+                result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                reason = _retry_reason(e)
+                if self.scheduler is not None:
+                    self.scheduler.settle(estimated, 0)
+                if reason is None:
+                    raise
+                attempt += 1
+                retry_after = retry_after_seconds(e)
+                delay = retry_after if retry_after is not None else random.uniform(
+                    0, min(self.retry_max_delay_s, self.retry_base_delay_s * 2 ** (attempt - 1)))
+                if reason == "rate_limited" and self.scheduler is not None:
+                    self.scheduler.penalize(delay)
+                out_of_time = deadline is not None and time.monotonic() + delay > deadline
+                if attempt > self.retry_attempts or out_of_time:
+                    if reason == "rate_limited":
+                        raise LLMRateLimited(f"LLM deployment still rate limited after {attempt} attempts") from e
+                    if out_of_time:
+                        raise LLMDeadlineExceeded(f"Deadline exceeded retrying LLM call ({reason})") from e
+                    raise
+                LLM_RETRIES.inc(reason=reason)
+                logger.warning("LLM call failed (%s); retry %d/%d in %.2fs", reason, attempt, self.retry_attempts, delay)
+                time.sleep(delay)
+                continue
+            if self.scheduler is not None:
+                usage = (result.llm_output or {}).get("token_usage") or {}
+                if usage.get("total_tokens"):
+                    self.scheduler.settle(estimated, usage["total_tokens"])
+            return result
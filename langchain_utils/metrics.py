@@ -0,0 +1,236 @@
+# langchain_utils/metrics.py
+
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', repr(float(bound))))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """Registers a callable returning extra exposition lines, evaluated at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append(f"# collector error: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "legal_qa_stage_duration_seconds", "Wall time of each request pipeline stage.", ["stage"]
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    "legal_qa_request_duration_seconds", "End-to-end wall time of query requests, by outcome (ok, no_documents, error).", ["outcome"]
+)
+LLM_TOKENS = REGISTRY.counter(
+    "legal_qa_llm_tokens_total", "LLM tokens used, by pipeline stage and token kind.", ["stage", "kind"]
+)
+LLM_CALLS = REGISTRY.counter("legal_qa_llm_calls_total", "LLM calls, by pipeline stage.", ["stage"])
+RETRIEVED_CHUNKS = REGISTRY.histogram(
+    "legal_qa_retrieved_chunks", "Chunks sent to the map step per request.", buckets=(1, 2, 4, 6, 8, 10, 15, 20, 30)
+)
+
+# Spans recorded for the current request, for per-request timing summaries
+_request_spans: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("request_spans", default=None)
+
+
+@contextlib.contextmanager
+def request_timer():
+    """Collects the spans of one request; yields the list of (stage, seconds) recorded so far."""
+    spans: List[Tuple[str, float]] = []
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+
+def record_span(stage: str, seconds: float):
+    STAGE_DURATION.observe(seconds, stage=stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Times the enclosed block as one pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+class StageTimingCallbackHandler(BaseCallbackHandler):
+    """
+    Times every LLM call and records its token usage under the stage of the chain that made it.
+    The stage is taken from the chain's tags or run name (the MapReduce chain names and tags its
+    LLMChains "map" and "reduce"; LLMChain.apply only forwards the name). Spans are recorded in the request context captured when the handler was created.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chain_stage: Dict[Any, str] = {}
+        self._llm_start: Dict[Any, Tuple[str, float]] = {}
+        self._spans = _request_spans.get()
+
+    def _stage_from_tags(self, tags):
+        for tag in tags or []:
+            if tag in ("map", "reduce"):
+                return tag
+        return None
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        with self._lock:
+            stage = (self._stage_from_tags(tags) or self._stage_from_tags([kwargs.get("name")])
+                     or self._chain_stage.get(parent_run_id))
+            if stage:
+                self._chain_stage[run_id] = stage
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            self._chain_stage.pop(run_id, None)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._chain_stage.pop(run_id, None)
+
+    def _on_llm_start(self, run_id, parent_run_id, tags):
+        with self._lock:
+            stage = self._stage_from_tags(tags) or self._chain_stage.get(parent_run_id) or "llm"
+            self._llm_start[run_id] = (stage, time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._on_llm_start(run_id, parent_run_id, tags)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._on_llm_start(run_id, parent_run_id, tags)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            stage, start = self._llm_start.pop(run_id, ("llm", None))
+        if start is not None:
+            seconds = time.perf_counter() - start
+            STAGE_DURATION.observe(seconds, stage=f"llm_{stage}")
+            if self._spans is not None:
+                self._spans.append((f"llm_{stage}", seconds))
+        LLM_CALLS.inc(stage=stage)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            for generations in response.generations:
+                for generation in generations:
+                    message_usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                    if message_usage:
+                        usage = {"prompt_tokens": message_usage.get("input_tokens", 0),
+                                 "completion_tokens": message_usage.get("output_tokens", 0)}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                LLM_TOKENS.inc(usage[kind], stage=stage, kind=kind)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            stage, _ = self._llm_start.pop(run_id, ("llm", None))
+        LLM_CALLS.inc(stage=f"{stage}_error")
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
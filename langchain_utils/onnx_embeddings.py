@@ -0,0 +1,139 @@
+# langchain_utils/onnx_embeddings.py
+
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from langchain_utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+MAX_SEQUENCE_LENGTH = 512
+
+
+def _is_exported(output_dir):
+    return all(os.path.exists(os.path.join(output_dir, name)) for name in (ONNX_MODEL_FILE, TOKENIZER_FILE))
+
+
+def _write_onnx_export(model_name, directory, opset):
+    """Writes the ONNX model and the tokenizer files into `directory` (needs torch and transformers)."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+        os.path.join(directory, ONNX_MODEL_FILE),
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "token_type_ids": {0: "batch", 1: "sequence"},
+            "last_hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=opset,
+    )
+    tokenizer.save_pretrained(directory)
+
+
+def export_bge_to_onnx(model_name, output_dir, quantize=False, opset=17):
+    """
+    Exports a BGE (BERT-style) encoder to ONNX with dynamic batch/sequence axes, plus its
+    fast tokenizer. With quantize=True a dynamic-int8 copy is written next to it.
+    Only this export step needs torch and transformers.
+
+    Workers starting together take turns on a file lock; the export is written to a staging
+    directory and moved into place with model.onnx last, so a reader never sees a partial
+    model and a crashed export is redone on the next start.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    int8_path = os.path.join(output_dir, ONNX_INT8_MODEL_FILE)
+    if _is_exported(output_dir) and (not quantize or os.path.exists(int8_path)):
+        return int8_path if quantize else model_path
+
+    with file_lock(os.path.join(output_dir, ".export.lock")):
+        # Another worker may have finished the export while this one waited
+        if not _is_exported(output_dir):
+            logger.info("Exporting %s to ONNX at %s...", model_name, model_path)
+            staging_dir = tempfile.mkdtemp(prefix=".onnx-export-", dir=os.path.dirname(os.path.abspath(output_dir)))
+            try:
+                _write_onnx_export(model_name, staging_dir, opset)
+                names = sorted(os.listdir(staging_dir), key=lambda name: name == ONNX_MODEL_FILE)
+                for name in names:
+                    os.replace(os.path.join(staging_dir, name), os.path.join(output_dir, name))
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+        if quantize and not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            logger.info("Quantizing %s to dynamic int8 at %s...", model_path, int8_path)
+            tmp_path = os.path.join(output_dir, f".{uuid.uuid4().hex}.{ONNX_INT8_MODEL_FILE}")
+            try:
+                quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+                os.replace(tmp_path, int8_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    return int8_path if quantize else model_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    BGE sentence embeddings on ONNX Runtime (CPU): CLS pooling followed by L2 normalization,
+    matching the sentence-transformers pipeline used by the torch backend.
+    """
+
+    def __init__(self, model_dir, quantized=False, batch_size=16, intra_op_threads=0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {inp.name for inp in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQUENCE_LENGTH)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        feeds = {name: value for name, value in feeds.items() if name in self.input_names}
+        last_hidden_state = self.session.run(None, feeds)[0]
+        cls_vectors = last_hidden_state[:, 0]
+        norms = np.linalg.norm(cls_vectors, axis=1, keepdims=True)
+        return cls_vectors / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._encode_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -1,8 +1,13 @@
 # langchain_utils/qa_chain.py
 
+import logging
 import os
 import sys
+import threading
 import uuid
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from typing import Any, Dict, List, Optional, Sequence, Union
 import traceback
 
@@ -11,7 +16,7 @@ from langchain.prompts import PromptTemplate
 from langchain.chains.llm import LLMChain
 from langchain.chains.combine_documents.stuff import StuffDocumentsChain
 from langchain.chains.mapreduce import MapReduceDocumentsChain
-from langchain_openai import AzureChatOpenAI
+from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 from langchain_core.runnables import RunnablePassthrough
 from langchain.globals import set_debug
@@ -21,17 +26,45 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from config import (AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_VERSION,
                     AZURE_OPENAI_DEPLOYMENT_NAME, AZURE_OPENAI_API_KEY,
                     TEMPERATURE, MAX_TOKENS, PDF_DIR, MAX_TOKENS_THRESHOLD,
-                    PROJECT_NAME, PERSIST_DIRECTORY)
-from langchain_utils.vectorstore import initialize_faiss_vectorstore, embeddings
+                    PROJECT_NAME, PERSIST_DIRECTORY, RETRIEVAL_SEARCH_TYPE,
+                    RETRIEVAL_MIN_K, RETRIEVAL_COMPARATIVE_MIN_K, RETRIEVAL_FETCH_K,
+                    RETRIEVAL_MMR_LAMBDA, RETRIEVAL_ELBOW_MIN_GAP, RETRIEVAL_RELATIVE_SCORE_FLOOR,
+                    LANGCHAIN_DEBUG, LANGCHAIN_VERBOSE, AZURE_OPENAI_RPM, AZURE_OPENAI_TPM,
+                    LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_TIMEOUT_S, LLM_RETRY_ATTEMPTS,
+                    LLM_RETRY_BASE_DELAY_S, LLM_RETRY_MAX_DELAY_S, INDEX_ROOT, INDEX_SNAPSHOTS_KEEP,
+                    INDEX_HOT_RELOAD, INDEX_WATCH_INTERVAL_S, INDEX_ARTIFACT, INDEX_ARTIFACT_SHA256, INDEX_PRUNE_GRACE_S,
+                    INDEX_VERIFY_CHECKSUMS, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, DEDUP_ENABLED,
+                    DEDUP_MAX_DISTANCE, RETRIEVAL_DEDUP, PARENT_CHILD_ENABLED,
+                    RETRIEVAL_CHILD_FETCH_MULTIPLIER, INDEX_SHARD_BY, INDEX_MAX_LOADED_SHARDS,
+                    RETRIEVAL_SHARD_WORKERS, RETRIEVAL_MODE, RETRIEVAL_SERVICE_ADDRESS,
+                    RETRIEVAL_SERVICE_TIMEOUT_S, RETRIEVAL_SERVICE_MAX_CONNECTIONS, EXTRACTION_CACHE_DIR,
+                    PARSER_MAX_WORKERS)
+from langchain_utils.vectorstore import (initialize_faiss_vectorstore, embeddings, warm_up_embeddings,
+                                         use_remote_embedding_stats)
+from langchain_utils.customer_matcher import CustomerMatcher
+from langchain_utils.index_snapshots import (IndexState, SnapshotWatcher, install_artifact, load_shard, load_snapshot,
+                                             pin_snapshot, prune_snapshots, publish_snapshot, read_current_version,
+                                             unpin_snapshot, write_snapshot)
+from langchain_utils.retrieval import AdaptiveRetriever, map_header
+from langchain_utils.shards import ShardedRetriever, group_documents_by_shard
+from langchain_utils.retrieval_service import RemoteRetriever, RetrievalClient
+from langchain_utils.llm_client import ScheduledAzureChatOpenAI, TokenBucketScheduler, create_http_client
 from document_processing.pdf_extractor import extract_documents_from_pdf
-from document_processing.parser import pyparse_hierarchical_chunk_text
+from document_processing.extraction_cache import ExtractionCache
+from document_processing.parser import pyparse_hierarchical_chunk_text, scan_hierarchy
+from document_processing.facts import FactsIndex, build_facts_index
+from document_processing.dedup import add_dedup_keys, deduplicate_documents
+from document_processing.child_chunks import build_parent_child_documents
+from document_processing.config import CHUNK_MAX_TOKENS, OVERLAP_RATIO, PARSER_VERSION
+
+logger = logging.getLogger(__name__)
 
 try:
     # Use the detailed system prompt suitable for MapReduce's Reduce step
     from system_prompt import system_prompt
-    print("--- Successfully imported system_prompt from system_prompt.py ---")
+    logger.debug("Successfully imported system_prompt from system_prompt.py")
 except ImportError:
-    print("--- WARNING: Could not import system_prompt. Using a basic default for Reduce step. ---")
+    logger.warning("Could not import system_prompt. Using a basic default for Reduce step.")
     system_prompt = "You are a helpful AI assistant. Synthesize the provided summaries to answer the question."
 
 
@@ -39,25 +72,65 @@ except ImportError:
 map_reduce_chain: Optional[MapReduceDocumentsChain] = None
 vectorstore = None
 retriever = None
+adaptive_retriever: Optional[AdaptiveRetriever] = None
 llm_instance = None
 detected_customer_names: List[str] = []
+customer_matcher: Optional[CustomerMatcher] = None
+facts_index: FactsIndex = FactsIndex()
 CUSTOMER_LIST_FILE = "detected_customers.txt"
+FACTS_INDEX_FILE = "facts_index.json"
+# Identifies the loaded index across workers (part of the single-flight key); set by initialize_app
+index_version = "none"
+# Snapshot being served (see activate_index_state) and the watcher that hot-swaps it
+index_state: Optional[IndexState] = None
+index_state_lock = threading.Lock()
+index_watcher: Optional[SnapshotWatcher] = None
+# Serializes activate_published_snapshot when there is no watcher, so a version is loaded once
+index_activation_lock = threading.Lock()
+# Whether searches go to the retrieval service (set by initialize_index)
+index_remote = False
+# Extracted pages on disk, so re-parsing does not rerun pymupdf4llm (created on first extraction)
+extraction_cache: Optional[ExtractionCache] = None
+# Pooled client of the retrieval service (RETRIEVAL_MODE=remote)
+retrieval_client: Optional[RetrievalClient] = None
+# One pooled HTTP client and one rate-limit budget per process, shared by every LLM instance
+llm_http_client = None
+llm_scheduler = TokenBucketScheduler(AZURE_OPENAI_RPM, AZURE_OPENAI_TPM)
+
+def get_llm_http_client():
+    global llm_http_client
+    if llm_http_client is None:
+        llm_http_client = create_http_client(LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_TIMEOUT_S)
+    return llm_http_client
+
+def get_retrieval_client() -> RetrievalClient:
+    global retrieval_client
+    if retrieval_client is None:
+        retrieval_client = RetrievalClient(RETRIEVAL_SERVICE_ADDRESS, timeout_s=RETRIEVAL_SERVICE_TIMEOUT_S,
+                                           max_connections=RETRIEVAL_SERVICE_MAX_CONNECTIONS)
+    return retrieval_client
 
 # --- MapReduce Chain Setup ---
-def setup_map_reduce_chain() -> MapReduceDocumentsChain:
+def setup_map_reduce_chain(llm=None) -> MapReduceDocumentsChain:
+    """Builds the MapReduce chain. Pass an llm (e.g. a deterministic fake) to bypass Azure OpenAI."""
     global llm_instance
-    llm_instance = AzureChatOpenAI(
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        openai_api_version=AZURE_OPENAI_API_VERSION,
-        deployment_name=AZURE_OPENAI_DEPLOYMENT_NAME,
-        openai_api_key=AZURE_OPENAI_API_KEY,
-        temperature=TEMPERATURE,
-        model_name=AZURE_OPENAI_DEPLOYMENT_NAME,
-        max_tokens=MAX_TOKENS,
-    )
-
-
-    llm = llm_instance
+    if llm is None:
+        llm_instance = ScheduledAzureChatOpenAI(
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
+            openai_api_version=AZURE_OPENAI_API_VERSION,
+            deployment_name=AZURE_OPENAI_DEPLOYMENT_NAME,
+            openai_api_key=AZURE_OPENAI_API_KEY,
+            temperature=TEMPERATURE,
+            model_name=AZURE_OPENAI_DEPLOYMENT_NAME,
+            max_tokens=MAX_TOKENS,
+            http_client=get_llm_http_client(),
+            max_retries=0,
+            scheduler=llm_scheduler,
+            retry_attempts=LLM_RETRY_ATTEMPTS,
+            retry_base_delay_s=LLM_RETRY_BASE_DELAY_S,
+            retry_max_delay_s=LLM_RETRY_MAX_DELAY_S,
+        )
+        llm = llm_instance
 
     # --- Map Prompt ---
     # Acknowledges prepended metadata and focuses on topic extraction
@@ -86,7 +159,7 @@ Document Excerpt with Metadata:
         input_variables=["page_content", "question"],
         template=map_template
     )
-    map_chain = LLMChain(llm=llm, prompt=map_prompt, verbose=True)
+    map_chain = LLMChain(llm=llm, prompt=map_prompt, verbose=LANGCHAIN_VERBOSE, name="map", tags=["map"])
 
     # --- Reduce Prompt ---
     # Uses the detailed system_prompt for synthesis from summaries
@@ -105,14 +178,14 @@ Final Answer:"""
         input_variables=["doc_summaries", "question"],
         template=reduce_template
         )
-    reduce_llm_chain = LLMChain(llm=llm, prompt=reduce_prompt, verbose=True)
+    reduce_llm_chain = LLMChain(llm=llm, prompt=reduce_prompt, verbose=LANGCHAIN_VERBOSE, name="reduce", tags=["reduce"])
 
     # Use StuffDocumentsChain for the final combination of summaries
     combine_documents_chain = StuffDocumentsChain(
         llm_chain=reduce_llm_chain,
         document_variable_name="doc_summaries",
         document_separator="\n\n---\n\n",
-        verbose=True
+        verbose=LANGCHAIN_VERBOSE
     )
 
     # --- Create the MapReduceDocumentsChain ---
@@ -122,199 +195,498 @@ Final Answer:"""
         document_variable_name="page_content",
         input_key="input_documents",
         output_key="output_text",
-        verbose=True
+        verbose=LANGCHAIN_VERBOSE
     )
     return chain
 
 
+# --- Map Step Input Preparation ---
+def prepare_docs_for_map(docs: List[Document]) -> List[Document]:
+    """
+    Prepends the Source/Page/Customer/Clause header the map prompt expects to each chunk.
+    The app gets these from RetrievedChunk.map_document; this is for plain retriever results.
+    """
+    return [Document(page_content=(doc.metadata.get('map_header') or map_header(doc.metadata)) + doc.page_content,
+                     metadata=doc.metadata) for doc in docs]
+
+
+def source_label(metadata) -> str:
+    """Display string of a chunk's source: file, customer, page and clause or section."""
+    source_str = (f"{metadata.get('source', 'Unknown Source')} (Customer: {metadata.get('customer', 'Unknown Customer')})"
+                  f" - Page {metadata.get('page_number', 'N/A')}")
+    clause_display = metadata.get('clause', None)
+    hierarchy_display = metadata.get('hierarchy', [])
+    if clause_display and clause_display != 'N/A':
+        source_str += f" (Clause: {clause_display})"
+    elif hierarchy_display:
+        source_str += f" (Section: {hierarchy_display[-1]})"
+    return source_str
+
+
+def add_precomputed_metadata(docs: List[Document]) -> None:
+    """Stores each chunk's source label, map header and dedup keys at ingestion so requests only look them up."""
+    for doc in docs:
+        doc.metadata['source_label'] = source_label(doc.metadata)
+        doc.metadata['map_header'] = map_header(doc.metadata)
+    add_dedup_keys(docs)
+
+
+def format_sources(docs: List[Document]) -> List[str]:
+    """One display string per distinct source page (the label of the first chunk seen from that page)."""
+    sources = []
+    seen_sources = set()
+    for doc in docs:
+        source_key = (doc.metadata.get('source'), doc.metadata.get('page_number'))
+        if source_key not in seen_sources:
+            # Indexes built before labels were stored fall back to building the label here
+            sources.append(doc.metadata.get('source_label') or source_label(doc.metadata))
+            seen_sources.add(source_key)
+    return sources
+
+
 # --- Document Loading and Parsing (Includes metadata handling) ---
 # (Keep print_chunk_details and load_all_documents exactly as they were)
 def print_chunk_details(chunk, index):
-    """Prints key details of a document chunk for debugging."""
+    """Logs key details of a document chunk at DEBUG level."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     metadata = chunk.metadata
-    print(f"\n--- Debug Chunk Details (Overall Index: {index}) ---")
-    print(f"  Source: {metadata.get('source', 'N/A')}")
-    print(f"  Page:   {metadata.get('page_number', 'N/A')}")
-    print(f"  Customer: {metadata.get('customer', 'N/A')}")
-    print(f"  Region: {metadata.get('region', 'N/A')}")
-    print(f"  Hierarchy: {metadata.get('hierarchy', [])}")
-    print(f"  Clause: {metadata.get('clause', 'N/A')}")
-    print(f"  Title:  {metadata.get('clause_title', 'N/A')}")
     content_snippet = chunk.page_content[:150].replace("\n", " ").replace("\r", "")
-    print(f"  Content Snippet: {content_snippet}...")
-    print("-" * 50)
-
-def load_all_documents(pdf_directory):
-    """Loads PDFs, extracts using automatic detection, parses, maintains state."""
-    all_final_documents = []
-    overall_chunk_index = 0
+    logger.debug(
+        "Chunk details (overall index %s): Source=%s, Page=%s, Customer=%s, Region=%s, Hierarchy=%s, "
+        "Clause=%s, Title=%s, Content snippet: %s...",
+        index, metadata.get('source', 'N/A'), metadata.get('page_number', 'N/A'), metadata.get('customer', 'N/A'),
+        metadata.get('region', 'N/A'), metadata.get('hierarchy', []), metadata.get('clause', 'N/A'),
+        metadata.get('clause_title', 'N/A'), content_snippet,
+    )
 
+def parse_page(doc_obj, hierarchy_stack, file_name, chunk_max_tokens=None, overlap_ratio=None):
+    """
+    Chunks one extracted page from the hierarchy stack entering it, which is updated in place (also
+    by a page that fails to parse, as its partial update carries over), and precomputes chunk metadata.
+    """
+    page_content = doc_obj.page_content
+    page_metadata = doc_obj.metadata
+    source_file = page_metadata.get('source', file_name)
+    page_number = page_metadata.get('page_number', 'N/A')
+    customer_name = page_metadata.get('customer', 'Unknown Customer')
+    region_name = page_metadata.get('region', 'Unknown Region')
+    word_count = len(page_content.split())
+
+    parser_metadata = {
+        'source': source_file, 'page_number': page_number,
+        'customer': customer_name, 'region': region_name,
+        'clause': 'N/A', 'hierarchy': []
+    }
+    parser_metadata.update({k: v for k, v in page_metadata.items() if k not in parser_metadata})
+
+    parsed_page_docs = None
+    if word_count > MAX_TOKENS_THRESHOLD:
+        try:
+            parsed_page_docs, _ = pyparse_hierarchical_chunk_text(
+                full_text=page_content, source_name=source_file,
+                page_number=page_number, extra_metadata=parser_metadata,
+                initial_stack=hierarchy_stack,
+                chunk_max_tokens=chunk_max_tokens, overlap_ratio=overlap_ratio
+            )
+        except Exception as e:
+            logger.exception("Failed to parse page %s of %s: %s", page_number, file_name, e)
+            logger.warning("Adding page %s as whole chunk due to parsing error.", page_number)
+    if parsed_page_docs is None:
+        doc_obj.metadata.update(parser_metadata)
+        doc_obj.metadata['hierarchy'] = [item[0] for item in hierarchy_stack] if hierarchy_stack else []
+        doc_obj.metadata['clause'] = hierarchy_stack[-1][0] if hierarchy_stack else 'N/A'
+        parsed_page_docs = [doc_obj]
+    add_precomputed_metadata(parsed_page_docs)
+    return parsed_page_docs
+
+
+def parse_page_documents(page_documents, file_name, chunk_max_tokens=None, overlap_ratio=None, max_workers=None):
+    """
+    Parses one PDF's extracted pages into chunks, carrying the clause hierarchy across pages.
+    With max_workers > 1, a cheap first pass (scan_hierarchy) checkpoints the hierarchy stack at each
+    page boundary and pages are chunked in worker processes, each from its checkpoint. The chunks
+    equal those of the in-order parse.
+    """
+    page_documents = list(page_documents)
+    if max_workers is None:
+        max_workers = PARSER_MAX_WORKERS
+
+    if max_workers <= 1 or len(page_documents) <= 1:
+        hierarchy_stack = []
+        parsed_pages = [parse_page(doc_obj, hierarchy_stack, file_name, chunk_max_tokens, overlap_ratio)
+                        for doc_obj in page_documents]
+    else:
+        # Pass 1: hierarchy stack entering each page (stack entries are tuples, so a shallow copy will do)
+        checkpoints = []
+        hierarchy_stack = []
+        for doc_obj in page_documents:
+            checkpoints.append(list(hierarchy_stack))
+            if len(doc_obj.page_content.split()) > MAX_TOKENS_THRESHOLD:
+                try:
+                    scan_hierarchy(doc_obj.page_content, initial_stack=hierarchy_stack,
+                                   chunk_max_tokens=chunk_max_tokens, overlap_ratio=overlap_ratio)
+                except Exception:
+                    pass  # logged when the page is parsed below
+        # Pass 2: parsing is pure Python, so pages go to processes rather than threads
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            parsed_pages = list(executor.map(
+                parse_page, page_documents, checkpoints, repeat(file_name),
+                repeat(chunk_max_tokens), repeat(overlap_ratio),
+            ))
+    return [doc for page_docs in parsed_pages for doc in page_docs]
+
+def extract_pages(pdf_path):
+    """Extracted page documents of one PDF, through the extraction cache unless EXTRACTION_CACHE_DIR is empty."""
+    global extraction_cache
+    if not EXTRACTION_CACHE_DIR:
+        return extract_documents_from_pdf(pdf_path)
+    if extraction_cache is None:
+        extraction_cache = ExtractionCache(EXTRACTION_CACHE_DIR, extract=extract_documents_from_pdf)
+    return extraction_cache.extract(pdf_path)
+
+def extract_all_pages(pdf_directory):
+    """Extracts the pages of every PDF in the directory. Returns [(file name, page documents)]."""
     if not os.path.isdir(pdf_directory):
-        print(f"ERROR: PDF directory not found: {pdf_directory}")
+        logger.error("PDF directory not found: %s", pdf_directory)
         return []
 
     pdf_files = [f for f in os.listdir(pdf_directory) if f.lower().endswith(".pdf")]
-    print(f"Found {len(pdf_files)} PDF files in {pdf_directory}")
+    logger.info("Found %s PDF files in %s", len(pdf_files), pdf_directory)
 
+    extracted = []
     for file in pdf_files:
         file_path = os.path.join(pdf_directory, file)
-        print(f"Processing {file_path}...")
+        logger.info("Processing %s...", file_path)
         try:
-            page_documents = extract_documents_from_pdf(file_path)
+            page_documents = extract_pages(file_path)
             if not page_documents:
-                 print(f"WARN: No documents extracted from {file_path}. Skipping.")
+                 logger.warning("No documents extracted from %s. Skipping.", file_path)
                  continue
         except Exception as e:
-            print(f"ERROR: Failed to extract pages from {file_path}: {e}")
-            traceback.print_exc()
+            logger.exception("Failed to extract pages from %s: %s", file_path, e)
             continue
+        extracted.append((file, page_documents))
+    return extracted
 
-        current_hierarchy_stack = []
+def load_all_documents(pdf_directory, chunk_max_tokens=None, overlap_ratio=None):
+    """Loads PDFs, extracts using automatic detection, parses, maintains state."""
+    all_final_documents = []
+    for file, page_documents in extract_all_pages(pdf_directory):
+        all_final_documents.extend(parse_page_documents(
+            page_documents, file, chunk_max_tokens=chunk_max_tokens, overlap_ratio=overlap_ratio
+        ))
+
+    logger.info("Total documents processed into chunks: %s", len(all_final_documents))
+    if DEDUP_ENABLED:
+        all_final_documents, stats = deduplicate_documents(all_final_documents, max_distance=DEDUP_MAX_DISTANCE)
+        logger.info("Deduplicated chunks: kept %s of %s (%s exact, %s near duplicates)",
+                    stats["kept"], stats["input"], stats["exact_duplicates"], stats["near_duplicates"])
+    return all_final_documents
 
-        for doc_obj in page_documents:
-            page_content = doc_obj.page_content
-            page_metadata = doc_obj.metadata
-            source_file = page_metadata.get('source', file)
-            page_number = page_metadata.get('page_number', 'N/A')
-            customer_name = page_metadata.get('customer', 'Unknown Customer')
-            region_name = page_metadata.get('region', 'Unknown Region')
-            word_count = len(page_content.split())
-
-            parser_metadata = {
-                'source': source_file, 'page_number': page_number,
-                'customer': customer_name, 'region': region_name,
-                'clause': 'N/A', 'hierarchy': []
-            }
-            parser_metadata.update({k: v for k, v in page_metadata.items() if k not in parser_metadata})
-
-            if word_count > MAX_TOKENS_THRESHOLD:
-                try:
-                    parsed_page_docs, current_hierarchy_stack = pyparse_hierarchical_chunk_text(
-                        full_text=page_content, source_name=source_file,
-                        page_number=page_number, extra_metadata=parser_metadata,
-                        initial_stack=current_hierarchy_stack
-                    )
-                    for parsed_doc in parsed_page_docs:
-                        all_final_documents.append(parsed_doc)
-                        overall_chunk_index += 1
-                except Exception as e:
-                    print(f"ERROR: Failed to parse page {page_number} of {file}: {e}")
-                    traceback.print_exc()
-                    print(f"  WARNING: Adding page {page_number} as whole chunk due to parsing error.")
-                    doc_obj.metadata.update(parser_metadata)
-                    doc_obj.metadata['hierarchy'] = [item[0] for item in current_hierarchy_stack] if current_hierarchy_stack else []
-                    doc_obj.metadata['clause'] = current_hierarchy_stack[-1][0] if current_hierarchy_stack else 'N/A'
-                    all_final_documents.append(doc_obj)
-                    overall_chunk_index += 1
-            else:
-                doc_obj.metadata.update(parser_metadata)
-                doc_obj.metadata['hierarchy'] = [item[0] for item in current_hierarchy_stack] if current_hierarchy_stack else []
-                doc_obj.metadata['clause'] = current_hierarchy_stack[-1][0] if current_hierarchy_stack else 'N/A'
-                all_final_documents.append(doc_obj)
-                overall_chunk_index += 1
 
-    print(f"Total documents processed into chunks: {len(all_final_documents)}")
-    return all_final_documents
+def compute_index_version(persist_directory: str) -> str:
+    """Version string of a saved FAISS index; identical for every worker that loads the same files."""
+    parts = []
+    for name in ("index.faiss", "index.pkl"):
+        try:
+            stat = os.stat(os.path.join(persist_directory, name))
+            parts.append(f"{stat.st_size}-{stat.st_mtime_ns}")
+        except OSError:
+            parts.append("missing")
+    return ":".join(parts)
+
+
+# --- Index snapshots ---
+def make_adaptive_retriever(vectorstore_, top_k_vectors=15) -> AdaptiveRetriever:
+    """The configured AdaptiveRetriever over one vectorstore (a whole index or one shard)."""
+    return AdaptiveRetriever(
+        vectorstore_, embeddings,
+        search_type=RETRIEVAL_SEARCH_TYPE,
+        min_k=RETRIEVAL_MIN_K,
+        max_k=top_k_vectors,
+        comparative_min_k=RETRIEVAL_COMPARATIVE_MIN_K,
+        fetch_k=RETRIEVAL_FETCH_K,
+        mmr_lambda=RETRIEVAL_MMR_LAMBDA,
+        elbow_min_gap=RETRIEVAL_ELBOW_MIN_GAP,
+        relative_score_floor=RETRIEVAL_RELATIVE_SCORE_FLOOR,
+        dedup_max_distance=DEDUP_MAX_DISTANCE if RETRIEVAL_DEDUP else None,
+        child_fetch_multiplier=RETRIEVAL_CHILD_FETCH_MULTIPLIER,
+    )
+
+
+def build_index_state(version, vectorstore_, customer_names, facts_index_, top_k_vectors=15,
+                      adaptive=None) -> IndexState:
+    """
+    Wraps a loaded vectorstore in the adaptive retriever and customer matcher a request needs.
+    A sharded snapshot passes its ShardedRetriever as `adaptive` (and no vectorstore).
+    """
+    customer_names = sorted(customer_names)
+    if adaptive is None:
+        adaptive = make_adaptive_retriever(vectorstore_, top_k_vectors)
+    return IndexState(version=version, vectorstore=vectorstore_, adaptive_retriever=adaptive,
+                      customer_names=customer_names, customer_matcher=CustomerMatcher(customer_names),
+                      facts_index=facts_index_)
+
+
+def activate_index_state(state: IndexState) -> None:
+    """
+    Makes `state` the one new requests use. Requests that already captured the previous state
+    (get_index_state) finish on it; it is freed when the last of them is done.
+    """
+    global index_state, vectorstore, retriever, adaptive_retriever, facts_index, index_version
+    global detected_customer_names, customer_matcher
+    with index_state_lock:
+        index_state = state
+        vectorstore = state.vectorstore
+        # Sharded snapshots have no single vectorstore to wrap
+        retriever = state.vectorstore.as_retriever(search_type="similarity",
+                                                   search_kwargs={"k": state.adaptive_retriever.max_k}
+                                                   ) if state.vectorstore is not None else None
+        adaptive_retriever = state.adaptive_retriever
+        facts_index = state.facts_index
+        detected_customer_names = state.customer_matcher.customer_names
+        customer_matcher = state.customer_matcher
+        index_version = state.version
+
+
+def get_index_state() -> Optional[IndexState]:
+    """The snapshot to serve one request from; capture it once per request."""
+    return index_state
+
+
+def index_compatibility() -> Dict[str, Any]:
+    """What a snapshot must have been built with for this app to serve it."""
+    return {"embedding_model": EMBEDDING_MODEL_NAME, "parser_version": PARSER_VERSION}
+
+
+def load_index_state(version: str, top_k_vectors=15, remote: bool = False) -> IndexState:
+    """
+    Loads one snapshot. With remote=True only its customer list and facts are loaded here; searches
+    go to the retrieval service, which serves the same snapshot directory.
+    """
+    vectorstore_, customer_names, facts_index_, manifest = load_snapshot(
+        INDEX_ROOT, version, embeddings, expected=index_compatibility(),
+        verify=INDEX_VERIFY_CHECKSUMS and not remote, load_vectors=not remote,
+    )
+    logger.info("Loaded index snapshot %s (%s chunks, %s shards, %s customers, %s facts)",
+                version, manifest.get("chunks"), len(manifest.get("shards") or {}) or 1, len(customer_names),
+                len(facts_index_))
+    if remote:
+        return build_index_state(version, None, customer_names, facts_index_, top_k_vectors=top_k_vectors,
+                                 adaptive=RemoteRetriever(get_retrieval_client(), max_k=top_k_vectors))
+    adaptive = None
+    if manifest.get("shards"):
+        adaptive = ShardedRetriever(
+            manifest["shards"],
+            lambda name: make_adaptive_retriever(load_shard(INDEX_ROOT, version, name, embeddings), top_k_vectors),
+            embeddings,
+            min_k=RETRIEVAL_MIN_K,
+            max_k=top_k_vectors,
+            elbow_min_gap=RETRIEVAL_ELBOW_MIN_GAP,
+            relative_score_floor=RETRIEVAL_RELATIVE_SCORE_FLOOR,
+            max_loaded=INDEX_MAX_LOADED_SHARDS,
+            max_workers=RETRIEVAL_SHARD_WORKERS,
+        )
+        # Shards load (and reload after eviction) from the snapshot directory, so keep it from being
+        # pruned until this retriever is garbage collected, i.e. no request or state still uses it
+        weakref.finalize(adaptive, unpin_snapshot, pin_snapshot(INDEX_ROOT, version))
+    return build_index_state(version, vectorstore_, customer_names, facts_index_, top_k_vectors=top_k_vectors,
+                             adaptive=adaptive)
+
+
+def build_vectorstore(documents: List[Document], parent_child: bool = PARENT_CHILD_ENABLED):
+    """
+    FAISS over the chunks. With parent_child, the vectors are the chunks' sentence / sub-clause
+    children and the chunks themselves are stored in the docstore as the parents retrieval returns.
+    """
+    if not parent_child:
+        return FAISS.from_documents(documents, embedding=embeddings)
+    children, parents = build_parent_child_documents(documents)
+    logger.info("Embedding %s child passages of %s parent chunks...", len(children), len(parents))
+    vectorstore_ = FAISS.from_documents(children, embedding=embeddings)
+    vectorstore_.docstore.add(parents)
+    return vectorstore_
+
+
+def build_snapshot_from_pdfs(pdf_directory=PDF_DIR, publish=True, root=INDEX_ROOT) -> str:
+    """Parses every PDF, embeds the chunks and writes (and by default publishes) a new snapshot under root."""
+    documents = load_all_documents(pdf_directory)
+    if not documents:
+        raise ValueError(f"No documents were loaded or processed from {pdf_directory}")
+    logger.info("Building FAISS index from %s processed chunks...", len(documents))
+    vectorstore_, shards = None, None
+    if INDEX_SHARD_BY:
+        shards = {name: build_vectorstore(docs)
+                  for name, docs in group_documents_by_shard(documents, INDEX_SHARD_BY).items()}
+    else:
+        vectorstore_ = build_vectorstore(documents)
+    customer_names = {doc.metadata.get('customer', 'Unknown Customer') for doc in documents}
+    customer_names.discard("Unknown Customer")
+    try:
+        facts_index_ = build_facts_index(documents)
+    except Exception as e:
+        logger.exception("Error building facts index: %s", e)
+        facts_index_ = FactsIndex()
+    manifest_extra = {**index_compatibility(), "embedding_backend": EMBEDDING_BACKEND,
+                      "chunk_max_tokens": CHUNK_MAX_TOKENS, "overlap_ratio": OVERLAP_RATIO,
+                      "dedup_max_distance": DEDUP_MAX_DISTANCE if DEDUP_ENABLED else None,
+                      "parent_child": PARENT_CHILD_ENABLED, "parents": len(documents),
+                      "shard_by": INDEX_SHARD_BY or None,
+                      "pdf_directory": pdf_directory}
+    version = write_snapshot(root, vectorstore_, sorted(customer_names), facts_index_, manifest_extra=manifest_extra,
+                             shards=shards)
+    if publish:
+        publish_snapshot(root, version)
+        prune_snapshots(root, INDEX_SNAPSHOTS_KEEP, grace_s=INDEX_PRUNE_GRACE_S)
+    return version
+
+
+def _load_legacy_index(top_k_vectors) -> Optional[IndexState]:
+    """Loads a pre-snapshot faiss_db directory, if one exists."""
+    if not os.path.exists(os.path.join(PERSIST_DIRECTORY, "index.faiss")):
+        return None
+    logger.warning("Serving legacy index %s; run precompute_vectorstore.py to create a versioned snapshot.",
+                   PERSIST_DIRECTORY)
+    vectorstore_ = initialize_faiss_vectorstore([], persist_directory=PERSIST_DIRECTORY)
+    try:
+        with open(CUSTOMER_LIST_FILE, "r") as f:
+            customer_names = [line.strip() for line in f if line.strip() and line.strip() != "Unknown Customer"]
+    except FileNotFoundError:
+        logger.warning("%s not found. Customer name list will be empty until index rebuild.", CUSTOMER_LIST_FILE)
+        customer_names = []
+    try:
+        facts_index_ = FactsIndex.load(FACTS_INDEX_FILE)
+    except FileNotFoundError:
+        logger.warning("%s not found. Fact lookups are disabled until index rebuild.", FACTS_INDEX_FILE)
+        facts_index_ = FactsIndex()
+    return build_index_state("legacy-" + compute_index_version(PERSIST_DIRECTORY), vectorstore_, customer_names,
+                             facts_index_, top_k_vectors=top_k_vectors)
 
 
 # --- Application Initialization ---
-def initialize_app(top_k_vectors=15):
-    """Initializes vectorstore, retriever, chain, and detected customer names."""
-    global vectorstore, retriever, map_reduce_chain, detected_customer_names
-    set_debug(True) # Keep debug mode on
-
-    # --- Vectorstore Loading/Building (remains the same) ---
-    documents_for_analysis = []
-    if os.path.exists(PERSIST_DIRECTORY):
-        print("Loading precomputed FAISS vectorstore...")
+def initialize_index(top_k_vectors=15, remote: bool = False) -> IndexState:
+    """
+    Loads and activates the current index snapshot (building and publishing one from PDF_DIR if
+    there is none) and, with INDEX_HOT_RELOAD, starts watching for newly published snapshots.
+    With remote=True the retrieval service owns the index: nothing is installed or built here.
+    """
+    global index_watcher, index_remote
+    index_remote = remote
+    use_remote_embedding_stats(get_retrieval_client() if remote else None)
+    state = None
+    if INDEX_ARTIFACT and not remote:
+        # A prebuilt artifact (see build_index.py) replaces building the index inside the app
         try:
-            vectorstore = initialize_faiss_vectorstore([], persist_directory=PERSIST_DIRECTORY)
-            print("FAISS vectorstore loaded successfully.")
-            try:
-                with open(CUSTOMER_LIST_FILE, "r") as f:
-                    detected_customer_names = sorted([line.strip() for line in f if line.strip() and line.strip() != "Unknown Customer"])
-                print(f"Loaded detected customer names from file: {detected_customer_names}")
-            except FileNotFoundError:
-                print(f"WARN: {CUSTOMER_LIST_FILE} not found. Customer name list will be empty until index rebuild.")
-                detected_customer_names = []
-            except Exception as e:
-                print(f"Error loading {CUSTOMER_LIST_FILE}: {e}")
-                detected_customer_names = []
+            artifact_version = install_artifact(INDEX_ROOT, INDEX_ARTIFACT, expected=index_compatibility(),
+                                                sha256=INDEX_ARTIFACT_SHA256)
+            if read_current_version(INDEX_ROOT) != artifact_version:
+                publish_snapshot(INDEX_ROOT, artifact_version)
         except Exception as e:
-            print(f"ERROR loading FAISS index: {e}. Will attempt to rebuild.")
-            vectorstore = None
-
-    if vectorstore is None:
-        print("Precomputed vectorstore not found or failed to load; building from scratch...")
-        documents_for_analysis = load_all_documents(PDF_DIR)
-        if not documents_for_analysis:
-             print("ERROR: No documents were loaded or processed. Check PDF_DIR and PDF files.")
-             sys.exit(1)
-        print(f"Building FAISS index from {len(documents_for_analysis)} processed chunks...")
+            logger.exception("Error installing index artifact %s: %s", INDEX_ARTIFACT.split("?", 1)[0], e)
+    version = read_current_version(INDEX_ROOT)
+    if version:
         try:
-            vectorstore = initialize_faiss_vectorstore(documents_for_analysis, persist_directory=PERSIST_DIRECTORY)
-            print("FAISS index built and saved successfully.")
-            all_names = set(doc.metadata.get('customer', 'Unknown Customer') for doc in documents_for_analysis)
-            detected_customer_names = sorted([name for name in all_names if name != "Unknown Customer"])
-            print(f"Dynamically detected customer names: {detected_customer_names}")
-            try:
-                with open(CUSTOMER_LIST_FILE, "w") as f:
-                    for name in detected_customer_names: f.write(name + "\n")
-                print(f"Saved detected customer names to {CUSTOMER_LIST_FILE}")
-            except Exception as e:
-                print(f"ERROR saving detected customer names to {CUSTOMER_LIST_FILE}: {e}")
+            state = load_index_state(version, top_k_vectors=top_k_vectors, remote=remote)
         except Exception as e:
-            print(f"ERROR building FAISS index: {e}")
-            traceback.print_exc()
-            sys.exit(1)
-
-    # --- Retriever Setup (remains the same) ---
-    if vectorstore:
+            logger.exception("Error loading index snapshot %s: %s", version, e)
+    if remote and state is None:
+        logger.error("No index snapshot under %s; start retrieval_service.py first.", INDEX_ROOT)
+        sys.exit(1)
+    if state is None and version is None:
         try:
-            retriever = vectorstore.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": top_k_vectors}
-            )
-            print(f"Retriever initialized with k={top_k_vectors}")
+            state = _load_legacy_index(top_k_vectors)
         except Exception as e:
-             print(f"ERROR creating retriever: {e}")
-             traceback.print_exc()
-             sys.exit(1)
-    else:
-        print("ERROR: Vectorstore initialization failed. Cannot create retriever.")
-        sys.exit(1)
+            logger.exception("Error loading legacy index %s: %s", PERSIST_DIRECTORY, e)
+    if state is None:
+        logger.info("No usable index snapshot; building one from %s...", PDF_DIR)
+        try:
+            state = load_index_state(build_snapshot_from_pdfs(PDF_DIR), top_k_vectors=top_k_vectors)
+        except Exception as e:
+            logger.exception("Error building index snapshot: %s", e)
+            sys.exit(1)
+    activate_index_state(state)
+    logger.info("Serving index %s%s; detected customers: %s", state.version,
+                f" through the retrieval service at {RETRIEVAL_SERVICE_ADDRESS}" if remote else "", state.customer_names)
+    if not remote:
+        warm_up_embeddings()
+
+    if INDEX_HOT_RELOAD and index_watcher is None:
+        index_watcher = SnapshotWatcher(
+            INDEX_ROOT, state.version,
+            lambda new_version: activate_index_state(
+                load_index_state(new_version, top_k_vectors=top_k_vectors, remote=remote)),
+            interval_s=INDEX_WATCH_INTERVAL_S,
+        )
+        index_watcher.start()
+    return state
+
+
+def activate_published_snapshot(version: str, top_k_vectors=15) -> None:
+    """Serves a snapshot this process just published (e.g. by ingestion) without waiting for the watcher."""
+    if index_watcher is not None:
+        index_watcher.check()
+        return
+    with index_activation_lock:
+        if index_state is None or index_state.version != version:
+            activate_index_state(load_index_state(version, top_k_vectors=top_k_vectors, remote=index_remote))
+
+
+def initialize_app(top_k_vectors=15):
+    """
+    Loads the index (in-process, or as a client of the retrieval service with RETRIEVAL_MODE=remote)
+    and sets up the chain.
+    """
+    global map_reduce_chain
+    # LangChain debug mode dumps every prompt and response; off unless LANGCHAIN_DEBUG is set
+    set_debug(LANGCHAIN_DEBUG)
+    initialize_index(top_k_vectors, remote=RETRIEVAL_MODE == "remote")
 
     # --- Chain Setup ---
     try:
-        # *** CHANGE: Setup MapReduce Chain ***
         map_reduce_chain = setup_map_reduce_chain()
-        print("MapReduce chain initialized")
+        logger.info("MapReduce chain initialized")
     except Exception as e:
-        # *** CHANGE: Error message ***
-        print(f"ERROR setting up MapReduce chain: {e}")
-        traceback.print_exc()
+        logger.exception("Error setting up MapReduce chain: %s", e)
         sys.exit(1)
 
-# --- Function to get detected names (remains the same) ---
+# --- Customer name list and query matcher ---
+def set_detected_customer_names(names: List[str]) -> None:
+    """Replaces the detected customer list and rebuilds the precompiled query matcher."""
+    global detected_customer_names, customer_matcher
+    detected_customer_names = sorted(names)
+    customer_matcher = CustomerMatcher(detected_customer_names)
+
+def get_customer_matcher() -> CustomerMatcher:
+    """Returns the matcher for the current customer list, rebuilding it only if the list changed."""
+    names = get_detected_customer_names()
+    if customer_matcher is None or customer_matcher.customer_names is not names:
+        set_detected_customer_names(names)
+    return customer_matcher
+
 def get_detected_customer_names() -> List[str]:
-    """Returns the list of customer names detected during initialization."""
+    """Returns the customer names of the snapshot being served (or of the legacy customer list file)."""
     global detected_customer_names
+    if index_state is not None:
+        return index_state.customer_matcher.customer_names
     if not detected_customer_names:
          try:
              with open(CUSTOMER_LIST_FILE, "r") as f:
-                 detected_customer_names = sorted([line.strip() for line in f if line.strip() and line.strip() != "Unknown Customer"])
-             print(f"Reloaded detected customer names in get() function: {detected_customer_names}")
+                 set_detected_customer_names([line.strip() for line in f if line.strip() and line.strip() != "Unknown Customer"])
+             logger.info("Reloaded detected customer names in get() function: %s", detected_customer_names)
          except FileNotFoundError:
-             print(f"WARN: {CUSTOMER_LIST_FILE} not found in get() function.")
+             logger.warning("%s not found in get() function.", CUSTOMER_LIST_FILE)
              return []
          except Exception as e:
-             print(f"Error loading {CUSTOMER_LIST_FILE} in get() function: {e}")
+             logger.error("Error loading %s in get() function: %s", CUSTOMER_LIST_FILE, e)
              return []
     return detected_customer_names
 
 
 # --- Direct Execution Test Block ---
 if __name__ == '__main__':
+    from logging_setup import configure_logging
+    configure_logging()
     print("Initializing MapReduce Chain directly for testing...")
     initialize_app(top_k_vectors=15) # Using k=15 for testing
     print("Initialization complete.")
@@ -336,13 +708,7 @@ if __name__ == '__main__':
             for i, d in enumerate(filtered_docs1): print(f"  {i+1}: {d.metadata.get('source')} - {d.metadata.get('customer')} - Pg {d.metadata.get('page_number')}")
 
             # --- PREPROCESSING STEP for MapReduce ---
-            processed_docs_for_map = []
-            for doc in filtered_docs1:
-                header = f"Source: {doc.metadata.get('source', 'Unknown')} | Page: {doc.metadata.get('page_number', 'N/A')} | Customer: {doc.metadata.get('customer', 'Unknown')} | Clause: {doc.metadata.get('clause', 'N/A')}\n---\n"
-                processed_docs_for_map.append(
-                    Document(page_content=header + doc.page_content, metadata=doc.metadata)
-                )
-            # -----------------------------------------
+            processed_docs_for_map = prepare_docs_for_map(filtered_docs1)
 
             chain_input1 = {"input_documents": processed_docs_for_map, "question": query1} # Use processed docs
             if processed_docs_for_map:
@@ -365,13 +731,7 @@ if __name__ == '__main__':
             for i, d in enumerate(retrieved_docs2): print(f"  {i+1}: {d.metadata.get('source')} - {d.metadata.get('customer')} - Pg {d.metadata.get('page_number')}")
 
             # --- PREPROCESSING STEP for MapReduce ---
-            processed_docs_for_map_2 = []
-            for doc in retrieved_docs2: # Use unfiltered docs for comparison
-                header = f"Source: {doc.metadata.get('source', 'Unknown')} | Page: {doc.metadata.get('page_number', 'N/A')} | Customer: {doc.metadata.get('customer', 'Unknown')} | Clause: {doc.metadata.get('clause', 'N/A')}\n---\n"
-                processed_docs_for_map_2.append(
-                    Document(page_content=header + doc.page_content, metadata=doc.metadata)
-                )
-            # -----------------------------------------
+            processed_docs_for_map_2 = prepare_docs_for_map(retrieved_docs2) # Use unfiltered docs for comparison
 
             chain_input2 = {"input_documents": processed_docs_for_map_2, "question": query2} # Use processed docs
             result2 = map_reduce_chain.invoke(chain_input2)
@@ -0,0 +1,133 @@
+# langchain_utils/query_embedding_cache.py
+
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_query(text: str) -> str:
+    """Cache key for a query: lowercased with whitespace collapsed (the bge tokenizer is uncased)."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class MicroBatchEncoder:
+    """
+    Coalesces concurrent single-query encodes that arrive within a short window into one
+    embed_documents() forward pass, run on a background thread.
+    """
+
+    def __init__(self, base_embeddings: Embeddings, window_ms: float = 5.0, max_batch_size: int = 32):
+        self.base_embeddings = base_embeddings
+        self.window_s = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batch_size_histogram: Dict[int, int] = {}
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def encode(self, text: str) -> List[float]:
+        future: Future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch):
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        with self._stats_lock:
+            self.batch_size_histogram[len(unique_texts)] = self.batch_size_histogram.get(len(unique_texts), 0) + 1
+        try:
+            vectors = self.base_embeddings.embed_documents(unique_texts)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        by_text = dict(zip(unique_texts, vectors))
+        for text, future in batch:
+            future.set_result(by_text[text])
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with an in-process LRU of normalized query -> vector and
+    micro-batched query encoding. Document embedding is passed straight through.
+    """
+
+    def __init__(self, base_embeddings: Embeddings, cache_size: int = 1024,
+                 batch_window_ms: float = 5.0, max_batch_size: int = 32):
+        self.base_embeddings = base_embeddings
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.batcher = MicroBatchEncoder(base_embeddings, window_ms=batch_window_ms, max_batch_size=max_batch_size)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base_embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+
+        vector = self.batcher.encode(key)
+
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[key] = vector
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return list(vector)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "cache_size": len(self._cache),
+                "cache_capacity": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+        with self.batcher._stats_lock:
+            stats["batch_size_histogram"] = dict(sorted(self.batcher.batch_size_histogram.items()))
+        return stats
@@ -0,0 +1,69 @@
+# langchain_utils/query_planner.py
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence
+
+from langchain_utils.metrics import REGISTRY
+from langchain_utils.retrieval import AdaptiveRetriever, RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+PLANNED_RETRIEVALS = REGISTRY.counter(
+    "legal_qa_planned_retrievals_total", "Retrievals run by the query planner, by plan (single / per_customer).",
+    ("plan",),
+)
+
+
+class RetrievalPlan(NamedTuple):
+    customers: List[Optional[str]]  # one filtered retrieval per entry; [None] is one unfiltered search
+    k_per_customer: int  # max_k of each retrieval
+
+    @property
+    def per_customer(self) -> bool:
+        return len(self.customers) > 1
+
+
+def plan_retrieval(detected_customers: Sequence[str], max_k: int, min_k_per_customer: int = 2) -> RetrievalPlan:
+    """
+    One customer: a filtered search. None: an unfiltered search. Several (comparative query): one
+    filtered search per customer, each capped at an equal share of max_k (at least min_k_per_customer).
+    """
+    if len(detected_customers) <= 1:
+        return RetrievalPlan(customers=list(detected_customers) or [None], k_per_customer=max_k)
+    return RetrievalPlan(customers=list(detected_customers),
+                         k_per_customer=max(min_k_per_customer, max_k // len(detected_customers)))
+
+
+class QueryPlanner:
+    """Runs a RetrievalPlan: per-customer retrievals in parallel on one shared query embedding."""
+
+    def __init__(self, max_workers: int = 4, min_k_per_customer: int = 2):
+        self.min_k_per_customer = min_k_per_customer
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+
+    def plan(self, detected_customers: Sequence[str], retriever: AdaptiveRetriever) -> RetrievalPlan:
+        return plan_retrieval(detected_customers, retriever.max_k, self.min_k_per_customer)
+
+    def retrieve(self, retriever: AdaptiveRetriever, query: str, plan: RetrievalPlan,
+                 callbacks=None, metadata=None) -> List[RetrievedChunk]:
+        """
+        Chunks of every planned retrieval, grouped per customer in the order the query names them.
+        Each customer's k is still chosen adaptively, up to its share.
+        """
+        if not plan.per_customer:
+            PLANNED_RETRIEVALS.inc(plan="single")
+            return retriever.retrieve(query, customer=plan.customers[0], callbacks=callbacks, metadata=metadata)
+        PLANNED_RETRIEVALS.inc(len(plan.customers), plan="per_customer")
+        query_embedding = retriever.embeddings.embed_query(query)
+        futures = [
+            self._executor.submit(retriever.retrieve, query, customer=customer, callbacks=callbacks,
+                                  metadata=metadata, query_embedding=query_embedding, max_k=plan.k_per_customer)
+            for customer in plan.customers
+        ]
+        merged = []
+        for customer, future in zip(plan.customers, futures):
+            chunks = future.result()
+            logger.debug("[Planner] %s: %s chunks (max %s)", customer, len(chunks), plan.k_per_customer)
+            merged.extend(chunks)
+        return merged
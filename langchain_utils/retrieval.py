@@ -0,0 +1,260 @@
+# langchain_utils/retrieval.py
+
+import logging
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from langchain_community.vectorstores.utils import DistanceStrategy, maximal_marginal_relevance
+from langchain_core.callbacks.manager import CallbackManager
+from langchain_core.documents import Document
+
+from document_processing.dedup import document_key_terms, document_simhash, hamming_distance
+from langchain_utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_DUPLICATES = REGISTRY.counter(
+    "legal_qa_retrieval_duplicates_dropped_total", "Retrieval candidates collapsed into a near-identical better-scored chunk."
+)
+
+
+class RetrievedChunk(NamedTuple):
+    document: Document
+    score: float  # cosine-style similarity, higher is better
+    chunk_id: str  # docstore id of the chunk
+    map_document: Optional[Document] = None  # map_header + content, ready for the map prompt
+
+
+def map_header(metadata) -> str:
+    """The Source/Page/Customer/Clause header the map prompt expects before each excerpt."""
+    return (
+        f"Source: {metadata.get('source', 'Unknown')} | "
+        f"Page: {metadata.get('page_number', 'N/A')} | "
+        f"Customer: {metadata.get('customer', 'Unknown')} | "
+        f"Clause: {metadata.get('clause', 'N/A')}\n"
+        f"---\n"
+    )
+
+
+def choose_adaptive_k(scores: Sequence[float], min_k: int, max_k: int,
+                      min_gap: float = 0.02, relative_floor: float = 0.9) -> int:
+    """
+    Picks how many of the (descending) scores to keep.
+
+    Candidates scoring below relative_floor * top score are dropped; within what is left the
+    cut is placed at the largest score gap (the elbow) if that gap is at least min_gap.
+    The result is always clamped to [min_k, max_k].
+    """
+    n = min(len(scores), max_k)
+    if n <= min_k:
+        return n
+    top = scores[0]
+    floor_k = n
+    if top > 0:
+        floor_k = sum(1 for s in scores[:n] if s >= top * relative_floor)
+    limit = max(min_k, floor_k)
+    best_gap, best_k = 0.0, limit
+    for k in range(min_k, limit):
+        gap = scores[k - 1] - scores[k]
+        if gap > best_gap:
+            best_gap, best_k = gap, k
+    if best_gap >= min_gap:
+        return best_k
+    return limit
+
+
+def selector_search_params(index, selector):
+    """FAISS search parameters restricting a search to `selector`, keeping the index's own nprobe / efSearch."""
+    import faiss
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+class AdaptiveRetriever:
+    """
+    FAISS retrieval that returns relevance scores and chooses k per query from the score curve.
+    Candidate vectors are read back from the index, so MMR never re-embeds documents.
+    Each chunk's map-ready Document (stored map_header + content) is built once and reused.
+    With dedup_max_distance set, near-identical candidates of the same customer are collapsed to
+    the best-scored one before k is chosen, so duplicates do not take k slots (or map calls).
+    In a parent-child index (vectors are sentence / sub-clause children with metadata['parent_id'])
+    children are searched and each parent clause chunk is returned once, scored by its best child.
+    """
+
+    def __init__(self, vectorstore, embeddings, search_type="similarity", min_k=4, max_k=15,
+                 comparative_min_k=10, fetch_k=40, mmr_lambda=0.5, elbow_min_gap=0.02,
+                 relative_score_floor=0.9, dedup_max_distance: Optional[int] = None,
+                 child_fetch_multiplier: int = 4):
+        if search_type not in ("similarity", "mmr"):
+            raise ValueError(f"Unsupported search_type '{search_type}'. Expected 'similarity' or 'mmr'.")
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        self.search_type = search_type
+        self.min_k = min_k
+        self.max_k = max_k
+        self.comparative_min_k = comparative_min_k
+        self.fetch_k = max(fetch_k, max_k)
+        self.mmr_lambda = mmr_lambda
+        self.elbow_min_gap = elbow_min_gap
+        self.relative_score_floor = relative_score_floor
+        self.dedup_max_distance = dedup_max_distance
+        self.child_fetch_multiplier = max(1, child_fetch_multiplier)
+        self.parent_child = self._has_child_vectors(vectorstore)
+        self._map_documents: Dict[str, Document] = {}
+        self._map_documents_lock = threading.Lock()
+        self._customer_positions: Optional[Dict[str, np.ndarray]] = None
+
+    @staticmethod
+    def _has_child_vectors(vectorstore) -> bool:
+        if not vectorstore.index_to_docstore_id:
+            return False
+        first = vectorstore.docstore.search(vectorstore.index_to_docstore_id[0])
+        return isinstance(first, Document) and 'parent_id' in first.metadata
+
+    def _distances_to_similarity(self, distances: np.ndarray) -> np.ndarray:
+        if self.vectorstore.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+            return distances
+        # IndexFlatL2 returns squared L2; for unit vectors that is 2 - 2*cos
+        return 1.0 - distances / 2.0
+
+    def map_document(self, chunk_id: str, doc: Document) -> Document:
+        """Memoized map-step payload of one chunk; indexes without stored headers build them once here."""
+        mapped = self._map_documents.get(chunk_id)
+        if mapped is None:
+            header = doc.metadata.get('map_header') or map_header(doc.metadata)
+            mapped = Document(page_content=header + doc.page_content, metadata=doc.metadata)
+            with self._map_documents_lock:
+                mapped = self._map_documents.setdefault(chunk_id, mapped)
+        return mapped
+
+    def collapse_duplicates(self, candidates):
+        """
+        Drops candidates within dedup_max_distance SimHash bits of a better one of the same customer,
+        unless their numbers, amounts or durations differ (an amended term).
+        """
+        kept, seen = [], []
+        for candidate in candidates:
+            doc = candidate[2]
+            customer = doc.metadata.get('customer')
+            content_hash = doc.metadata.get('content_hash')
+            fingerprint = document_simhash(doc)
+            terms = document_key_terms(doc)
+            if any(customer == other_customer and ((content_hash and content_hash == other_hash)
+                                                   or (terms == other_terms and
+                                                       hamming_distance(fingerprint, other) <= self.dedup_max_distance))
+                   for other_customer, other_hash, other, other_terms in seen):
+                continue
+            seen.append((customer, content_hash, fingerprint, terms))
+            kept.append(candidate)
+        if len(kept) < len(candidates):
+            RETRIEVAL_DUPLICATES.inc(len(candidates) - len(kept))
+        return kept
+
+    def customer_positions(self, customer: str) -> np.ndarray:
+        """FAISS positions of one customer's vectors (grouped once per index, on first filtered search)."""
+        if self._customer_positions is None:
+            grouped: Dict[str, List[int]] = {}
+            for position, doc_id in self.vectorstore.index_to_docstore_id.items():
+                doc = self.vectorstore.docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    grouped.setdefault(doc.metadata.get('customer'), []).append(position)
+            self._customer_positions = {name: np.array(positions, dtype=np.int64) for name, positions in grouped.items()}
+        return self._customer_positions.get(customer, np.array([], dtype=np.int64))
+
+    def search_candidates(self, query_embedding: List[float], fetch_k: int, customer: Optional[str] = None):
+        """
+        Returns [(faiss position, similarity, document)] best first, optionally for one customer only.
+        In a parent-child index the document is the parent and the position that of its best child.
+        """
+        vector = np.array([query_embedding], dtype=np.float32)
+        if self.vectorstore._normalize_L2:
+            import faiss
+            faiss.normalize_L2(vector)
+        search_k = fetch_k * self.child_fetch_multiplier if self.parent_child else fetch_k
+        if customer:
+            import faiss
+            # Search only the customer's vectors, so other customers cannot crowd it out of fetch_k
+            selector = faiss.IDSelectorBatch(self.customer_positions(customer))
+            distances, positions = self.vectorstore.index.search(
+                vector, search_k, params=selector_search_params(self.vectorstore.index, selector))
+        else:
+            distances, positions = self.vectorstore.index.search(vector, search_k)
+        similarities = self._distances_to_similarity(distances[0])
+        candidates = []
+        seen_parents = set()
+        for position, similarity in zip(positions[0], similarities):
+            if position == -1:
+                continue
+            doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[position])
+            if not isinstance(doc, Document):
+                continue
+            if customer and doc.metadata.get('customer') != customer:
+                continue
+            parent_id = doc.metadata.get('parent_id')
+            if parent_id is not None:
+                if parent_id in seen_parents:
+                    continue
+                seen_parents.add(parent_id)
+                doc = self.vectorstore.docstore.search(parent_id)
+                if not isinstance(doc, Document):
+                    continue
+            candidates.append((int(position), float(similarity), doc))
+            if len(candidates) == fetch_k:
+                break
+        return candidates
+
+    def retrieve(self, query: str, customer: Optional[str] = None, comparative: bool = False,
+                 callbacks=None, metadata=None, query_embedding: Optional[List[float]] = None,
+                 max_k: Optional[int] = None) -> List[RetrievedChunk]:
+        """
+        Retrieves chunks with scores, choosing k adaptively. Emits retriever callbacks for tracing.
+        Pass query_embedding to reuse a vector computed elsewhere (e.g. one batch encode per question set),
+        and max_k to cap k below the retriever's own (e.g. one customer's share of a comparative query).
+        """
+        callback_manager = CallbackManager.configure(callbacks, None, inheritable_metadata=metadata)
+        run_manager = callback_manager.on_retriever_start(None, query, name="AdaptiveRetriever")
+        try:
+            results = self._retrieve(query, customer=customer, comparative=comparative, query_embedding=query_embedding,
+                                     max_k=max_k)
+        except Exception as e:
+            run_manager.on_retriever_error(e)
+            raise
+        run_manager.on_retriever_end([chunk.document for chunk in results])
+        return results
+
+    def _retrieve(self, query, customer=None, comparative=False, query_embedding=None, max_k=None):
+        if query_embedding is None:
+            query_embedding = self.embeddings.embed_query(query)
+        candidates = self.search_candidates(query_embedding, self.fetch_k, customer=customer)
+        if self.dedup_max_distance is not None:
+            candidates = self.collapse_duplicates(candidates)
+        if not candidates:
+            return []
+
+        max_k = min(max_k or self.max_k, self.max_k)
+        min_k = min(self.comparative_min_k if comparative else self.min_k, max_k)
+        k = choose_adaptive_k([c[1] for c in candidates], min_k, max_k,
+                              min_gap=self.elbow_min_gap, relative_floor=self.relative_score_floor)
+
+        if self.search_type == "mmr":
+            candidate_vectors = np.vstack([self.vectorstore.index.reconstruct(c[0]) for c in candidates])
+            selected = maximal_marginal_relevance(
+                np.array(query_embedding, dtype=np.float32), candidate_vectors, lambda_mult=self.mmr_lambda, k=k
+            )
+            chosen = [candidates[i] for i in selected]
+        else:
+            chosen = candidates[:k]
+
+        logger.debug("[Retrieval] search_type=%s, chose k=%d (min_k=%d, max_k=%d, candidates=%d, top=%.4f, cut=%.4f)",
+                     self.search_type, len(chosen), min_k, max_k, len(candidates), candidates[0][1], chosen[-1][1])
+        results = []
+        for position, similarity, doc in chosen:
+            # Parents are not in index_to_docstore_id; their docstore id is on the document
+            chunk_id = doc.id or self.vectorstore.index_to_docstore_id[position]
+            results.append(RetrievedChunk(document=doc, score=similarity, chunk_id=chunk_id,
+                                          map_document=self.map_document(chunk_id, doc)))
+        return results
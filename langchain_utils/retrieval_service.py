@@ -0,0 +1,250 @@
+# langchain_utils/retrieval_service.py
+#
+# Out-of-process retrieval: one process keeps the embedding model and the index resident and
+# serves them over HTTP/JSON on a Unix socket or TCP port; web workers talk to it through
+# RemoteRetriever / RemoteEmbeddings, which stand in for AdaptiveRetriever and the embeddings.
+#
+#   POST /retrieve {"query", "customer", "comparative", "max_k", "query_embedding"}
+#        -> {"version", "chunks": [{"chunk_id", "score", "page_content", "metadata"}]}
+#   POST /embed    {"texts": [...], "query": true|false} -> {"vectors": [[...], ...]}
+#   GET  /health   -> {"version"}
+#   GET  /stats/embeddings -> the service's query-embedding cache and micro-batch stats
+#
+# Concurrent /retrieve and /embed calls share the service's CachedQueryEmbeddings, so their query
+# encodes are micro-batched into one model pass.
+
+import json
+import logging
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+from langchain_core.callbacks.manager import CallbackManager
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from langchain_utils.metrics import REGISTRY
+from langchain_utils.retrieval import RetrievedChunk, map_header
+
+logger = logging.getLogger(__name__)
+
+SERVICE_REQUESTS = REGISTRY.counter(
+    "legal_qa_retrieval_service_requests_total", "Retrieval service requests by endpoint and status.",
+    ("endpoint", "status"),
+)
+
+
+class RetrievalServiceError(RuntimeError):
+    """The retrieval service could not be reached, timed out or returned an error."""
+
+
+# --- Service ---
+class RetrievalRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled client connections are reused
+
+    def address_string(self):
+        # Unix socket peers have no (host, port)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        state = self.server.get_state()
+        if self.path == "/health":
+            self._send_json(200 if state is not None else 503, {"version": state.version if state else None})
+        elif self.path == "/stats/embeddings":
+            get_stats = getattr(state.adaptive_retriever.embeddings, "get_stats", None) if state else None
+            self._send_json(200 if get_stats else 503, get_stats() if get_stats else {"error": "No embedding stats"})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        endpoint = self.path.strip("/")
+        handler = {"retrieve": self.server.handle_retrieve, "embed": self.server.handle_embed}.get(endpoint)
+        if handler is None:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            response = handler(request)
+        except Exception as e:
+            logger.exception("Retrieval service %s failed: %s", endpoint, e)
+            SERVICE_REQUESTS.inc(endpoint=endpoint, status="error")
+            self._send_json(500, {"error": str(e)})
+            return
+        SERVICE_REQUESTS.inc(endpoint=endpoint, status="ok")
+        self._send_json(200, response)
+
+
+class _ServiceMixin:
+    """Request handling shared by the TCP and Unix socket servers."""
+    daemon_threads = True
+    get_state: Callable[[], Any]
+
+    def handle_retrieve(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        # One snapshot per request, as in the web app
+        state = self.get_state()
+        chunks = state.adaptive_retriever.retrieve(
+            request["query"], customer=request.get("customer"), comparative=bool(request.get("comparative")),
+            query_embedding=request.get("query_embedding"), max_k=request.get("max_k"),
+        )
+        return {"version": state.version, "chunks": [
+            {"chunk_id": chunk.chunk_id, "score": chunk.score, "page_content": chunk.document.page_content,
+             "metadata": chunk.document.metadata} for chunk in chunks
+        ]}
+
+    def handle_embed(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        embeddings = self.get_state().adaptive_retriever.embeddings
+        texts = request.get("texts") or []
+        if request.get("query"):
+            return {"vectors": [embeddings.embed_query(text) for text in texts]}
+        return {"vectors": embeddings.embed_documents(texts)}
+
+
+class TCPRetrievalServer(_ServiceMixin, ThreadingHTTPServer):
+    pass
+
+
+class UnixRetrievalServer(_ServiceMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def create_server(address: str, get_state: Callable[[], Any]):
+    """Service bound to "unix:///path/to.sock" or "http://host:port"; call serve_forever() on it."""
+    if address.startswith("unix://"):
+        path = address[len("unix://"):]
+        if os.path.exists(path):
+            os.unlink(path)
+        server = UnixRetrievalServer(path, RetrievalRequestHandler)
+    else:
+        host, _, port = address.replace("http://", "").rstrip("/").rpartition(":")
+        server = TCPRetrievalServer((host or "127.0.0.1", int(port)), RetrievalRequestHandler)
+    server.get_state = get_state
+    return server
+
+
+# --- Client ---
+class RetrievalClient:
+    """Pooled keep-alive client of the retrieval service (Unix socket or HTTP)."""
+
+    def __init__(self, address: str, timeout_s: float = 10.0, max_connections: int = 20):
+        self.address = address
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        timeout = httpx.Timeout(timeout_s, connect=min(timeout_s, 2.0))
+        if address.startswith("unix://"):
+            self.base_url = "http://retrieval"
+            transport = httpx.HTTPTransport(uds=address[len("unix://"):], limits=limits)
+            self._client = httpx.Client(transport=transport, timeout=timeout)
+        else:
+            self.base_url = address.rstrip("/")
+            self._client = httpx.Client(limits=limits, timeout=timeout)
+
+    def _call(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        try:
+            response = self._client.request(method, self.base_url + path, json=body)
+        except httpx.HTTPError as e:
+            raise RetrievalServiceError(f"Retrieval service {path} failed: {e}") from e
+        if response.status_code != 200:
+            raise RetrievalServiceError(f"Retrieval service {path} returned {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    def retrieve(self, query: str, **params) -> Dict[str, Any]:
+        return self._call("POST", "/retrieve", {"query": query, **params})
+
+    def embed(self, texts: List[str], query: bool = False) -> List[List[float]]:
+        return self._call("POST", "/embed", {"texts": texts, "query": query})["vectors"]
+
+    def health(self) -> Dict[str, Any]:
+        return self._call("GET", "/health")
+
+    def embedding_stats(self) -> Dict[str, Any]:
+        return self._call("GET", "/stats/embeddings")
+
+    def close(self):
+        self._client.close()
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embeddings computed by the retrieval service, so web workers never load the model."""
+
+    def __init__(self, client: RetrievalClient):
+        self.client = client
+
+    def embed_documents(self, texts):
+        return self.client.embed(list(texts))
+
+    def embed_query(self, text):
+        return self.client.embed([text], query=True)[0]
+
+
+class RemoteRetriever:
+    """AdaptiveRetriever stand-in whose searches run in the retrieval service."""
+
+    def __init__(self, client: RetrievalClient, max_k: int = 15, max_map_documents: int = 4096):
+        self.client = client
+        self.embeddings = RemoteEmbeddings(client)
+        self.max_k = max_k
+        # LRU of map-step documents for the snapshot version the service last answered from
+        self.max_map_documents = max_map_documents
+        self._map_documents: "OrderedDict[str, Document]" = OrderedDict()
+        self._map_documents_version: Optional[str] = None
+        self._map_documents_lock = threading.Lock()
+
+    def _map_document(self, version: Optional[str], chunk_id: str, doc: Document) -> Document:
+        with self._map_documents_lock:
+            if version != self._map_documents_version:
+                # Chunk ids are only stable within a snapshot
+                self._map_documents.clear()
+                self._map_documents_version = version
+            mapped = self._map_documents.get(chunk_id)
+            if mapped is not None:
+                self._map_documents.move_to_end(chunk_id)
+                return mapped
+        header = doc.metadata.get('map_header') or map_header(doc.metadata)
+        mapped = Document(page_content=header + doc.page_content, metadata=doc.metadata)
+        with self._map_documents_lock:
+            if version == self._map_documents_version:
+                self._map_documents[chunk_id] = mapped
+                while len(self._map_documents) > self.max_map_documents:
+                    self._map_documents.popitem(last=False)
+        return mapped
+
+    def retrieve(self, query: str, customer: Optional[str] = None, comparative: bool = False,
+                 callbacks=None, metadata=None, query_embedding: Optional[List[float]] = None,
+                 max_k: Optional[int] = None) -> List[RetrievedChunk]:
+        """Same contract as AdaptiveRetriever.retrieve; retriever callbacks are emitted locally."""
+        callback_manager = CallbackManager.configure(callbacks, None, inheritable_metadata=metadata)
+        run_manager = callback_manager.on_retriever_start(None, query, name="RemoteRetriever")
+        try:
+            response = self.client.retrieve(query, customer=customer, comparative=comparative,
+                                            query_embedding=query_embedding, max_k=max_k or self.max_k)
+        except Exception as e:
+            run_manager.on_retriever_error(e)
+            raise
+        results = []
+        for chunk in response["chunks"]:
+            doc = Document(id=chunk["chunk_id"], page_content=chunk["page_content"], metadata=chunk["metadata"])
+            results.append(RetrievedChunk(document=doc, score=chunk["score"], chunk_id=chunk["chunk_id"],
+                                          map_document=self._map_document(response.get("version"), chunk["chunk_id"], doc)))
+        run_manager.on_retriever_end([chunk.document for chunk in results])
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        try:
+            service = self.client.health()
+        except RetrievalServiceError as e:
+            service = {"error": str(e)}
+        return {"retrieval_service": self.client.address, **service}
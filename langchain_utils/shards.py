@@ -0,0 +1,151 @@
+# langchain_utils/shards.py
+#
+# Sharded retrieval: one FAISS index per region or customer group. ShardedRetriever routes each
+# query to the shards that can hold its answer (the customer's shard, the shards of a region named
+# in the query, or all of them), searches them in parallel and merges the scored chunks. Shards are
+# loaded on first use and the least recently used ones are dropped beyond max_loaded, so memory
+# follows the tenants being queried rather than the whole corpus.
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_utils.metrics import REGISTRY
+from langchain_utils.retrieval import RetrievedChunk, choose_adaptive_k
+
+logger = logging.getLogger(__name__)
+
+SHARD_LOADS = REGISTRY.counter("legal_qa_index_shard_loads_total", "Index shards loaded on demand.")
+SHARD_EVICTIONS = REGISTRY.counter("legal_qa_index_shard_evictions_total", "Cold index shards evicted.")
+
+# Words in a query that name a region (regions are assigned from the NewCold entity of each contract).
+# Bare "us"/"au" are left out: "tell us ..." must not restrict a search to one region.
+REGION_KEYWORDS = {
+    "AU": ("australia", "australian", "melbourne"),
+    "US": ("usa", "u.s.", "united states", "american", "burley"),
+}
+
+
+def shard_name(key: str) -> str:
+    """File-safe shard name of a region or customer ("Simplot Australia" -> "simplot-australia")."""
+    return re.sub(r'[^a-z0-9]+', '-', (key or "").lower()).strip('-') or "unknown"
+
+
+def group_documents_by_shard(documents, shard_by: str) -> Dict[str, List]:
+    """Splits chunks into shards by their "region" or "customer" metadata."""
+    if shard_by not in ("region", "customer"):
+        raise ValueError(f"Unknown shard key '{shard_by}'. Expected 'region' or 'customer'.")
+    groups: Dict[str, List] = {}
+    for doc in documents:
+        groups.setdefault(shard_name(doc.metadata.get(shard_by)), []).append(doc)
+    return groups
+
+
+def infer_regions(query: str, regions: List[str]) -> List[str]:
+    """Regions (among those indexed) named in the query, e.g. "our Australian contracts" -> ["AU"]."""
+    text = query.lower()
+    named = []
+    for region in regions:
+        words = REGION_KEYWORDS.get(region, (region.lower(),))
+        if any(re.search(rf'(?<!\w){re.escape(word)}(?!\w)', text) for word in words):
+            named.append(region)
+    return named
+
+
+class ShardedRetriever:
+    """
+    AdaptiveRetriever interface (retrieve, embeddings, max_k) over lazily loaded shards.
+    load_shard(name) returns the AdaptiveRetriever of one shard; shards describes each one
+    ({"customers": [...], "regions": [...], "chunks": n}) as recorded in the snapshot manifest.
+    """
+
+    def __init__(self, shards: Dict[str, Dict[str, Any]], load_shard: Callable[[str], Any], embeddings,
+                 min_k: int = 4, max_k: int = 15, elbow_min_gap: float = 0.02, relative_score_floor: float = 0.9,
+                 max_loaded: int = 4, max_workers: int = 4):
+        self.shards = shards
+        self.load_shard = load_shard
+        self.embeddings = embeddings
+        self.min_k = min_k
+        self.max_k = max_k
+        self.elbow_min_gap = elbow_min_gap
+        self.relative_score_floor = relative_score_floor
+        self.max_loaded = max(1, max_loaded)
+        self.total_chunks = sum(info.get("chunks", 0) for info in shards.values())
+        self._loaded: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in shards}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-search")
+        self._regions = sorted({region for info in shards.values() for region in info.get("regions", [])})
+
+    def get_shard(self, name: str):
+        """The shard's retriever, loading it (once, even under concurrent requests) and evicting the coldest."""
+        with self._lock:
+            shard = self._loaded.get(name)
+            if shard is not None:
+                self._loaded.move_to_end(name)
+                return shard
+        with self._load_locks[name]:
+            with self._lock:
+                shard = self._loaded.get(name)
+            if shard is None:
+                shard = self.load_shard(name)
+                SHARD_LOADS.inc()
+                logger.info("Loaded index shard %s (%s chunks)", name, self.shards[name].get("chunks"))
+            with self._lock:
+                self._loaded[name] = shard
+                self._loaded.move_to_end(name)
+                while len(self._loaded) > self.max_loaded:
+                    # In-flight requests keep their reference; the shard is freed once they finish
+                    evicted, _ = self._loaded.popitem(last=False)
+                    SHARD_EVICTIONS.inc()
+                    logger.info("Evicted index shard %s", evicted)
+        return shard
+
+    def route(self, query: str, customer: Optional[str] = None) -> List[str]:
+        """Shards to search: the customer's, else those of regions named in the query, else all."""
+        if customer:
+            return [name for name, info in self.shards.items() if customer in info.get("customers", [])]
+        regions = infer_regions(query, self._regions)
+        if regions:
+            return [name for name, info in self.shards.items() if set(regions) & set(info.get("regions", []))]
+        return list(self.shards)
+
+    def retrieve(self, query: str, customer: Optional[str] = None, comparative: bool = False,
+                 callbacks=None, metadata=None, query_embedding: Optional[List[float]] = None,
+                 max_k: Optional[int] = None) -> List[RetrievedChunk]:
+        """Searches the routed shards in parallel and keeps the best chunks across them (adaptive k)."""
+        names = self.route(query, customer)
+        if not names:
+            return []
+        max_k = min(max_k or self.max_k, self.max_k)
+        kwargs = dict(customer=customer, comparative=comparative, callbacks=callbacks, metadata=metadata, max_k=max_k)
+        if len(names) == 1:
+            return self.get_shard(names[0]).retrieve(query, query_embedding=query_embedding, **kwargs)
+        if query_embedding is None:
+            query_embedding = self.embeddings.embed_query(query)
+
+        def search(name):
+            return self.get_shard(name).retrieve(query, query_embedding=query_embedding, **kwargs)
+
+        futures = [self._executor.submit(search, name) for name in names]
+        merged = sorted((chunk for future in futures for chunk in future.result()), key=lambda c: c.score, reverse=True)
+        if not merged:
+            return []
+        k = choose_adaptive_k([chunk.score for chunk in merged], min(self.min_k, max_k), max_k,
+                              min_gap=self.elbow_min_gap, relative_floor=self.relative_score_floor)
+        logger.debug("[Shards] searched %s, merged %s chunks, kept %s", names, len(merged), k)
+        return merged[:k]
+
+    def search_candidates(self, query_embedding: List[float], fetch_k: int, customer: Optional[str] = None):
+        """The shards' [(shard position, similarity, document)] merged best first, as AdaptiveRetriever's."""
+        merged = [candidate for name in self.route("", customer)
+                  for candidate in self.get_shard(name).search_candidates(query_embedding, fetch_k, customer=customer)]
+        return sorted(merged, key=lambda candidate: candidate[1], reverse=True)[:fetch_k]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            loaded = list(self._loaded)
+        return {"chunks": self.total_chunks, "shards": len(self.shards), "loaded": loaded, "max_loaded": self.max_loaded}
@@ -0,0 +1,158 @@
+# langchain_utils/single_flight.py
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langchain_utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_CALLS = REGISTRY.counter(
+    "legal_qa_single_flight_total",
+    "Coalesced executions by role: leader ran the pipeline, follower/remote_follower reused its result.",
+    ["role"],
+)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SQLiteFlightStore:
+    """
+    Cross-process in-flight registry in a local SQLite file. The first worker to claim a key runs
+    it; the others poll for its JSON result. Claims expire after lease_s so a crashed leader
+    cannot block a key, and finished results are kept for result_ttl_s so late pollers find them.
+    """
+
+    def __init__(self, path: str, lease_s: float = 300.0, result_ttl_s: float = 5.0):
+        self.path = path
+        self.lease_s = lease_s
+        self.result_ttl_s = result_ttl_s
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS flights ("
+                " key TEXT PRIMARY KEY, state TEXT NOT NULL, result TEXT, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def claim(self, key: str) -> Tuple[bool, Optional[str], Optional[str]]:
+        """Returns (claimed, state, result). claimed=True means the caller must run and complete the key."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "DELETE FROM flights WHERE (state = 'running' AND updated_at < ?) OR (state != 'running' AND updated_at < ?)",
+                (now - self.lease_s, now - self.result_ttl_s),
+            )
+            row = conn.execute("SELECT state, result FROM flights WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO flights (key, state, updated_at) VALUES (?, 'running', ?)", (key, now))
+                conn.execute("COMMIT")
+                return True, None, None
+            conn.execute("COMMIT")
+            return False, row[0], row[1]
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def finish(self, key: str, state: str, result: Optional[str] = None):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE flights SET state = ?, result = ?, updated_at = ? WHERE key = ?",
+                         (state, result, time.time(), key))
+        finally:
+            conn.close()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: one caller (the leader) runs fn, the others
+    wait and share its result or exception. With a SQLiteFlightStore the same happens across
+    worker processes, for results that survive a JSON round trip.
+    """
+
+    def __init__(self, store: Optional[SQLiteFlightStore] = None, poll_interval_s: float = 0.05):
+        self.store = store
+        self.poll_interval_s = poll_interval_s
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"leader": 0, "follower": 0, "remote_follower": 0}
+
+    def _count(self, role: str):
+        with self._stats_lock:
+            self.stats[role] += 1
+        SINGLE_FLIGHT_CALLS.inc(role=role)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, str]:
+        """Runs fn once per concurrent key. Returns (result, role) where role is leader/follower/remote_follower."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            self._count("follower")
+            if call.error is not None:
+                raise call.error
+            return call.result, "follower"
+
+        try:
+            call.result, role = self._run_remote(key, fn) if self.store is not None else (fn(), "leader")
+            self._count(role)
+            return call.result, role
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _run_remote(self, key, fn):
+        while True:
+            try:
+                claimed, state, result = self.store.claim(key)
+            except sqlite3.Error as e:
+                logger.warning("Single-flight store unavailable (%s); running without cross-worker dedup", e)
+                return fn(), "leader"
+            if claimed:
+                try:
+                    value = fn()
+                except BaseException:
+                    self.store.finish(key, "error")
+                    raise
+                try:
+                    self.store.finish(key, "done", json.dumps(value))
+                except (TypeError, sqlite3.Error) as e:
+                    logger.warning("Could not publish single-flight result for other workers: %s", e)
+                    self.store.finish(key, "error")
+                return value, "leader"
+            if state == "done":
+                return json.loads(result), "remote_follower"
+            if state == "error":
+                # The other worker failed; run it here instead of propagating a remote error
+                return fn(), "leader"
+            time.sleep(self.poll_interval_s)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        total = sum(stats.values())
+        stats["dedup_rate"] = (stats["follower"] + stats["remote_follower"]) / total if total else 0.0
+        return stats
@@ -0,0 +1,127 @@
+# langchain_utils/trace_export.py
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+TRACE_RUNS = REGISTRY.counter(
+    "legal_qa_trace_runs_total", "Trace runs handed to the exporter, by outcome.", ["outcome"]
+)
+
+
+class LangSmithTraceSink:
+    """Posts batches of finished runs to LangSmith. The client is created on first export, off the request path."""
+
+    def __init__(self, client=None):
+        self._client = client
+
+    def export(self, runs: List[Dict[str, Any]]):
+        if self._client is None:
+            from langsmith import Client
+            self._client = Client(auto_batch_tracing=False)
+        self._client.batch_ingest_runs(create=runs)
+
+
+class InMemoryTraceSink:
+    """Collects exported runs in memory; delay_s and fail simulate a slow or unavailable backend."""
+
+    def __init__(self, delay_s: float = 0.0, fail: bool = False):
+        self.delay_s = delay_s
+        self.fail = fail
+        self.batches: List[List[Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def runs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [run for batch in self.batches for run in batch]
+
+    def export(self, runs: List[Dict[str, Any]]):
+        if self.delay_s:
+            time.sleep(self.delay_s)
+        if self.fail:
+            raise ConnectionError("trace backend unavailable")
+        with self._lock:
+            self.batches.append(list(runs))
+
+
+class TraceExporter:
+    """
+    Bounded queue drained by a background thread that exports runs in batches.
+    submit() never blocks: when the queue is full the run is dropped and counted.
+    """
+
+    def __init__(self, sink, max_queue_size: int = 1000, max_batch_size: int = 100, flush_interval_s: float = 1.0):
+        self.sink = sink
+        self.max_batch_size = max_batch_size
+        self.flush_interval_s = flush_interval_s
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_size)
+        self._pending = 0
+        self._pending_lock = threading.Condition()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._worker.start()
+
+    def submit(self, run: Dict[str, Any]) -> bool:
+        self._ensure_worker()
+        with self._pending_lock:
+            try:
+                self._queue.put_nowait(run)
+            except queue.Full:
+                self.dropped += 1
+                TRACE_RUNS.inc(outcome="dropped")
+                return False
+            self._pending += 1
+        return True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._export(batch)
+
+    def _export(self, batch):
+        try:
+            self.sink.export(batch)
+            self.exported += len(batch)
+            TRACE_RUNS.inc(len(batch), outcome="exported")
+        except Exception as e:
+            self.failed += len(batch)
+            TRACE_RUNS.inc(len(batch), outcome="failed")
+            logger.warning("Dropping %d trace runs after export failure: %s", len(batch), e)
+        finally:
+            with self._pending_lock:
+                self._pending -= len(batch)
+                self._pending_lock.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every submitted run has been exported (or failed). Returns False on timeout."""
+        with self._pending_lock:
+            return self._pending_lock.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"queued": self._queue.qsize(), "exported": self.exported, "dropped": self.dropped, "failed": self.failed}
@@ -1,17 +1,139 @@
+import logging
 import os
+import threading
+from typing import Optional
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from config import PERSIST_DIRECTORY, EMBEDDING_MODEL_NAME
+from config import (PERSIST_DIRECTORY, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, ONNX_MODEL_DIR,
+                    ONNX_QUANTIZE_INT8, QUERY_EMBEDDING_CACHE_SIZE,
+                    QUERY_EMBEDDING_BATCH_WINDOW_MS, QUERY_EMBEDDING_MAX_BATCH_SIZE)
+from langchain_utils.query_embedding_cache import CachedQueryEmbeddings
+from langchain_utils.metrics import REGISTRY
+from langchain_utils.retrieval_service import RetrievalClient, RetrievalServiceError
 
-# Initialize embedding model using config parameters
-embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+logger = logging.getLogger(__name__)
+
+def create_base_embeddings(backend=EMBEDDING_BACKEND, model_name=EMBEDDING_MODEL_NAME,
+                           onnx_model_dir=ONNX_MODEL_DIR, quantize=ONNX_QUANTIZE_INT8):
+    """Creates the embedding model for the configured backend ("torch" or "onnx")."""
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_name)
+    if backend == "onnx":
+        from langchain_utils.onnx_embeddings import OnnxEmbeddings, export_bge_to_onnx
+        # Exports (and quantizes) on first use; later starts load the ONNX files directly
+        export_bge_to_onnx(model_name, onnx_model_dir, quantize=quantize)
+        return OnnxEmbeddings(onnx_model_dir, quantized=quantize)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Expected 'torch' or 'onnx'.")
+
+class LazyEmbeddings(Embeddings):
+    """Creates the configured embedding model on first use, so importing this module stays cheap."""
+
+    def __init__(self, factory=create_base_embeddings):
+        self._factory = factory
+        self._model = None
+        self._lock = threading.Lock()
+
+    def get_model(self) -> Embeddings:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._factory()
+        return self._model
+
+    def embed_documents(self, texts):
+        return self.get_model().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.get_model().embed_query(text)
+
+# Initialize embedding model using config parameters (loaded on first embed call)
+base_embeddings = LazyEmbeddings()
+# Shared embeddings: query vectors are LRU-cached and concurrent query encodes are micro-batched
+embeddings = CachedQueryEmbeddings(
+    base_embeddings,
+    cache_size=QUERY_EMBEDDING_CACHE_SIZE,
+    batch_window_ms=QUERY_EMBEDDING_BATCH_WINDOW_MS,
+    max_batch_size=QUERY_EMBEDDING_MAX_BATCH_SIZE,
+)
+
+def warm_up_embeddings():
+    """Loads the embedding model now rather than on the first query."""
+    base_embeddings.get_model()
+
+# Set with RETRIEVAL_MODE=remote: queries are embedded by the retrieval service, not by `embeddings`
+remote_stats_client: Optional[RetrievalClient] = None
+
+def use_remote_embedding_stats(client: Optional[RetrievalClient]):
+    """Reports the retrieval service's embedding stats instead of this process's idle cache."""
+    global remote_stats_client
+    remote_stats_client = client
+
+def get_embedding_stats():
+    """Returns query-embedding cache hit rate and micro-batch size histogram, and where they come from."""
+    if remote_stats_client is not None:
+        return {"source": "retrieval_service", **remote_stats_client.embedding_stats()}
+    return {"source": "local", **embeddings.get_stats()}
+
+def build_faiss_index(dim, index_type="flat", n_vectors=0):
+    """Creates an empty FAISS index: "flat" (exact), "hnsw" (graph) or "ivf" (inverted lists)."""
+    import faiss
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "hnsw":
+        return faiss.IndexHNSWFlat(dim, 32)
+    if index_type == "ivf":
+        nlist = max(1, min(int(n_vectors ** 0.5), n_vectors // 39 or 1))
+        return faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+    raise ValueError(f"Unknown FAISS index type '{index_type}'. Expected 'flat', 'hnsw' or 'ivf'.")
+
+def faiss_from_embeddings(documents, vectors, embedding_function, index_type="flat", ids=None):
+    """Builds a FAISS vectorstore from precomputed vectors, without calling the embedding model."""
+    import numpy as np
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    matrix = np.asarray(vectors, dtype=np.float32)
+    index = build_faiss_index(matrix.shape[1], index_type=index_type, n_vectors=len(matrix))
+    if not index.is_trained:
+        index.train(matrix)
+    vectorstore = FAISS(embedding_function, index, InMemoryDocstore(), {})
+    vectorstore.add_embeddings(
+        [(doc.page_content, list(vec)) for doc, vec in zip(documents, matrix)],
+        metadatas=[doc.metadata for doc in documents],
+        ids=ids,
+    )
+    return vectorstore
+
+def _embedding_metrics_lines():
+    """Exposes the query-embedding cache and micro-batch histogram in the /metrics output."""
+    try:
+        stats = get_embedding_stats()
+    except RetrievalServiceError as e:
+        logger.warning("Embedding stats unavailable: %s", e)
+        return []
+    source = stats["source"]
+    lines = [
+        "# HELP legal_qa_query_embedding_cache_lookups_total Query-embedding cache lookups by result.",
+        "# TYPE legal_qa_query_embedding_cache_lookups_total counter",
+        f'legal_qa_query_embedding_cache_lookups_total{{result="hit",source="{source}"}} {stats["hits"]}',
+        f'legal_qa_query_embedding_cache_lookups_total{{result="miss",source="{source}"}} {stats["misses"]}',
+        "# HELP legal_qa_query_embedding_cache_entries Entries in the query-embedding cache.",
+        "# TYPE legal_qa_query_embedding_cache_entries gauge",
+        f'legal_qa_query_embedding_cache_entries{{source="{source}"}} {stats["cache_size"]}',
+        "# HELP legal_qa_query_embedding_batches_total Micro-batched encoder passes by batch size.",
+        "# TYPE legal_qa_query_embedding_batches_total counter",
+    ]
+    for size, count in stats["batch_size_histogram"].items():
+        lines.append(f'legal_qa_query_embedding_batches_total{{batch_size="{size}",source="{source}"}} {count}')
+    return lines
+
+REGISTRY.register_collector(_embedding_metrics_lines)
 
 def initialize_faiss_vectorstore(documents, persist_directory=PERSIST_DIRECTORY):
     if os.path.exists(persist_directory):
-        print("Loading existing FAISS vectorstore...")
+        logger.info("Loading existing FAISS vectorstore...")
         vectorstore = FAISS.load_local(persist_directory, embeddings, allow_dangerous_deserialization=True)
     else:
-        print("Creating new FAISS vectorstore with documents...")
+        logger.info("Creating new FAISS vectorstore with documents...")
         vectorstore = FAISS.from_documents(documents, embedding=embeddings)
         vectorstore.save_local(persist_directory)
-    return vectorstore
\ No newline at end of file
+    return vectorstore
@@ -0,0 +1,56 @@
+# logging_setup.py
+# Leveled logging for the app and scripts. Modules log through logging.getLogger(__name__) with
+# lazy %-style arguments, so disabled levels cost a level check and no string formatting.
+# Bulky per-request dumps are additionally gated by request sampling (see sample_request).
+import contextvars
+import logging
+import random
+import sys
+from typing import Dict, Optional
+
+from config import LOG_LEVEL, LOG_LEVELS, LOG_REQUEST_SAMPLE_RATE
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Whether the current request was picked for per-request debug dumps
+_request_sampled: contextvars.ContextVar[bool] = contextvars.ContextVar("request_debug_sampled", default=False)
+
+
+def parse_module_levels(spec: str) -> Dict[str, int]:
+    """Parses "routes=DEBUG,document_processing=WARNING" into {logger name: level}."""
+    levels = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        level_value = logging.getLevelName(level.strip().upper())
+        if not name.strip() or not isinstance(level_value, int):
+            raise ValueError(f"Invalid LOG_LEVELS entry '{item}'. Expected <module>=<LEVEL>.")
+        levels[name.strip()] = level_value
+    return levels
+
+
+def configure_logging(level: Optional[str] = None, module_levels: Optional[str] = None):
+    """Installs a single stderr handler on the root logger and applies the per-module levels."""
+    root = logging.getLogger()
+    if not any(getattr(handler, "_legal_qa_handler", False) for handler in root.handlers):
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler._legal_qa_handler = True
+        root.addHandler(handler)
+    root.setLevel((level or LOG_LEVEL).upper())
+    for name, module_level in parse_module_levels(LOG_LEVELS if module_levels is None else module_levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+
+def sample_request(rate: Optional[float] = None) -> bool:
+    """Decides once per request whether its debug dumps are logged. Call at the start of a request."""
+    rate = LOG_REQUEST_SAMPLE_RATE if rate is None else rate
+    sampled = rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+    _request_sampled.set(sampled)
+    return sampled
+
+
+def request_debug_enabled(logger: logging.Logger) -> bool:
+    """True if logger is at DEBUG and the current request was sampled; guard expensive dumps with it."""
+    return _request_sampled.get() and logger.isEnabledFor(logging.DEBUG)
@@ -1,19 +1,25 @@
 # precompute_vectorstore.py
-import os
-from config import PDF_DIR, PERSIST_DIRECTORY
-from langchain_utils.qa_chain import load_all_documents
-from langchain_utils.vectorstore import initialize_faiss_vectorstore
+# Builds a versioned index snapshot from the PDFs and publishes it as CURRENT. Running workers pick
+# up the new snapshot without a restart (see INDEX_HOT_RELOAD); in-flight requests finish on the old one.
+import argparse
+from config import PDF_DIR, INDEX_ROOT
+from langchain_utils.index_snapshots import read_current_version
+from langchain_utils.qa_chain import build_snapshot_from_pdfs
 
-def precompute():
-    if os.path.exists(PERSIST_DIRECTORY):
-        print(f"Precomputed vectorstore already exists in {PERSIST_DIRECTORY}.")
+def precompute(pdf_dir=PDF_DIR, rebuild=False):
+    current = read_current_version(INDEX_ROOT)
+    if current and not rebuild:
+        print(f"Index snapshot {current} is already published in {INDEX_ROOT} (use --rebuild to build a new one).")
     else:
-        print("Precomputing vectorstore from PDFs...")
-        # Process all PDFs to create Document objects
-        documents = load_all_documents(PDF_DIR)
-        # Build the FAISS vectorstore and save it locally
-        initialize_faiss_vectorstore(documents, persist_directory=PERSIST_DIRECTORY)
-        print("Vectorstore precomputed and saved.")
+        print("Precomputing vectorstore snapshot from PDFs...")
+        version = build_snapshot_from_pdfs(pdf_dir)
+        print(f"Snapshot {version} built and published in {INDEX_ROOT}.")
 
 if __name__ == "__main__":
-    precompute()
+    from logging_setup import configure_logging
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Build and publish a versioned index snapshot.")
+    parser.add_argument("--pdf-dir", default=PDF_DIR)
+    parser.add_argument("--rebuild", action="store_true", help="Build a new snapshot even if one is published.")
+    args = parser.parse_args()
+    precompute(args.pdf_dir, rebuild=args.rebuild)
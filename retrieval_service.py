@@ -0,0 +1,36 @@
+# retrieval_service.py
+# Runs retrieval out of process: loads the embedding model and the current index snapshot once
+# (hot-reloading new snapshots like the app) and serves searches over a Unix socket or HTTP:
+#   python retrieval_service.py --address unix:///tmp/legal-qa-retrieval.sock
+# Web workers started with RETRIEVAL_MODE=remote and the same RETRIEVAL_SERVICE_ADDRESS query it
+# instead of loading their own copy. See langchain_utils/retrieval_service.py for the protocol.
+import argparse
+
+from config import RETRIEVAL_SERVICE_ADDRESS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve index search and query embedding to the web workers.")
+    parser.add_argument("--address", default=RETRIEVAL_SERVICE_ADDRESS,
+                        help="unix:///path/to.sock or http://host:port")
+    parser.add_argument("--top-k", type=int, default=15, help="Maximum chunks per retrieval.")
+    args = parser.parse_args()
+
+    from logging_setup import configure_logging
+    configure_logging()
+    import langchain_utils.qa_chain as qa_module
+    from langchain_utils.retrieval_service import create_server
+
+    qa_module.initialize_index(top_k_vectors=args.top_k)
+    server = create_server(args.address, qa_module.get_index_state)
+    print(f"Retrieval service listening on {args.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,258 @@
 # routes.py
 
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, Response, render_template, request, jsonify
 import langchain_utils.qa_chain as qa_module
-from langchain_utils.qa_chain import get_detected_customer_names
-import markdown
-from langchain_core.callbacks.manager import CallbackManager
-from email_tracer import EmailLangChainTracer
-import re
+from document_processing.facts import format_facts_answer
+from config import (ANSWER_HTML_CACHE_SIZE, BATCH_JOBS_DIR, BATCH_MAX_WORKERS, BATCH_QUESTIONS_PER_MAP,
+                    DEDUP_ENABLED, DEDUP_MAX_DISTANCE, FACTS_LOOKUP_ENABLED, INDEX_ROOT, INDEX_SNAPSHOTS_KEEP,
+                    INDEX_PRUNE_GRACE_S, INGEST_MAX_WORKERS, PDF_DIR, LLM_REQUEST_DEADLINE_S, RETRIEVAL_MIN_K_PER_CUSTOMER,
+                    RETRIEVAL_MODE, RETRIEVAL_PLANNER_WORKERS, SINGLE_FLIGHT_ENABLED, SINGLE_FLIGHT_BACKEND,
+                    SINGLE_FLIGHT_DB_PATH, SINGLE_FLIGHT_LEASE_S, SINGLE_FLIGHT_RESULT_TTL_S)
+from email_tracer import get_tracer
+import glob
+import json
+import logging
+import os
 import sys
-import traceback
+import threading
+import time
+import uuid
+from contextlib import ExitStack
 from langchain.chains.mapreduce import MapReduceDocumentsChain # For type hint
 from langchain_core.documents import Document
+from langchain_utils.retrieval import RetrievedChunk
+from langchain_utils.answer_rendering import AnswerRenderer
+from langchain_utils.batch_qa import BatchJobStore, BatchQARunner, load_checkpoint, parse_questions, write_results
+from langchain_utils.file_lock import file_lock
+from langchain_utils.ingest import UPLOAD_STAGING_DIR, IngestQueue
+from langchain_utils.llm_client import LLMDeadlineExceeded, LLMRateLimited, llm_deadline
+from langchain_utils.metrics import (StageTimingCallbackHandler, RETRIEVED_CHUNKS, REQUEST_DURATION,
+                                     record_span, render_metrics, request_timer, span)
+from langchain_utils.query_embedding_cache import normalize_query
+from langchain_utils.query_planner import QueryPlanner
+from langchain_utils.retrieval_service import RemoteEmbeddings, RetrievalServiceError
+from langchain_utils.single_flight import SingleFlight, SQLiteFlightStore
+from langchain_utils.vectorstore import get_embedding_stats
+from logging_setup import request_debug_enabled, sample_request
 from typing import List # Import List for type hinting
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
 
 main_blueprint = Blueprint("main", __name__)
 
-# --- Helpers (generate_keyword, get_customer_filter_keyword) remain the same ---
-def generate_keyword(customer_name):
-    if not customer_name: return None
-    name_cleaned = customer_name
-    suffixes = [' Pty Ltd', ' Pty Limited', ' Ltd', ' Limited', ' Inc']
-    for suffix in suffixes:
-        if name_cleaned.endswith(suffix):
-            name_cleaned = name_cleaned[:-len(suffix)]
-            break
-    parts = name_cleaned.split()
-    return parts[0].lower() if parts else None
-
-def get_customer_filter_keyword(query):
-    detected_names = get_detected_customer_names()
-    customer_keywords_map = {}
-    for name in detected_names:
-        keyword = generate_keyword(name)
-        if keyword:
-            customer_keywords_map[keyword] = name
-            full_name_keyword = name.lower().replace(" ", "")
-            if full_name_keyword != keyword:
-                 customer_keywords_map[full_name_keyword] = name
-
-    query_lower = query.lower()
-    found_original_names = []
-    sorted_keywords = sorted(customer_keywords_map.keys(), key=len, reverse=True)
-    temp_query = query_lower
-    for query_keyword in sorted_keywords:
-        regex_pattern = rf'\b{re.escape(query_keyword)}\b'
-        match = re.search(regex_pattern, temp_query)
-        if match:
-            original_name = customer_keywords_map[query_keyword]
-            if original_name not in found_original_names:
-                 found_original_names.append(original_name)
-                 temp_query = temp_query[:match.start()] + "_"*len(query_keyword) + temp_query[match.end():]
+# Concurrent identical queries share one pipeline execution
+query_flight = None
+if SINGLE_FLIGHT_ENABLED:
+    query_flight = SingleFlight(
+        SQLiteFlightStore(SINGLE_FLIGHT_DB_PATH, lease_s=SINGLE_FLIGHT_LEASE_S, result_ttl_s=SINGLE_FLIGHT_RESULT_TTL_S)
+        if SINGLE_FLIGHT_BACKEND == "sqlite" else None
+    )
+
+# Splits comparative queries into parallel per-customer retrievals
+query_planner = QueryPlanner(max_workers=RETRIEVAL_PLANNER_WORKERS, min_k_per_customer=RETRIEVAL_MIN_K_PER_CUSTOMER)
+
+# One reusable Markdown converter per thread plus an LRU of rendered answers
+answer_renderer = AnswerRenderer(ANSWER_HTML_CACHE_SIZE)
+
+# Batch jobs started through /batch: status, checkpoints and results in BATCH_JOBS_DIR, so any worker
+# can report a job and a job interrupted by a restart can be resumed
+batch_job_store = BatchJobStore(BATCH_JOBS_DIR)
+
+# Uploaded contracts are extracted, parsed, embedded and appended as a new snapshot in the background
+# (embedded by the retrieval service with RETRIEVAL_MODE=remote, so workers never load the model)
+ingest_embeddings = (RemoteEmbeddings(qa_module.get_retrieval_client()) if RETRIEVAL_MODE == "remote"
+                     else qa_module.embeddings)
+ingest_queue = IngestQueue(
+    INDEX_ROOT, ingest_embeddings, extract=qa_module.extract_pages,
+    parse=qa_module.parse_page_documents, expected=qa_module.index_compatibility(),
+    max_workers=INGEST_MAX_WORKERS, keep=INDEX_SNAPSHOTS_KEEP, prune_grace_s=INDEX_PRUNE_GRACE_S,
+    dedup_max_distance=DEDUP_MAX_DISTANCE if DEDUP_ENABLED else None,
+    on_published=qa_module.activate_published_snapshot, corpus_dir=PDF_DIR,
+)
+
+# --- Helpers ---
+def get_customer_filter_keyword(query, found_original_names=None):
+    if found_original_names is None:
+        found_original_names = qa_module.get_customer_matcher().find_customers(query)
 
     if len(found_original_names) == 1:
         name_to_filter = found_original_names[0]
-        print(f"DEBUG [Filter]: SUCCESS - Will filter for customer metadata exactly matching: '{name_to_filter}'")
+        logger.debug("[Filter] SUCCESS - Will filter for customer metadata exactly matching: '%s'", name_to_filter)
         return name_to_filter
     elif len(found_original_names) > 1:
-        print(f"DEBUG [Filter]: Multiple customers found ({found_original_names}). No filter applied (comparative query).")
+        logger.debug("[Filter] Multiple customers found (%s). No filter applied (comparative query).", found_original_names)
         return None
     else:
-        print("DEBUG [Filter]: No specific customer detected. No filter applied.")
+        logger.debug("[Filter] No specific customer detected. No filter applied.")
         return None
+
+def query_flight_key(query, state):
+    """Single-flight key: normalized query, customer filter and the index snapshot version."""
+    detected = state.customer_matcher.find_customers(query)
+    customer = detected[0] if len(detected) == 1 else ""
+    return "\x1f".join((normalize_query(query), customer, state.version))
 # --- End Helper ---
 
 
+def process_query(user_query, user_email, state=None):
+    """
+    Runs customer detection, fact lookup, retrieval, filtering and the MapReduce chain for one
+    query against one index snapshot (the current one unless `state` is given).
+    Returns (answer_html, sources, status) with status "ok", "no_documents" or "error".
+    Every stage is recorded as a timing span.
+    """
+    if state is None:
+        state = qa_module.get_index_state()
+    answer = "An error occurred."
+    sources = []
+    status = "error"
+    retrieved_docs_for_display = []
+
+    # Setup callbacks (stage timing is always on; LangSmith tracing is optional).
+    # Handlers are passed as a list: a CallbackManager object in the run config is not
+    # inherited by the map/reduce sub-chains.
+    callbacks = [StageTimingCallbackHandler()]
+    try:
+        tracer = get_tracer()
+        if tracer is not None:
+            callbacks.append(tracer)
+    except Exception as e:
+        logger.error("Error initializing tracer: %s", e)
+    trace_metadata = {"user_email": user_email}
+
+    # Determine filtering
+    with span("customer_detection"):
+        detected_customers = state.customer_matcher.find_customers(user_query)
+        filter_customer_name = get_customer_filter_keyword(user_query, detected_customers)
+    logger.debug("Customer filter identified: %s", filter_customer_name)
+
+    # --- Fact Lookup (answers simple numeric questions without retrieval or LLM calls) ---
+    matched_facts = None
+    if FACTS_LOOKUP_ENABLED and filter_customer_name:
+        with span("fact_lookup"):
+            try:
+                matched_facts = state.facts_index.answer_query(user_query, filter_customer_name)
+            except Exception as e:
+                logger.exception("Error during fact lookup: %s", e)
+    if matched_facts:
+        logger.debug("Answered from facts index with %s facts.", len(matched_facts))
+        answer, sources = format_facts_answer(matched_facts, filter_customer_name)
+        with span("markdown_rendering"):
+            answer = answer_renderer.render(answer)
+        return answer, sources, "ok"
+
+    try:
+        # --- Retrieval ---
+        logger.debug("Retrieving documents for query: '%s'", user_query)
+        with span("retrieval"):
+            # Comparative queries get one filtered retrieval per customer instead of one shared top-k
+            plan = query_planner.plan(detected_customers, state.adaptive_retriever)
+            retrieved_chunks: List[RetrievedChunk] = query_planner.retrieve(
+                state.adaptive_retriever,
+                user_query,
+                plan,
+                callbacks=callbacks,
+                metadata=trace_metadata,
+            )
+        logger.debug("Initial retrieval found %s documents (plan: %s x max %s).",
+                     len(retrieved_chunks), plan.customers, plan.k_per_customer)
+        if request_debug_enabled(logger):
+            logger.debug("Initial retrieved docs metadata:\n%s", "\n".join(
+                f"  Doc {i+1}: Score={chunk.score:.4f}, Src={chunk.document.metadata.get('source')}, Pg={chunk.document.metadata.get('page_number')}, Cust={chunk.document.metadata.get('customer')}, Clause={chunk.document.metadata.get('clause')}"
+                for i, chunk in enumerate(retrieved_chunks)
+            ))
+
+        # --- Filtering ---
+        with span("filtering"):
+            chunks_to_process: List[RetrievedChunk] = retrieved_chunks
+            if filter_customer_name:
+                logger.debug("Applying filter for customer: '%s'", filter_customer_name)
+                filtered_chunks = [
+                    chunk for chunk in retrieved_chunks
+                    if chunk.document.metadata.get('customer', '') == filter_customer_name
+                ]
+                if not filtered_chunks:
+                     logger.warning("Post-filtering removed all documents for customer '%s'.", filter_customer_name)
+                     answer = f"I found general information related to your query, but could not find documents specifically for '{filter_customer_name}'. Please check the customer name or broaden your search."
+                     status = "no_documents"
+                     sources = []
+                     chunks_to_process = []
+                else:
+                    chunks_to_process = filtered_chunks
+                logger.debug("%s docs remaining after filtering.", len(chunks_to_process))
+                if request_debug_enabled(logger):
+                    logger.debug("Filtered docs metadata:\n%s", "\n".join(
+                        f"  Doc {i+1}: Src={chunk.document.metadata.get('source')}, Pg={chunk.document.metadata.get('page_number')}, Cust={chunk.document.metadata.get('customer')}, Clause={chunk.document.metadata.get('clause')}"
+                        for i, chunk in enumerate(chunks_to_process)
+                    ))
+            else:
+                logger.debug("No customer filter applied (comparative or no specific customer detected).")
+            docs_to_process: List[Document] = [chunk.document for chunk in chunks_to_process]
+
+        # Docs for final source display should reflect what *could* have been used
+        retrieved_docs_for_display = docs_to_process
+        RETRIEVED_CHUNKS.observe(len(docs_to_process))
+
+        # --- Chain Execution ---
+        if not docs_to_process:
+             if status != "no_documents":
+                answer = "Could not find relevant documents for your query after retrieval/filtering."
+                status = "no_documents"
+                sources = []
+        else:
+            # Map-ready payloads (metadata header + content) come precomputed with each retrieved chunk
+            with span("metadata_prefixing"):
+                processed_docs_for_map = [chunk.map_document for chunk in chunks_to_process]
+            if request_debug_enabled(logger):
+                logger.debug("Example of first processed doc content for Map:\n%s...", processed_docs_for_map[0].page_content[:500])
+
+            # *** Use the processed docs in the chain input ***
+            chain_input = {
+                "input_documents": processed_docs_for_map, # Use modified docs
+                "question": user_query
+            }
+            logger.debug("Invoking MapReduce chain...")
+            try:
+                with span("map_reduce"), llm_deadline(LLM_REQUEST_DEADLINE_S):
+                    result = qa_module.map_reduce_chain.invoke(
+                        chain_input,
+                        config={"callbacks": callbacks, "metadata": trace_metadata}
+                    )
+                answer_raw = result.get("output_text", "Error: Could not generate answer from MapReduce chain.")
+                if request_debug_enabled(logger):
+                    logger.debug("Raw LLM response (reduce step):\n%s", answer_raw)
+                answer = answer_raw
+                status = "ok" if "output_text" in result else "error"
+            except (LLMRateLimited, LLMDeadlineExceeded) as e:
+                 logger.warning("MapReduce chain gave up under rate limiting: %s", e)
+                 answer = "Error: the language model is busy right now (rate limited). Please try again in a few seconds."
+            except Exception as e:
+                 logger.exception("Error invoking MapReduce chain: %s", e)
+                 answer = "Error processing query via MapReduce chain."
+
+        # --- Source Generation (Use metadata from original docs before preprocessing) ---
+        with span("source_formatting"):
+            # Use retrieved_docs_for_display which has the original metadata
+            sources = qa_module.format_sources(retrieved_docs_for_display)
+
+        # --- Final Formatting (remains the same) ---
+        with span("markdown_rendering"):
+            if status == "ok":
+                if not isinstance(answer, str): answer = str(answer)
+                answer = answer_renderer.render(answer)
+            elif not isinstance(answer, str):
+                 answer = str(answer)
+
+    except Exception as e:
+         logger.exception("Error during document processing or chain execution: %s", e)
+         answer = "An unexpected error occurred while processing your query."
+         sources = []
+         status = "error"
+
+    return answer, sources, status
+
+
 @main_blueprint.route("/", methods=["GET", "POST"])
 def home():
     if request.method == "POST":
@@ -75,161 +264,209 @@ def home():
             user_query = request.form.get("query", "")
             user_email = request.form.get("email", "")
 
-        answer = "An error occurred."
-        sources = []
-        retrieved_docs_for_display = []
-
-        print(f"\n--- NEW REQUEST ---")
-        print(f"User Query: {user_query}")
-        print(f"User Email: {user_email}")
+        sample_request()
+        logger.info("New request from %s: %s", user_email, user_query)
 
         if not user_query.strip():
             answer = "Please enter a valid query."
             sources = None
         else:
             # Check for MapReduce chain
-            if qa_module.retriever is None or qa_module.map_reduce_chain is None:
-                 print("ERROR: Retriever or MapReduce chain not initialized!")
+            # The snapshot captured here serves the whole request, even if a newer one is swapped in meanwhile
+            state = qa_module.get_index_state()
+            if state is None or qa_module.map_reduce_chain is None:
+                 logger.error("Retriever or MapReduce chain not initialized!")
                  if request.is_json: return jsonify({"error": "System not ready"}), 500
                  else: return render_template("index.html", query=user_query, answer="Error: System not ready.", sources=None), 500
 
-            # Setup callbacks
-            try:
-                tracer = EmailLangChainTracer(project_name="pr-new-molecule-89")
-                callback_manager = CallbackManager([tracer])
-            except Exception as e:
-                print(f"Error initializing tracer: {e}")
-                callback_manager = CallbackManager([])
-
-            # Determine filtering
-            filter_customer_name = get_customer_filter_keyword(user_query)
-            print(f"DEBUG: Customer filter identified: {filter_customer_name}")
-
-            try:
-                # --- Retrieval ---
-                print(f"DEBUG: Retrieving documents for query: '{user_query}'")
-                initial_docs: List[Document] = qa_module.retriever.get_relevant_documents(
-                    user_query, callbacks=callback_manager
-                )
-                print(f"DEBUG: Initial retrieval found {len(initial_docs)} documents.")
-                print("--- Initial Retrieved Docs Metadata ---")
-                for i, doc in enumerate(initial_docs):
-                    print(f"  Doc {i+1}: Src={doc.metadata.get('source')}, Pg={doc.metadata.get('page_number')}, Cust={doc.metadata.get('customer')}, Clause={doc.metadata.get('clause')}")
-                print("--- End Initial Retrieved Docs Metadata ---")
-
-                # --- Filtering ---
-                docs_to_process: List[Document] = initial_docs
-                if filter_customer_name:
-                    print(f"DEBUG: Applying filter for customer: '{filter_customer_name}'")
-                    filtered_docs = [
-                        doc for doc in initial_docs
-                        if doc.metadata.get('customer', '') == filter_customer_name
-                    ]
-                    if not filtered_docs:
-                         print(f"WARN: Post-filtering removed all documents for customer '{filter_customer_name}'.")
-                         answer = f"I found general information related to your query, but could not find documents specifically for '{filter_customer_name}'. Please check the customer name or broaden your search."
-                         sources = []
-                         docs_to_process = []
-                    else:
-                        docs_to_process = filtered_docs
-                    print(f"DEBUG: {len(docs_to_process)} docs remaining after filtering.")
-                    print("--- Filtered Docs Metadata (if filter applied) ---")
-                    for i, doc in enumerate(docs_to_process):
-                        print(f"  Doc {i+1}: Src={doc.metadata.get('source')}, Pg={doc.metadata.get('page_number')}, Cust={doc.metadata.get('customer')}, Clause={doc.metadata.get('clause')}")
-                    print("--- End Filtered Docs Metadata ---")
-                else:
-                    print("DEBUG: No customer filter applied (comparative or no specific customer detected).")
-
-                # Docs for final source display should reflect what *could* have been used
-                retrieved_docs_for_display = docs_to_process
-
-                # --- Chain Execution ---
-                if not docs_to_process:
-                     if answer == "An error occurred.":
-                        answer = "Could not find relevant documents for your query after retrieval/filtering."
-                        sources = []
+            request_start = time.perf_counter()
+            with request_timer() as spans:
+                if query_flight is not None:
+                    (answer, sources, status), role = query_flight.do(
+                        query_flight_key(user_query, state), lambda: process_query(user_query, user_email, state)
+                    )
+                    if role != "leader":
+                        logger.info("Reused the result of an identical in-flight query (%s)", role)
+                        record_span("coalesced_wait", time.perf_counter() - request_start)
                 else:
-                    # *** WORKAROUND A: Prepend metadata to page_content for Map step ***
-                    print(f"DEBUG: Prepending metadata to content for {len(docs_to_process)} documents...")
-                    processed_docs_for_map = []
-                    for doc in docs_to_process:
-                        # Create a clear header string
-                        header = (
-                            f"Source: {doc.metadata.get('source', 'Unknown')} | "
-                            f"Page: {doc.metadata.get('page_number', 'N/A')} | "
-                            f"Customer: {doc.metadata.get('customer', 'Unknown')} | "
-                            f"Clause: {doc.metadata.get('clause', 'N/A')}\n"
-                            f"---\n"
-                        )
-                        # Create a *new* Document object with the modified content
-                        processed_docs_for_map.append(
-                            Document(page_content=header + doc.page_content, metadata=doc.metadata)
-                        )
-                    print(f"DEBUG: Example of first processed doc content for Map:\n{processed_docs_for_map[0].page_content[:500]}...")
-                    # *****************************************************************
-
-                    # *** Use the processed docs in the chain input ***
-                    chain_input = {
-                        "input_documents": processed_docs_for_map, # Use modified docs
-                        "question": user_query
-                    }
-                    print(f"DEBUG: Invoking MapReduce chain...")
-                    try:
-                        result = qa_module.map_reduce_chain.invoke(
-                            chain_input,
-                            config={"callbacks": callback_manager, "metadata": {"user_email": user_email}}
-                        )
-                        answer_raw = result.get("output_text", "Error: Could not generate answer from MapReduce chain.")
-                        print("--- Raw LLM Response (Reduce Step) ---")
-                        print(answer_raw)
-                        print("--- End Raw LLM Response ---")
-                        answer = answer_raw
-                    except Exception as e:
-                         print(f"Error invoking MapReduce chain: {e}")
-                         traceback.print_exc()
-                         answer = "Error processing query via MapReduce chain."
-
-                # --- Source Generation (Use metadata from original docs before preprocessing) ---
-                sources = []
-                seen_sources = set()
-                # Use retrieved_docs_for_display which has the original metadata
-                for doc in retrieved_docs_for_display:
-                    source_file = doc.metadata.get('source', 'Unknown Source')
-                    page_num = doc.metadata.get('page_number', 'N/A')
-                    customer_display = doc.metadata.get('customer', 'Unknown Customer')
-                    source_key = f"{source_file}|Page {page_num}"
-
-                    if source_key not in seen_sources:
-                        source_str = f"{source_file} (Customer: {customer_display}) - Page {page_num}"
-                        clause_display = doc.metadata.get('clause', None)
-                        hierarchy_display = doc.metadata.get('hierarchy', [])
-                        if clause_display and clause_display != 'N/A': source_str += f" (Clause: {clause_display})"
-                        elif hierarchy_display:
-                            try: source_str += f" (Section: {hierarchy_display[-1]})"
-                            except IndexError: pass
-                        sources.append(source_str)
-                        seen_sources.add(source_key)
-
-                # --- Final Formatting (remains the same) ---
-                if "Error:" not in answer and "Could not find" not in answer:
-                    if not isinstance(answer, str): answer = str(answer)
-                    answer = markdown.markdown(answer, extensions=['fenced_code', 'tables'])
-                elif not isinstance(answer, str):
-                     answer = str(answer)
-
-            except Exception as e:
-                 print(f"Error during document processing or chain execution: {e}")
-                 traceback.print_exc()
-                 answer = "An unexpected error occurred while processing your query."
-                 sources = []
+                    answer, sources, status = process_query(user_query, user_email, state)
+            REQUEST_DURATION.observe(time.perf_counter() - request_start, outcome=status)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("[Timing] %s", ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in spans))
 
         # --- Return Response ---
-        print(f"DEBUG: Final Answer Prepared:\n{answer[:500]}...")
-        print(f"DEBUG: Final Sources Prepared: {sources}")
+        if request_debug_enabled(logger):
+            logger.debug("Final answer prepared:\n%s...", answer[:500])
+            logger.debug("Final sources prepared: %s", sources)
         if request.is_json:
             return jsonify({"answer": answer, "sources": sources})
         else:
             return render_template("index.html", query=user_query, answer=answer, sources=sources)
 
     # GET request
-    return render_template("index.html", query="", answer="", sources=None)
\ No newline at end of file
+    return render_template("index.html", query="", answer="", sources=None)
+
+
+@main_blueprint.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus-style stage latency histograms, LLM token usage and embedding cache stats."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@main_blueprint.route("/stats/embeddings", methods=["GET"])
+def embedding_stats():
+    """Query-embedding cache hit rate and micro-batch size histogram (the retrieval service's in remote mode)."""
+    try:
+        return jsonify(get_embedding_stats())
+    except RetrievalServiceError as e:
+        return jsonify({"error": str(e)}), 503
+
+
+@main_blueprint.route("/stats/answer_html", methods=["GET"])
+def answer_html_stats():
+    """Hit rate of the rendered-answer HTML cache."""
+    return jsonify(answer_renderer.get_stats())
+
+
+@main_blueprint.route("/stats/index", methods=["GET"])
+def index_stats():
+    """Version and size of the index snapshot new requests are served from."""
+    state = qa_module.get_index_state()
+    if state is None:
+        return jsonify({"version": None})
+    stats = {"customers": len(state.customer_names), "facts": len(state.facts_index)}
+    if state.vectorstore is None:
+        # Sharded snapshot (loaded shards) or retrieval service (its health)
+        stats.update(state.adaptive_retriever.get_stats())
+    else:
+        stats["chunks"] = len(state.vectorstore.index_to_docstore_id)
+    return jsonify({"version": state.version, **stats})
+
+
+@main_blueprint.route("/stats/single_flight", methods=["GET"])
+def single_flight_stats():
+    """Leader/follower counts and dedup rate of coalesced identical queries."""
+    return jsonify(query_flight.get_stats() if query_flight is not None else {"enabled": False})
+
+def run_batch_job(job_id, job, questions, customers, state, lock):
+    """Runs a batch job while holding its lock, saving progress and runner stats after every answer."""
+    runner = BatchQARunner(
+        state.adaptive_retriever, qa_module.map_reduce_chain.llm_chain.llm,
+        qa_module.map_reduce_chain.reduce_documents_chain,
+        facts_index=state.facts_index if FACTS_LOOKUP_ENABLED else None,
+        max_workers=BATCH_MAX_WORKERS, questions_per_map=BATCH_QUESTIONS_PER_MAP,
+        checkpoint_path=batch_job_store.path(job_id, ".checkpoint.jsonl"),
+    )
+    progress_lock = threading.Lock()
+
+    def progress(result):
+        with progress_lock:
+            job.update(completed=job["completed"] + 1, stats=runner.get_stats())
+            batch_job_store.save(job_id, job)
+
+    with lock:
+        try:
+            results = runner.run(questions, customers, progress=progress)
+            write_results(results, batch_job_store.path(job_id, ".jsonl"))
+            job.update(status="done", completed=len(results), stats=runner.get_stats())
+        except Exception as e:
+            logger.exception("Batch job %s failed: %s", job_id, e)
+            job.update(status="error", error=str(e), stats=runner.get_stats())
+        batch_job_store.save(job_id, job)
+
+
+@main_blueprint.route("/batch", methods=["POST"])
+def start_batch():
+    """
+    Starts a batch job from {"questions": [str | {"id", "question"}], "customers": [str]} (customers
+    default to every detected customer). Returns the job id to poll at /batch/<job_id>. Posting
+    {"job_id": ...} of an interrupted job resumes it from its checkpoint, with its saved questions
+    and customers unless new ones are given.
+    """
+    data = request.get_json(silent=True) or {}
+    job_id = data.get("job_id")
+    previous = None
+    if job_id is not None:
+        previous = batch_job_store.load(str(job_id))
+        if previous is None:
+            return jsonify({"error": "Unknown batch job"}), 404
+        if previous["status"] == "done":
+            return jsonify({"error": "Batch job is already done."}), 409
+    try:
+        questions = parse_questions(data.get("questions") or (previous or {}).get("questions") or [])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # A job runs entirely on the snapshot that was current when it (re)started
+    state = qa_module.get_index_state()
+    if state is None or qa_module.map_reduce_chain is None:
+        return jsonify({"error": "System not ready"}), 500
+    customers = data.get("customers") or (previous or {}).get("customers") or state.customer_names
+    if not questions or not customers:
+        return jsonify({"error": "Provide a non-empty 'questions' list and at least one customer."}), 400
+    if not isinstance(customers, list) or not all(isinstance(c, str) and c for c in customers):
+        return jsonify({"error": "'customers' must be a list of customer names."}), 400
+
+    job_id = job_id or uuid.uuid4().hex
+    # Held by the runner until the job ends (or its process dies), so a running job is not started twice
+    lock = ExitStack()
+    try:
+        lock.enter_context(file_lock(batch_job_store.path(job_id, ".lock"), blocking=False))
+    except BlockingIOError:
+        return jsonify({"error": "Batch job is already running."}), 409
+    done = load_checkpoint(batch_job_store.path(job_id, ".checkpoint.jsonl"))
+    job = {"status": "running", "total": len(questions) * len(customers),
+           "completed": sum(1 for c in customers for q in questions if (c, q.id) in done),
+           "index_version": state.version, "questions": [q._asdict() for q in questions], "customers": customers}
+    batch_job_store.save(job_id, job)
+    threading.Thread(target=run_batch_job, args=(job_id, job, questions, customers, state, lock), daemon=True,
+                     name=f"batch-{job_id[:8]}").start()
+    logger.info("%s batch job %s: %d questions x %d customers", "Resumed" if previous else "Started",
+                job_id, len(questions), len(customers))
+    return jsonify({"job_id": job_id}), 202
+
+
+@main_blueprint.route("/batch/<job_id>", methods=["GET"])
+def batch_status(job_id):
+    """Progress and map-call savings of a batch job; includes the results once it is done."""
+    job = batch_job_store.load(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown batch job"}), 404
+    status = {key: job[key] for key in ("status", "total", "completed", "index_version", "stats", "error")
+              if key in job}
+    if job["status"] == "done":
+        with open(batch_job_store.path(job_id, ".jsonl")) as f:
+            status["results"] = [json.loads(line) for line in f if line.strip()]
+    return jsonify(status)
+
+
+@main_blueprint.route("/ingest", methods=["POST"])
+def start_ingest():
+    """
+    Stages an uploaded contract (multipart field "file") and queues it for ingestion; it moves into
+    PDF_DIR once its snapshot is published and is dropped if the job fails, so it can be re-uploaded.
+    Returns the job id to poll at /ingest/<job_id>; queries keep using the current snapshot meanwhile.
+    """
+    upload = request.files.get("file")
+    file_name = secure_filename(upload.filename) if upload is not None and upload.filename else ""
+    if not file_name.lower().endswith(".pdf"):
+        return jsonify({"error": "Upload a PDF in the 'file' field."}), 400
+    pdf_path = os.path.join(PDF_DIR, file_name)
+    if os.path.exists(pdf_path):
+        return jsonify({"error": f"{file_name} is already in the corpus."}), 409
+    staging_root = os.path.join(PDF_DIR, UPLOAD_STAGING_DIR)
+    if glob.glob(os.path.join(glob.escape(staging_root), "*", glob.escape(file_name))):
+        return jsonify({"error": f"{file_name} is already being ingested."}), 409
+    staging_dir = os.path.join(staging_root, uuid.uuid4().hex)
+    os.makedirs(staging_dir)
+    staged_path = os.path.join(staging_dir, file_name)
+    upload.save(staged_path)
+    return jsonify({"job_id": ingest_queue.submit(staged_path)}), 202
+
+
+@main_blueprint.route("/ingest/<job_id>", methods=["GET"])
+def ingest_status(job_id):
+    """Status, current stage, per-stage timings and (once done) the published snapshot of an ingestion job."""
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown ingestion job"}), 404
+    return jsonify(job)
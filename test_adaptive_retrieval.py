@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.retrieval import AdaptiveRetriever, choose_adaptive_k
+
+
+@pytest.mark.parametrize("scores, min_k, max_k, expected", [
+    ([0.92, 0.91, 0.90, 0.70, 0.69, 0.68], 2, 6, 3),  # cut at the clear gap
+    ([0.80, 0.80, 0.79, 0.79, 0.78, 0.78], 2, 6, 6),  # flat scores: keep up to max_k
+    ([0.92, 0.50, 0.49, 0.48], 3, 6, 3),              # floor and gap both below min_k: clamped up
+    ([0.90] * 20, 2, 5, 5),                           # clamped down to max_k
+    ([0.92, 0.91], 4, 10, 2),                         # fewer candidates than min_k
+])
+def test_choose_adaptive_k(scores, min_k, max_k, expected):
+    assert choose_adaptive_k(scores, min_k, max_k, min_gap=0.02, relative_floor=0.9) == expected
+
+
+def test_comparative_queries_keep_at_least_comparative_min_k():
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    texts = [f"Acme clause {i}." for i in range(12)]
+    vectorstore = FAISS.from_texts(texts, embeddings)
+    retriever = AdaptiveRetriever(vectorstore, embeddings, min_k=1, max_k=10, comparative_min_k=8,
+                                  relative_score_floor=0.99, elbow_min_gap=0.0)
+
+    assert len(retriever.retrieve(texts[0])) < 8
+    assert len(retriever.retrieve(texts[0], comparative=True)) == 8
+
+
+def test_mmr_skips_near_duplicates_using_stored_vectors():
+    vectors = {"fee": [1.0, 0.0], "fee again": [0.999, 0.045], "temperature": [0.8, 0.6]}
+    embeddings = DeterministicFakeEmbeddings(size=2)
+    vectorstore = FAISS.from_embeddings(
+        [(text, list(np.array(v) / np.linalg.norm(v))) for text, v in vectors.items()], embeddings)
+    query = [1.0, 0.0]
+
+    similarity = AdaptiveRetriever(vectorstore, embeddings, search_type="similarity", min_k=2, max_k=2)
+    mmr = AdaptiveRetriever(vectorstore, embeddings, search_type="mmr", min_k=2, max_k=2, mmr_lambda=0.3)
+
+    assert [c.document.page_content for c in similarity.retrieve("q", query_embedding=query)] == ["fee", "fee again"]
+    assert [c.document.page_content for c in mmr.retrieve("q", query_embedding=query)] == ["fee", "temperature"]
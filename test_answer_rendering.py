@@ -0,0 +1,12 @@
+import markdown
+
+from langchain_utils.answer_rendering import AnswerRenderer
+
+
+def test_reused_converter_matches_fresh_render_and_caches():
+    renderer = AnswerRenderer(cache_size=2)
+    answers = ["**Payment** within 30 days[^1].\n\n| a | b |\n|---|---|\n| 1 | 2 |", "```\ncode\n```", "- one\n- two"]
+    for answer in answers + answers[-1:]:
+        assert renderer.render(answer) == markdown.markdown(answer, extensions=['fenced_code', 'tables'])
+    assert renderer.get_stats()["hits"] == 1
+    assert renderer.get_stats()["size"] == 2
@@ -0,0 +1,93 @@
+import json
+import time
+
+from flask import Flask
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+import routes
+from document_processing.facts import FactsIndex
+from langchain_utils.batch_qa import BatchJobStore, BatchQARunner, BatchQuestion, load_checkpoint
+from langchain_utils.customer_matcher import CustomerMatcher
+from langchain_utils.fake_llm import DeterministicFakeChatModel, DeterministicFakeEmbeddings
+from langchain_utils.index_snapshots import IndexState
+from langchain_utils.qa_chain import setup_map_reduce_chain
+from langchain_utils.retrieval import AdaptiveRetriever
+
+QUESTIONS = [
+    BatchQuestion("1", "What are the payment terms?"),
+    BatchQuestion("2", "Who pays for freight?"),
+    BatchQuestion("3", "How long is the initial term?"),
+]
+
+
+def _runner(llm, checkpoint_path=None):
+    embeddings = DeterministicFakeEmbeddings(size=32)
+    docs = [
+        Document(page_content=f"Clause {i} text. Obligations of the parties under clause {i}.",
+                 metadata={"source": f"{customer}.pdf", "page_number": i, "customer": customer, "clause": str(i)})
+        for customer in ("Acme", "Globex") for i in range(1, 7)
+    ]
+    vectorstore = FAISS.from_documents(docs, embeddings)
+    # min_k == max_k: every question retrieves all six chunks of the customer
+    retriever = AdaptiveRetriever(vectorstore, embeddings, min_k=6, max_k=6, fetch_k=12)
+    chain = setup_map_reduce_chain(llm=llm)
+    return BatchQARunner(retriever, llm, chain.reduce_documents_chain, max_workers=4, questions_per_map=8,
+                         checkpoint_path=checkpoint_path)
+
+
+def test_chunks_shared_by_questions_are_mapped_once():
+    llm = DeterministicFakeChatModel()
+    runner = _runner(llm)
+    results = runner.run(QUESTIONS, ["Acme", "Globex"])
+
+    assert [(r["customer"], r["question_id"]) for r in results] == [
+        (c, q.id) for c in ("Acme", "Globex") for q in QUESTIONS]
+    assert all(r["method"] == "map_reduce" and r["sources"] for r in results)
+    stats = runner.get_stats()
+    assert stats["chunk_question_pairs"] == 36
+    assert llm.call_counts == {"map": 12, "reduce": 6}
+    assert stats["map_calls_saved"] == 24
+
+
+def test_resume_skips_completed_pairs(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    _runner(DeterministicFakeChatModel(), checkpoint).run(QUESTIONS[:2], ["Acme"])
+    assert len(load_checkpoint(checkpoint)) == 2
+
+    llm = DeterministicFakeChatModel()
+    runner = _runner(llm, checkpoint)
+    results = runner.run(QUESTIONS, ["Acme"])
+    assert len(results) == 3
+    assert runner.get_stats()["resumed"] == 2
+    assert llm.call_counts["reduce"] == 1
+
+
+def test_api_jobs_are_shared_through_the_jobs_dir_and_resume_from_their_checkpoint(tmp_path, monkeypatch):
+    runner = _runner(DeterministicFakeChatModel())
+    state = IndexState("v1", runner.retriever.vectorstore, runner.retriever, ["Acme", "Globex"],
+                       CustomerMatcher(["Acme", "Globex"]), FactsIndex())
+    monkeypatch.setattr(routes, "batch_job_store", BatchJobStore(str(tmp_path)))
+    monkeypatch.setattr(routes.qa_module, "get_index_state", lambda: state)
+    monkeypatch.setattr(routes.qa_module, "map_reduce_chain", setup_map_reduce_chain(llm=DeterministicFakeChatModel()))
+    app = Flask(__name__)
+    app.register_blueprint(routes.main_blueprint)
+    client = app.test_client()
+
+    assert client.post("/batch", json={"questions": [{"id": "1"}]}).status_code == 400
+
+    # A job interrupted after answering two questions for Acme, as left behind by a dead worker
+    job_id = "0" * 32
+    _runner(DeterministicFakeChatModel(), str(tmp_path / f"{job_id}.checkpoint.jsonl")).run(QUESTIONS[:2], ["Acme"])
+    BatchJobStore(str(tmp_path)).save(job_id, {"status": "running", "total": 3, "completed": 2,
+                                               "questions": [q._asdict() for q in QUESTIONS], "customers": ["Acme"]})
+    assert client.post("/batch", json={"job_id": job_id}).status_code == 202
+
+    deadline = time.time() + 30
+    while json.load(open(tmp_path / f"{job_id}.json"))["status"] == "running" and time.time() < deadline:
+        time.sleep(0.05)
+    status = client.get(f"/batch/{job_id}").get_json()
+    assert status["status"] == "done" and status["completed"] == 3 and len(status["results"]) == 3
+    assert status["stats"]["resumed"] == 2 and status["stats"]["reduce_calls"] == 1
+    assert client.post("/batch", json={"job_id": job_id}).status_code == 409
+    assert client.get("/batch/unknown").status_code == 404
@@ -0,0 +1,29 @@
+# test_customer_matcher.py
+from langchain_utils.customer_matcher import CustomerMatcher
+
+CUSTOMERS = ["Lactalis Australia", "Patties Foods", "Simplot Australia"]
+
+
+def test_single_customer_detected():
+    matcher = CustomerMatcher(CUSTOMERS)
+    assert matcher.find_customers("Which clause deals with termination in Lactalis?") == ["Lactalis Australia"]
+    assert matcher.find_customers("storage terms for simplotaustralia") == ["Simplot Australia"]
+
+
+def test_comparative_query_finds_all_customers():
+    matcher = CustomerMatcher(CUSTOMERS)
+    found = matcher.find_customers("compare termination clauses in simplot and patties contracts")
+    assert found == ["Simplot Australia", "Patties Foods"]
+
+
+def test_keywords_respect_word_boundaries():
+    matcher = CustomerMatcher(CUSTOMERS)
+    assert matcher.find_customers("what about simplotting or pattiesfoodstuff") == []
+    assert matcher.find_customers("no customer here") == []
+
+
+def test_shared_prefixes_and_many_customers():
+    names = [f"Customer{i} Pty Ltd" for i in range(500)] + ["Cust Limited"]
+    matcher = CustomerMatcher(names)
+    assert matcher.find_customers("terms for customer42 and customer420") == ["Customer42 Pty Ltd", "Customer420 Pty Ltd"]
+    assert matcher.find_customers("what does cust owe") == ["Cust Limited"]
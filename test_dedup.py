@@ -0,0 +1,56 @@
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from document_processing.dedup import add_dedup_keys, deduplicate_documents, document_simhash, hamming_distance
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.retrieval import AdaptiveRetriever
+
+CLAUSE = " ".join(f"Under item {i} the Operator shall keep pallet lot {i * 7} below minus eighteen degrees Celsius "
+                  f"and report excursion number {i} to the Customer within two Business Days." for i in range(20))
+
+
+def _doc(text, customer="Acme", source="acme.pdf"):
+    return Document(page_content=text, metadata={"customer": customer, "source": source, "page_number": 1})
+
+
+def test_exact_and_near_duplicates_collapse_per_customer():
+    docs = [
+        _doc(CLAUSE),
+        _doc("DocuSign Envelope ID: 1A2B-3C4D\n" + (CLAUSE).upper(), source="acme-resigned.pdf"),
+        _doc(CLAUSE + "Amended by the parties.", source="acme-amendment.pdf"),
+        _doc(CLAUSE, customer="Globex", source="globex.pdf"),
+        _doc("Either party may terminate this Agreement for convenience on six months written notice."),
+    ]
+    kept, stats = deduplicate_documents(docs, max_distance=6)
+    assert [d.metadata["source"] for d in kept] == ["acme.pdf", "globex.pdf", "acme.pdf"]
+    assert (stats["exact_duplicates"], stats["near_duplicates"]) == (1, 1)
+    assert kept[0].metadata["duplicate_sources"] == ["acme-resigned.pdf p.1", "acme-amendment.pdf p.1"]
+
+
+def test_retrieval_collapses_duplicate_candidates():
+    docs = [_doc(CLAUSE), _doc(CLAUSE + "Amended.", source="acme-amendment.pdf")] + [
+        _doc(f"Unrelated clause number {i} about invoicing and payment of storage charges.", source="other.pdf")
+        for i in range(4)]
+    add_dedup_keys(docs)
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    retriever = AdaptiveRetriever(FAISS.from_documents(docs, embeddings), embeddings, min_k=6, max_k=6,
+                                  dedup_max_distance=6)
+    sources = [chunk.document.metadata["source"] for chunk in retriever.retrieve("temperature", customer="Acme")]
+    assert len(sources) == 5
+    assert sources.count("acme.pdf") + sources.count("acme-amendment.pdf") == 1
+
+
+def test_amended_terms_are_never_collapsed():
+    payment = " ".join(f"Invoice item {i} covers handling of pallet lot {i * 7} at the Warehouse." for i in range(40))
+    original = _doc(payment + " The Customer shall pay each invoice within thirty (30) days.")
+    amended = _doc(payment + " The Customer shall pay each invoice within sixty (60) days.", source="acme-amendment.pdf")
+    assert hamming_distance(document_simhash(original), document_simhash(amended)) <= 6
+
+    kept, stats = deduplicate_documents([original, amended], max_distance=6)
+    assert [d.metadata["source"] for d in kept] == ["acme.pdf", "acme-amendment.pdf"]
+    assert stats["near_duplicates"] == 0
+
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    retriever = AdaptiveRetriever(FAISS.from_documents(kept, embeddings), embeddings, min_k=2, max_k=2,
+                                  dedup_max_distance=6)
+    assert len(retriever.retrieve("payment terms", customer="Acme")) == 2
@@ -0,0 +1,40 @@
+# test_embedding_backends.py
+# Parity check between the torch (sentence-transformers) and ONNX Runtime embedding backends.
+# Needs torch, transformers, onnxruntime and the bge model weights, so it is skipped otherwise.
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("langchain_huggingface")
+
+from config import EMBEDDING_MODEL_NAME
+from langchain_utils.vectorstore import create_base_embeddings
+
+TEXTS = [
+    "what is the storage temperature for mccain",
+    "compare termination clauses in simplot and patties contracts",
+    "19.4 Subject to Clause 19.1 but notwithstanding any other provision of this Agreement, NewCold's "
+    "total aggregate liability shall be limited in aggregate for all liabilities arising under this "
+    "Agreement in the sum of $10,000,000 (ten million Australian dollars).",
+]
+
+
+@pytest.fixture(scope="module")
+def torch_vectors():
+    return np.array(create_base_embeddings("torch").embed_documents(TEXTS))
+
+
+@pytest.mark.parametrize("quantize, min_cosine", [(False, 0.999), (True, 0.97)])
+def test_onnx_matches_torch(tmp_path_factory, torch_vectors, quantize, min_cosine):
+    model_dir = str(tmp_path_factory.getbasetemp() / "onnx_bge")
+    onnx_embeddings = create_base_embeddings("onnx", model_name=EMBEDDING_MODEL_NAME,
+                                             onnx_model_dir=model_dir, quantize=quantize)
+    onnx_vectors = np.array(onnx_embeddings.embed_documents(TEXTS))
+
+    assert onnx_vectors.shape == torch_vectors.shape
+    cosines = np.sum(onnx_vectors * torch_vectors, axis=1) / (
+        np.linalg.norm(onnx_vectors, axis=1) * np.linalg.norm(torch_vectors, axis=1)
+    )
+    assert cosines.min() >= min_cosine, f"cosine agreement too low: {cosines}"
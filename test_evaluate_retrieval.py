@@ -0,0 +1,32 @@
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+import evaluate_retrieval
+import langchain_utils.qa_chain as qa_chain
+from document_processing.facts import FactsIndex
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.index_snapshots import publish_snapshot, write_snapshot
+from langchain_utils.shards import group_documents_by_shard
+
+EMBEDDINGS = DeterministicFakeEmbeddings(size=16)
+
+
+def test_evaluates_the_sharded_snapshot_the_app_serves(tmp_path, monkeypatch):
+    docs = [Document(page_content=f"{customer} storage clause {i}.",
+                     metadata={"customer": customer, "region": region, "clause": str(i), "hierarchy": [str(i)]})
+            for customer, region in (("Acme", "AU"), ("Globex", "US")) for i in range(1, 5)]
+    shards = {name: FAISS.from_documents(group, EMBEDDINGS)
+              for name, group in group_documents_by_shard(docs, "region").items()}
+    version = write_snapshot(str(tmp_path), None, ["Acme", "Globex"], FactsIndex(), shards=shards,
+                             manifest_extra={"shard_by": "region", **qa_chain.index_compatibility()})
+    publish_snapshot(str(tmp_path), version)
+    monkeypatch.setattr(qa_chain, "INDEX_ROOT", str(tmp_path))
+    monkeypatch.setattr(qa_chain, "embeddings", EMBEDDINGS)
+
+    gold = [{"query": "Globex storage clause 3.", "customer": "Globex", "expected_clauses": ["3"]},
+            {"query": "Acme storage clause 2.", "customer": None, "expected_clauses": ["2"]}]
+    report = evaluate_retrieval.evaluate_current_snapshot(gold, ks=[1, 8], root=str(tmp_path))
+
+    assert report["index_version"] == version and report["queries"] == 2
+    assert report["recall_at_k"]["8"] == 1.0
+    assert evaluate_retrieval.evaluate_current_snapshot(gold, root=str(tmp_path / "empty")) is None
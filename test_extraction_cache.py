@@ -0,0 +1,42 @@
+from langchain_core.documents import Document
+
+import document_processing.extraction_cache as extraction_cache_module
+from document_processing.extraction_cache import ExtractionCache, extraction_cache_key
+
+
+def _counting_extract(calls):
+    def extract(pdf_path):
+        calls.append(pdf_path)
+        return [Document(page_content="## 1. Storage\nAcme shall pay storage fees.",
+                         metadata={"source": "acme.pdf", "page_number": 1, "customer": "Acme", "region": "AU"})]
+    return extract
+
+
+def test_second_extraction_is_served_from_the_cache(tmp_path):
+    pdf = tmp_path / "acme.pdf"
+    pdf.write_bytes(b"%PDF-1.4 acme")
+    calls = []
+    cache = ExtractionCache(str(tmp_path / "cache"), extract=_counting_extract(calls))
+
+    first = cache.extract(str(pdf))
+    copy = tmp_path / "acme-renamed.pdf"
+    copy.write_bytes(pdf.read_bytes())
+    second = cache.extract(str(copy))
+
+    assert len(calls) == 1 and cache.get_stats() == {"hits": 1, "misses": 1}
+    assert second[0].page_content == first[0].page_content
+    assert second[0].metadata["customer"] == "Acme" and second[0].metadata["region"] == "AU"
+    assert second[0].metadata["source"] == "acme-renamed.pdf"
+
+
+def test_key_changes_with_content_and_extractor_version(tmp_path, monkeypatch):
+    pdf = tmp_path / "acme.pdf"
+    pdf.write_bytes(b"%PDF-1.4 acme")
+    key = extraction_cache_key(str(pdf))
+
+    monkeypatch.setattr(extraction_cache_module, "EXTRACTOR_VERSION", "test-bump")
+    assert extraction_cache_key(str(pdf)) != key
+    monkeypatch.undo()
+
+    pdf.write_bytes(b"%PDF-1.4 acme, amended")
+    assert extraction_cache_key(str(pdf)) != key
@@ -0,0 +1,34 @@
+from langchain_core.documents import Document
+
+from document_processing.facts import FactsIndex, build_facts_index, extract_facts_from_text
+
+METADATA = {"customer": "Acme", "source": "acme.pdf", "page_number": 4, "clause": "7.1", "clause_title": "Charges"}
+CLAUSES = [
+    "The Customer shall pay the monthly storage fee of $12,500 within thirty (30) days of the invoice date.",
+    "Chilled Products shall be stored at 0-4°C and Frozen Products at -18°C or below.",
+]
+
+
+def _temperatures(text):
+    return [(fact["value"], fact["text"]) for fact in extract_facts_from_text(text) if fact["type"] == "temperature"]
+
+
+def test_temperature_ranges_are_not_read_as_negative_values():
+    assert _temperatures("Store at 0-4°C.") == [([0.0, 4.0], "0-4°C")]
+    assert _temperatures("between -18 to -22 °C") == [([-22.0, -18.0], "-18 to -22 °C")]
+    assert _temperatures("frozen at -18°C, chilled at minus 2 degrees Celsius") == \
+           [(-18.0, "-18°C"), (-2.0, "minus 2 degrees Celsius")]
+
+
+def test_only_clear_fact_questions_are_answered_from_facts():
+    index = build_facts_index([Document(page_content=text, metadata=METADATA) for text in CLAUSES])
+
+    fee = index.answer_query("How much is Acme's monthly storage fee?", "Acme")
+    assert [fact["text"] for fact in fee] == ["$12,500"]
+    chilled = index.answer_query("What temperature range applies to chilled products for Acme?", "Acme")
+    assert chilled[0]["value"] == [0.0, 4.0]
+
+    # Open questions go to retrieval and the LLM, however many fact words they contain
+    assert index.answer_query("What happens if Acme doesn't pay its fees on time?", "Acme") is None
+    assert index.answer_query("What is the storage fee for pallets?", "Globex") is None
+    assert FactsIndex().answer_query("How much is the storage fee?", "Acme") is None
@@ -0,0 +1,110 @@
+import hashlib
+import io
+import os
+import tarfile
+import threading
+import time
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from document_processing.facts import FactsIndex
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.index_snapshots import (SNAPSHOTS_DIR, IncompatibleIndexError, SnapshotWatcher, install_artifact,
+                                             list_snapshots, load_snapshot, pack_snapshot, prune_snapshots,
+                                             publish_snapshot, read_current_version, write_snapshot)
+
+EMBEDDINGS = DeterministicFakeEmbeddings(size=16)
+COMPATIBILITY = {"embedding_model": "fake", "parser_version": "1"}
+
+
+def _write(root, customer):
+    docs = [Document(page_content=f"{customer} clause {i}.", metadata={"customer": customer}) for i in range(3)]
+    return write_snapshot(str(root), FAISS.from_documents(docs, EMBEDDINGS), [customer], FactsIndex(),
+                          manifest_extra=COMPATIBILITY)
+
+
+def test_watcher_swaps_to_published_snapshot_and_old_one_stays_usable(tmp_path):
+    first = _write(tmp_path, "Acme")
+    assert read_current_version(str(tmp_path)) is None  # written but not yet published
+    publish_snapshot(str(tmp_path), first)
+
+    serving = {}
+
+    def activate(version):
+        serving["state"] = load_snapshot(str(tmp_path), version, EMBEDDINGS)
+
+    watcher = SnapshotWatcher(str(tmp_path), None, activate)
+    assert watcher.check()
+    in_flight = serving["state"]
+    assert not watcher.check()  # unchanged pointer
+
+    second = _write(tmp_path, "Globex")
+    publish_snapshot(str(tmp_path), second)
+    assert watcher.check() and watcher.version == second
+    assert serving["state"][1] == ["Globex"]
+    # A request that captured the old snapshot still searches it
+    assert in_flight[0].similarity_search("Acme clause 1.", k=1)[0].metadata["customer"] == "Acme"
+    assert not [name for name in os.listdir(tmp_path / SNAPSHOTS_DIR) if name.startswith(".")]
+
+
+def test_concurrent_checks_activate_a_new_snapshot_once(tmp_path):
+    publish_snapshot(str(tmp_path), _write(tmp_path, "Acme"))
+    activations = []
+
+    def activate(version):
+        time.sleep(0.1)  # slow load, so both checks see the new version before either finishes
+        activations.append(version)
+
+    watcher = SnapshotWatcher(str(tmp_path), None, activate)
+    threads = [threading.Thread(target=watcher.check) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert activations == [watcher.version]
+
+
+def test_prune_keeps_current_and_newest(tmp_path):
+    versions = [_write(tmp_path, f"Customer {i}") for i in range(4)]
+    publish_snapshot(str(tmp_path), versions[0])
+    prune_snapshots(str(tmp_path), keep=2)
+    assert list_snapshots(str(tmp_path)) == [versions[0], versions[3]]
+
+
+def test_artifact_round_trip_checks_checksums_and_compatibility(tmp_path):
+    version = _write(tmp_path / "build", "Acme")
+    artifact = str(tmp_path / "index.tar.gz")
+    sha256 = pack_snapshot(str(tmp_path / "build"), version, artifact)
+
+    with pytest.raises(IncompatibleIndexError):
+        install_artifact(str(tmp_path / "app"), artifact, expected={**COMPATIBILITY, "parser_version": "2"})
+    assert install_artifact(str(tmp_path / "app"), artifact, expected=COMPATIBILITY, sha256=sha256) == version
+    assert install_artifact(str(tmp_path / "app"), artifact, expected=COMPATIBILITY) == version  # idempotent
+    assert load_snapshot(str(tmp_path / "app"), version, EMBEDDINGS, expected=COMPATIBILITY, verify=True)[1] == ["Acme"]
+
+    # A corrupted chunk store is rejected
+    tampered = str(tmp_path / "tampered.tar.gz")
+    with tarfile.open(artifact) as src, tarfile.open(tampered, "w:gz") as dst:
+        for member in src.getmembers():
+            data = src.extractfile(member).read()
+            if member.name == "index.pkl":
+                data = data[:-1] + bytes([data[-1] ^ 1])
+            member.size = len(data)
+            dst.addfile(member, io.BytesIO(data))
+    with pytest.raises(IncompatibleIndexError):
+        install_artifact(str(tmp_path / "other"), tampered, expected=COMPATIBILITY)
+
+
+def test_artifact_sha256_covers_directories_and_is_required_for_urls(tmp_path):
+    version = _write(tmp_path / "build", "Acme")
+    directory = os.path.join(str(tmp_path / "build"), SNAPSHOTS_DIR, version)
+    with open(os.path.join(directory, "manifest.json"), "rb") as f:
+        manifest_sha256 = hashlib.sha256(f.read()).hexdigest()
+
+    with pytest.raises(IncompatibleIndexError):
+        install_artifact(str(tmp_path / "app"), directory, expected=COMPATIBILITY, sha256="0" * 64)
+    assert install_artifact(str(tmp_path / "app"), directory, expected=COMPATIBILITY, sha256=manifest_sha256) == version
+    with pytest.raises(IncompatibleIndexError, match="sha256 is required"):
+        install_artifact(str(tmp_path / "app"), "https://example.invalid/index.tar.gz", expected=COMPATIBILITY)
@@ -0,0 +1,147 @@
+import os
+import time
+
+import pytest
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from document_processing.facts import FactsIndex
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.index_snapshots import (load_shard, load_snapshot, publish_snapshot, read_current_version,
+                                             write_snapshot)
+import langchain_utils.ingest as ingest_module
+from langchain_utils.ingest import STAGES, IndexLayoutChanged, IngestQueue, append_to_snapshot
+from langchain_utils.qa_chain import parse_page_documents
+from langchain_utils.shards import group_documents_by_shard
+
+EMBEDDINGS = DeterministicFakeEmbeddings(size=16)
+
+
+def _extract(pdf_path):
+    return [Document(page_content=f"Globex shall pay storage fees within {30 + page} days.",
+                     metadata={"source": os.path.basename(pdf_path), "page_number": page, "customer": "Globex", "region": "US"})
+            for page in (1, 2)]
+
+
+def _wait(queue, job_id):
+    deadline = time.time() + 30
+    while queue.get(job_id)["status"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.05)
+    return queue.get(job_id)
+
+
+def _acme_docs():
+    return [Document(page_content=f"Acme clause {i}.", metadata={"customer": "Acme", "region": "AU"}) for i in range(3)]
+
+
+def test_ingest_appends_a_new_snapshot_and_leaves_the_served_one_alone(tmp_path):
+    first = write_snapshot(str(tmp_path), FAISS.from_documents(_acme_docs(), EMBEDDINGS), ["Acme"], FactsIndex())
+    publish_snapshot(str(tmp_path), first)
+    serving = load_snapshot(str(tmp_path), first, EMBEDDINGS)[0]
+
+    published = []
+    queue = IngestQueue(str(tmp_path), EMBEDDINGS, extract=_extract, parse=parse_page_documents,
+                        on_published=published.append)
+    job = _wait(queue, queue.submit("/uploads/globex.pdf"))
+
+    assert job["status"] == "done", job.get("error")
+    assert set(job["stage_seconds"]) == set(STAGES) and job["chunks"] == 2 and job["customers"] == ["Globex"]
+    assert read_current_version(str(tmp_path)) == job["version"] == published[0]
+    vectorstore, customers, facts, manifest = load_snapshot(str(tmp_path), job["version"], EMBEDDINGS, verify=True)
+    assert len(vectorstore.index_to_docstore_id) == 5 and customers == ["Acme", "Globex"]
+    assert manifest["appended_to"] == first and manifest["appended_sources"] == ["globex.pdf"]
+    assert len(serving.index_to_docstore_id) == 3  # the snapshot being served was not modified
+
+
+def test_ingest_into_sharded_parent_child_index_creates_the_missing_shard(tmp_path, monkeypatch):
+    shards = {name: FAISS.from_documents(docs, EMBEDDINGS)
+              for name, docs in group_documents_by_shard(_acme_docs(), "region").items()}
+    first = write_snapshot(str(tmp_path), None, ["Acme"], FactsIndex(), shards=shards,
+                           manifest_extra={"shard_by": "region", "parent_child": True})
+    publish_snapshot(str(tmp_path), first)
+    loaded = []
+    monkeypatch.setattr(ingest_module, "load_shard", lambda *args: loaded.append(args[2]) or load_shard(*args))
+
+    queue = IngestQueue(str(tmp_path), EMBEDDINGS, extract=_extract, parse=parse_page_documents)
+    job = _wait(queue, queue.submit("/uploads/globex.pdf"))
+
+    assert job["status"] == "done", job.get("error")
+    assert loaded == []  # the untouched "au" shard is carried over without being loaded
+    manifest = load_snapshot(str(tmp_path), job["version"], EMBEDDINGS, verify=True)[3]
+    assert sorted(manifest["shards"]) == ["au", "us"] and manifest["shards"]["us"]["customers"] == ["Globex"]
+    assert manifest["chunks"] == 3 + manifest["shards"]["us"]["chunks"]
+    assert len(load_shard(str(tmp_path), job["version"], "au", EMBEDDINGS).index_to_docstore_id) == 3
+    us = load_shard(str(tmp_path), job["version"], "us", EMBEDDINGS)
+    child = us.docstore.search(us.index_to_docstore_id[0])
+    assert us.docstore.search(child.metadata["parent_id"]).metadata["source"] == "globex.pdf"
+
+
+def test_ingest_appends_from_separate_workers_all_land_in_the_index(tmp_path):
+    first = write_snapshot(str(tmp_path), FAISS.from_documents(_acme_docs(), EMBEDDINGS), ["Acme"], FactsIndex())
+    publish_snapshot(str(tmp_path), first)
+    # Two queues stand in for two app workers sharing the index root
+    workers = [IngestQueue(str(tmp_path), EMBEDDINGS, extract=_extract, parse=parse_page_documents) for _ in range(2)]
+    job_ids = [queue.submit(f"/uploads/globex-{i}.pdf") for i, queue in enumerate(workers)]
+    jobs = [_wait(queue, job_id) for queue, job_id in zip(workers, job_ids)]
+
+    assert [job["status"] for job in jobs] == ["done", "done"]
+    vectorstore = load_snapshot(str(tmp_path), read_current_version(str(tmp_path)), EMBEDDINGS)[0]
+    assert len(vectorstore.index_to_docstore_id) == 7  # neither append was lost to the other
+
+
+def test_ingest_job_status_is_shared_and_staged_uploads_are_settled(tmp_path):
+    root, corpus = tmp_path / "index", tmp_path / "pdfs"
+    first = write_snapshot(str(root), FAISS.from_documents(_acme_docs(), EMBEDDINGS), ["Acme"], FactsIndex())
+    publish_snapshot(str(root), first)
+    staged = []
+    for name in ("globex.pdf", "empty.pdf"):
+        (tmp_path / name[:-4]).mkdir()
+        staged.append(tmp_path / name[:-4] / name)
+        staged[-1].write_bytes(b"%PDF")
+
+    def extract(pdf_path):
+        return [] if pdf_path.endswith("empty.pdf") else _extract(pdf_path)
+
+    queue = IngestQueue(str(root), EMBEDDINGS, extract=extract, parse=parse_page_documents, corpus_dir=str(corpus))
+    done, failed = (_wait(queue, queue.submit(str(path))) for path in staged)
+
+    assert done["status"] == "done" and failed["status"] == "error"
+    assert sorted(p.name for p in corpus.iterdir()) == ["globex.pdf"]  # the failed upload can be sent again
+    assert not any(path.parent.exists() for path in staged)
+    other_worker = IngestQueue(str(root), EMBEDDINGS, extract=extract, parse=parse_page_documents)
+    job_id = next(job_id for job_id, job in queue.jobs.items() if job["status"] == "done")
+    assert other_worker.get(job_id) == done
+    assert other_worker.get("../../etc/passwd") is None
+
+
+def test_ingest_rejects_content_the_snapshot_already_holds(tmp_path):
+    first = write_snapshot(str(tmp_path), FAISS.from_documents(_acme_docs(), EMBEDDINGS), ["Acme"], FactsIndex())
+    publish_snapshot(str(tmp_path), first)
+    queue = IngestQueue(str(tmp_path), EMBEDDINGS, extract=_extract, parse=parse_page_documents, dedup_max_distance=6)
+
+    assert _wait(queue, queue.submit("/uploads/globex.pdf"))["status"] == "done"
+    again = _wait(queue, queue.submit("/other/globex.pdf"))
+    copy = _wait(queue, queue.submit("/uploads/globex-signed.pdf"))  # same clauses under another name
+
+    assert again["status"] == "error" and "already holds globex.pdf" in again["error"]
+    assert copy["status"] == "error" and "every clause" in copy["error"]
+    vectorstore = load_snapshot(str(tmp_path), read_current_version(str(tmp_path)), EMBEDDINGS)[0]
+    assert len(vectorstore.index_to_docstore_id) == 5
+
+
+def test_ingest_re_embeds_when_the_parent_child_layout_changed_meanwhile(tmp_path):
+    first = write_snapshot(str(tmp_path), FAISS.from_documents(_acme_docs(), EMBEDDINGS), ["Acme"], FactsIndex())
+    publish_snapshot(str(tmp_path), first)
+    queue = IngestQueue(str(tmp_path), EMBEDDINGS, extract=_extract, parse=parse_page_documents)
+    chunks = parse_page_documents(_extract("/uploads/globex.pdf"), "globex.pdf")
+    embedded = queue._embed(chunks)  # flat, like the current snapshot
+    rebuilt = write_snapshot(str(tmp_path), FAISS.from_documents(_acme_docs(), EMBEDDINGS), ["Acme"], FactsIndex(),
+                             manifest_extra={"parent_child": True})
+    publish_snapshot(str(tmp_path), rebuilt)
+
+    with pytest.raises(IndexLayoutChanged):
+        append_to_snapshot(str(tmp_path), *embedded[:3], EMBEDDINGS, parent_child=embedded[3])
+    vectorstore = load_snapshot(str(tmp_path), queue._index(chunks, embedded), EMBEDDINGS)[0]
+    added = [doc for doc in vectorstore.docstore._dict.values() if doc.metadata.get("source") == "globex.pdf"]
+    assert any("parent_id" in doc.metadata for doc in added)
@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from langchain_utils.llm_client import (PRIORITY_BATCH, PRIORITY_INTERACTIVE, LLMRateLimited, ScheduledAzureChatOpenAI,
+                                        TokenBucketScheduler, create_http_client)
+
+
+class MockAzureOpenAI(BaseHTTPRequestHandler):
+    """Answers chat completions; the first `fail_first` requests get a 429 with Retry-After."""
+
+    fail_first = 0
+    requests = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        cls.requests += 1
+        if cls.requests <= cls.fail_first:
+            self._send(429, {"error": {"code": "429", "message": "Rate limit exceeded"}}, {"Retry-After": "0.05"})
+            return
+        content = "echo: " + body["messages"][-1]["content"]
+        self._send(200, {
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8},
+        })
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mock_server():
+    MockAzureOpenAI.requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockAzureOpenAI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def _llm(endpoint, retry_attempts=3):
+    return ScheduledAzureChatOpenAI(
+        azure_endpoint=endpoint, openai_api_version="2025-01-01-preview", deployment_name="gpt-4o-mini",
+        openai_api_key="test", http_client=create_http_client(), max_retries=0,
+        scheduler=TokenBucketScheduler(600, 100000), retry_attempts=retry_attempts, retry_base_delay_s=0.01,
+    )
+
+
+def test_retries_429_honouring_retry_after(mock_server):
+    MockAzureOpenAI.fail_first = 2
+    assert _llm(mock_server).invoke("hello").content == "echo: hello"
+    assert MockAzureOpenAI.requests == 3
+
+
+def test_gives_up_with_rate_limited_error(mock_server):
+    MockAzureOpenAI.fail_first = 100
+    with pytest.raises(LLMRateLimited):
+        _llm(mock_server, retry_attempts=1).invoke("hello")
+    assert MockAzureOpenAI.requests == 2
+
+
+def test_interactive_calls_are_admitted_before_batch_calls():
+    scheduler = TokenBucketScheduler(requests_per_minute=600, tokens_per_minute=1_000_000)
+    scheduler._requests = 0.0  # empty: one request every 0.1s
+    order = []
+
+    def call(priority, name):
+        scheduler.acquire(1, priority=priority)
+        order.append(name)
+
+    batch = [threading.Thread(target=call, args=(PRIORITY_BATCH, f"batch{i}")) for i in range(2)]
+    for thread in batch:
+        thread.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=call, args=(PRIORITY_INTERACTIVE, "interactive"))
+    interactive.start()
+    for thread in batch + [interactive]:
+        thread.join(timeout=5)
+    assert order[0] == "interactive"
@@ -0,0 +1,40 @@
+import contextlib
+import io
+
+from langchain_core.documents import Document
+
+from langchain_utils.fake_llm import DeterministicFakeChatModel
+from langchain_utils.metrics import (Histogram, StageTimingCallbackHandler, LLM_CALLS, render_metrics,
+                                     request_timer, span)
+from langchain_utils.qa_chain import setup_map_reduce_chain, prepare_docs_for_map
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("h", "test", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, stage="x")
+    lines = histogram.render()
+    assert 'h_bucket{stage="x",le="0.1"} 1' in lines
+    assert 'h_bucket{stage="x",le="1.0"} 2' in lines
+    assert 'h_bucket{stage="x",le="+Inf"} 3' in lines
+    assert 'h_count{stage="x"} 3' in lines
+
+
+def test_request_spans_include_map_and_reduce_llm_calls():
+    with contextlib.redirect_stdout(io.StringIO()):
+        chain = setup_map_reduce_chain(llm=DeterministicFakeChatModel())
+    docs = [Document(page_content=f"Clause {i} applies. More text.", metadata={"source": "a.pdf", "customer": "X"})
+            for i in range(3)]
+    map_calls_before = LLM_CALLS._values.get(("map",), 0.0)
+
+    with request_timer() as spans, contextlib.redirect_stdout(io.StringIO()):
+        with span("map_reduce"):
+            chain.invoke({"input_documents": prepare_docs_for_map(docs), "question": "which clause applies?"},
+                         config={"callbacks": [StageTimingCallbackHandler()]})
+
+    stages = [stage for stage, _ in spans]
+    assert stages.count("llm_map") == 3
+    assert stages.count("llm_reduce") == 1
+    assert stages[-1] == "map_reduce"
+    assert LLM_CALLS._values[("map",)] == map_calls_before + 3
+    assert 'legal_qa_stage_duration_seconds_count{stage="map_reduce"}' in render_metrics()
@@ -0,0 +1,53 @@
+import os
+import threading
+import time
+
+import pytest
+
+from langchain_utils import onnx_embeddings
+from langchain_utils.onnx_embeddings import ONNX_MODEL_FILE, TOKENIZER_FILE, export_bge_to_onnx
+
+
+def _fake_export(calls, fail=False):
+    def write(model_name, directory, opset):
+        calls.append(directory)
+        time.sleep(0.2)
+        with open(os.path.join(directory, ONNX_MODEL_FILE), "w") as f:
+            f.write("model")
+        if fail:
+            raise RuntimeError("export crashed")
+        with open(os.path.join(directory, TOKENIZER_FILE), "w") as f:
+            f.write("{}")
+    return write
+
+
+def test_crashed_or_partial_export_is_redone_and_never_visible(tmp_path, monkeypatch):
+    output_dir = str(tmp_path / "onnx_bge")
+    calls = []
+    monkeypatch.setattr(onnx_embeddings, "_write_onnx_export", _fake_export(calls, fail=True))
+    with pytest.raises(RuntimeError):
+        export_bge_to_onnx("bge", output_dir)
+    assert not os.path.exists(os.path.join(output_dir, ONNX_MODEL_FILE))
+    assert sorted(os.listdir(tmp_path)) == ["onnx_bge"]  # staging directory removed
+
+    # A model left behind by an older, non-atomic export without its tokenizer is not "done"
+    with open(os.path.join(output_dir, ONNX_MODEL_FILE), "w") as f:
+        f.write("partial")
+    monkeypatch.setattr(onnx_embeddings, "_write_onnx_export", _fake_export(calls))
+    export_bge_to_onnx("bge", output_dir)
+    assert len(calls) == 2 and open(os.path.join(output_dir, ONNX_MODEL_FILE)).read() == "model"
+    assert os.path.exists(os.path.join(output_dir, TOKENIZER_FILE))
+
+
+def test_concurrent_workers_export_once(tmp_path, monkeypatch):
+    output_dir = str(tmp_path / "onnx_bge")
+    calls = []
+    monkeypatch.setattr(onnx_embeddings, "_write_onnx_export", _fake_export(calls))
+
+    threads = [threading.Thread(target=export_bge_to_onnx, args=("bge", output_dir)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
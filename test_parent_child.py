@@ -0,0 +1,41 @@
+from langchain_core.documents import Document
+
+from document_processing.child_chunks import build_parent_child_documents, split_child_texts
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.qa_chain import build_vectorstore
+from langchain_utils.retrieval import AdaptiveRetriever
+
+PAYMENT = ("The Customer shall pay each invoice within thirty days of the invoice date. "
+           "Late payments accrue interest at two percent per month: (a) from the due date; and "
+           "(b) until the amount is paid in full.")
+STORAGE = ("The Operator shall store frozen goods at minus eighteen degrees Celsius. "
+           "Temperature excursions must be reported to the Customer within two Business Days.")
+
+
+def test_split_keeps_sentences_and_sub_clauses_apart():
+    assert split_child_texts(PAYMENT) == [
+        "The Customer shall pay each invoice within thirty days of the invoice date.",
+        "Late payments accrue interest at two percent per month:",
+        "(a) from the due date; and",
+        "(b) until the amount is paid in full.",
+    ]
+    assert len(split_child_texts("word " * 130, max_words=60)) == 3
+
+
+def test_retrieval_searches_children_and_returns_each_parent_once(monkeypatch):
+    embeddings = DeterministicFakeEmbeddings(size=32)
+    monkeypatch.setattr("langchain_utils.qa_chain.embeddings", embeddings)
+    parents = [Document(page_content=text, metadata={"customer": "Acme", "source": "acme.pdf", "clause": clause})
+               for clause, text in (("7.1", PAYMENT), ("12.3", STORAGE))]
+    vectorstore = build_vectorstore(parents, parent_child=True)
+    children, _ = build_parent_child_documents(parents)
+    assert len(vectorstore.index_to_docstore_id) == len(children) == 6
+
+    retriever = AdaptiveRetriever(vectorstore, embeddings, min_k=1, max_k=1, fetch_k=2)
+    [chunk] = retriever.retrieve("Temperature excursions must be reported to the Customer within two Business Days.",
+                                 customer="Acme")
+    assert chunk.document.page_content == STORAGE  # the whole clause, not the matching sentence
+    assert chunk.chunk_id == vectorstore.docstore.search(chunk.chunk_id).id
+
+    retriever = AdaptiveRetriever(vectorstore, embeddings, min_k=6, max_k=6, fetch_k=6)
+    assert sorted(c.document.metadata["clause"] for c in retriever.retrieve("interest", customer="Acme")) == ["12.3", "7.1"]
@@ -0,0 +1,56 @@
+import copy
+
+import pytest
+from langchain_core.documents import Document
+
+from document_processing.parser import pyparse_hierarchical_chunk_text, scan_hierarchy
+from langchain_utils.qa_chain import parse_page_documents
+from test_chuking2 import sample_text
+
+METADATA_KEYS = ("source", "page_number", "customer", "clause", "clause_title", "hierarchy")
+
+
+def _pages(lines_per_page):
+    # Page breaks at arbitrary lines, so clauses (and their sub-clauses) run across pages
+    lines = sample_text.splitlines()
+    return [Document(page_content="\n".join(lines[start:start + lines_per_page]),
+                     metadata={"source": "sample.pdf", "page_number": n + 1, "customer": "Simplot Australia"})
+            for n, start in enumerate(range(0, len(lines), lines_per_page))]
+
+
+def _sequential(pages, **kwargs):
+    """The in-order parse: one hierarchy stack threaded through every page."""
+    documents, stack = [], []
+    for page in pages:
+        page_docs, stack = pyparse_hierarchical_chunk_text(
+            page.page_content, "sample.pdf", page_number=page.metadata["page_number"],
+            extra_metadata={"customer": "Simplot Australia"}, initial_stack=stack, **kwargs)
+        documents.extend(page_docs)
+    return documents
+
+
+@pytest.mark.parametrize("lines_per_page, chunk_max_tokens, max_workers", [(45, None, 4), (70, None, 2), (60, 120, 1)])
+def test_parallel_parse_from_checkpoints_matches_sequential_parse(lines_per_page, chunk_max_tokens, max_workers):
+    pages = _pages(lines_per_page)
+    assert all(len(page.page_content.split()) > 350 for page in pages[:-1])
+    expected = _sequential(copy.deepcopy(pages), chunk_max_tokens=chunk_max_tokens)
+
+    actual = parse_page_documents(copy.deepcopy(pages), "sample.pdf", chunk_max_tokens=chunk_max_tokens,
+                                  max_workers=max_workers)
+
+    # The short last page is kept whole by parse_page_documents, as before
+    actual = [doc for doc in actual if doc.metadata["page_number"] != pages[-1].metadata["page_number"]]
+    expected = [doc for doc in expected if doc.metadata["page_number"] != pages[-1].metadata["page_number"]]
+    assert [(doc.page_content, {key: doc.metadata.get(key) for key in METADATA_KEYS}) for doc in actual] == \
+           [(doc.page_content, {key: doc.metadata.get(key) for key in METADATA_KEYS}) for doc in expected]
+
+
+@pytest.mark.parametrize("chunk_max_tokens", [None, 12, 20, 40])
+def test_scan_hierarchy_ends_on_the_stack_of_a_full_parse(chunk_max_tokens):
+    # Small chunks put token splits right before headers, which the scan must not read as headers
+    scanned, parsed = [], []
+    for page in _pages(15):
+        _, parsed = pyparse_hierarchical_chunk_text(page.page_content, "sample.txt", initial_stack=parsed,
+                                                    chunk_max_tokens=chunk_max_tokens)
+        scanned = scan_hierarchy(page.page_content, initial_stack=scanned, chunk_max_tokens=chunk_max_tokens)
+        assert scanned == parsed
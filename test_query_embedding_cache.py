@@ -0,0 +1,56 @@
+import threading
+
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.query_embedding_cache import CachedQueryEmbeddings
+
+
+class CountingEmbeddings(DeterministicFakeEmbeddings):
+    """Records every embed_documents batch."""
+
+    def __init__(self):
+        super().__init__(size=8)
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def test_lru_eviction_hits_misses_and_lowercased_keys():
+    base = CountingEmbeddings()
+    cached = CachedQueryEmbeddings(base, cache_size=2, batch_window_ms=0)
+
+    first = cached.embed_query("Storage  fee for Acme?")
+    assert cached.embed_query("storage fee for acme?") == first  # same normalized key
+    cached.embed_query("Termination notice?")
+    cached.embed_query("storage fee for acme?")  # refreshes the fee entry
+    cached.embed_query("Liability cap?")  # evicts the least recently used: termination
+
+    cached.embed_query("termination notice?")
+    assert [batch[0] for batch in base.batches] == ["storage fee for acme?", "termination notice?",
+                                                   "liability cap?", "termination notice?"]
+    stats = cached.get_stats()
+    assert (stats["hits"], stats["misses"], stats["cache_size"]) == (2, 4, 2)
+
+
+def test_concurrent_queries_are_coalesced_into_one_encode():
+    base = CountingEmbeddings()
+    cached = CachedQueryEmbeddings(base, batch_window_ms=500)
+    queries = ["Storage fee?", "storage FEE?", "Liability cap?", "Termination notice?"]
+    barrier = threading.Barrier(len(queries))
+    results = {}
+
+    def ask(query):
+        barrier.wait()
+        results[query] = cached.embed_query(query)
+
+    threads = [threading.Thread(target=ask, args=(query,)) for query in queries]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(base.batches) == 1
+    assert sorted(base.batches[0]) == ["liability cap?", "storage fee?", "termination notice?"]
+    assert results["Storage fee?"] == results["storage FEE?"]
+    assert cached.get_stats()["batch_size_histogram"] == {3: 1}
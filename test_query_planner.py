@@ -0,0 +1,26 @@
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.query_planner import QueryPlanner, plan_retrieval
+from langchain_utils.retrieval import AdaptiveRetriever
+
+
+def test_plan_splits_k_fairly():
+    assert plan_retrieval([], 15) == ([None], 15)
+    assert plan_retrieval(["Acme"], 15) == (["Acme"], 15)
+    assert plan_retrieval(["Acme", "Globex"], 15) == (["Acme", "Globex"], 7)
+    assert plan_retrieval(["A", "B", "C", "D", "E", "F", "G", "H"], 15, min_k_per_customer=2).k_per_customer == 2
+
+
+def test_comparative_query_gets_evidence_from_every_customer():
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    # Acme has ten times the chunks of Globex, enough to fill an unfiltered top-k on its own
+    docs = [Document(page_content=f"{customer} termination clause {i}.", metadata={"customer": customer})
+            for customer, count in (("Acme", 30), ("Globex", 3)) for i in range(count)]
+    retriever = AdaptiveRetriever(FAISS.from_documents(docs, embeddings), embeddings, min_k=4, max_k=6, fetch_k=6)
+    planner = QueryPlanner(max_workers=2)
+
+    query = "compare acme and globex termination"
+    chunks = planner.retrieve(retriever, query, planner.plan(["Acme", "Globex"], retriever))
+    assert [c.document.metadata["customer"] for c in chunks] == ["Acme"] * 3 + ["Globex"] * 3
@@ -0,0 +1,38 @@
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+import routes
+from document_processing.facts import FactsIndex
+from langchain_utils.customer_matcher import CustomerMatcher
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.index_snapshots import IndexState
+from langchain_utils.retrieval import AdaptiveRetriever
+
+
+class StubChain:
+    def __init__(self, result):
+        self.result = result
+
+    def invoke(self, chain_input, config=None):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def _state():
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    docs = [Document(page_content=f"Acme clause {i}.", metadata={"customer": "Acme", "source": "acme.pdf",
+                                                                 "page_number": i, "clause": str(i)})
+            for i in range(4)]
+    retriever = AdaptiveRetriever(FAISS.from_documents(docs, embeddings), embeddings, min_k=2, max_k=4)
+    return IndexState("v1", retriever.vectorstore, retriever, ["Acme"], CustomerMatcher(["Acme"]), FactsIndex())
+
+
+def test_status_comes_from_the_pipeline_not_the_answer_text(monkeypatch):
+    state = _state()
+    monkeypatch.setattr(routes.qa_module, "map_reduce_chain",
+                        StubChain({"output_text": "Error correction under Clause 12 is the Operator's duty."}))
+    assert routes.process_query("Who fixes errors for Acme?", "", state)[2] == "ok"
+
+    monkeypatch.setattr(routes.qa_module, "map_reduce_chain", StubChain(RuntimeError("LLM down")))
+    assert routes.process_query("Who fixes errors for Acme?", "", state)[2] == "error"
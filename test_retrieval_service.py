@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from document_processing.facts import FactsIndex
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.index_snapshots import IndexState
+from langchain_utils.retrieval import AdaptiveRetriever
+from langchain_utils.retrieval_service import RemoteRetriever, RetrievalClient, RetrievalServiceError, create_server
+
+
+@pytest.mark.parametrize("transport", ["unix", "http"])
+def test_remote_retriever_matches_local(tmp_path, transport):
+    embeddings = DeterministicFakeEmbeddings(size=16)
+    docs = [Document(page_content=f"{customer} clause {i}.",
+                     metadata={"customer": customer, "source": f"{customer}.pdf", "page_number": i, "clause": str(i)})
+            for customer in ("Acme", "Globex") for i in range(5)]
+    local = AdaptiveRetriever(FAISS.from_documents(docs, embeddings), embeddings, min_k=2, max_k=4)
+    state = IndexState("v1", local.vectorstore, local, ["Acme", "Globex"], None, FactsIndex())
+
+    address = f"unix://{tmp_path}/retrieval.sock" if transport == "unix" else "http://127.0.0.1:0"
+    server = create_server(address, lambda: state)
+    if transport == "http":
+        address = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = RetrievalClient(address, timeout_s=5)
+    try:
+        remote = RemoteRetriever(client, max_k=4)
+        expected = local.retrieve("Acme clause 3.", customer="Acme")
+        actual = remote.retrieve("Acme clause 3.", customer="Acme")
+        assert [(c.chunk_id, c.document.page_content) for c in actual] == \
+               [(c.chunk_id, c.document.page_content) for c in expected]
+        assert [c.score for c in actual] == pytest.approx([c.score for c in expected])
+        assert actual[0].map_document.page_content == expected[0].map_document.page_content
+        assert remote.embeddings.embed_query("x") == pytest.approx(embeddings.embed_query("x"))
+        assert remote.get_stats()["version"] == "v1"
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    with pytest.raises(RetrievalServiceError):
+        RetrievalClient(address, timeout_s=1).health()
+
+
+def test_remote_retriever_bounds_map_documents_and_reports_service_stats(tmp_path, monkeypatch):
+    import langchain_utils.vectorstore as vectorstore_module
+    from langchain_utils.query_embedding_cache import CachedQueryEmbeddings
+
+    embeddings = CachedQueryEmbeddings(DeterministicFakeEmbeddings(size=16), batch_window_ms=0)
+    docs = [Document(page_content=f"Acme clause {i}.",
+                     metadata={"customer": "Acme", "source": "Acme.pdf", "page_number": i, "clause": str(i)})
+            for i in range(6)]
+    local = AdaptiveRetriever(FAISS.from_documents(docs, embeddings), embeddings, min_k=4, max_k=4)
+    states = {"current": IndexState("v1", local.vectorstore, local, ["Acme"], None, FactsIndex())}
+
+    server = create_server(f"unix://{tmp_path}/retrieval.sock", lambda: states["current"])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = RetrievalClient(f"unix://{tmp_path}/retrieval.sock", timeout_s=5)
+    try:
+        remote = RemoteRetriever(client, max_k=4, max_map_documents=3)
+        first = remote.retrieve("Acme clause 1.", customer="Acme")
+        assert len(first) == 4 and len(remote._map_documents) == 3
+
+        states["current"] = states["current"]._replace(version="v2")
+        remote.retrieve("Acme clause 2.", customer="Acme")
+        assert remote._map_documents_version == "v2" and len(remote._map_documents) == 3
+
+        monkeypatch.setattr(vectorstore_module, "remote_stats_client", client)
+        stats = vectorstore_module.get_embedding_stats()
+        assert stats["source"] == "retrieval_service" and stats["misses"] == 2
+        assert any('source="retrieval_service"' in line for line in vectorstore_module._embedding_metrics_lines())
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
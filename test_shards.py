@@ -0,0 +1,110 @@
+import gc
+import os
+import socket
+import subprocess
+import sys
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from document_processing.facts import FactsIndex
+from document_processing.pdf_extractor import find_region_automatically
+from langchain_utils.fake_llm import DeterministicFakeEmbeddings
+from langchain_utils.index_snapshots import (is_pinned, list_snapshots, load_shard, load_snapshot, pin_snapshot,
+                                             prune_snapshots, publish_snapshot, read_manifest, unpin_snapshot,
+                                             write_snapshot)
+from langchain_utils.retrieval import AdaptiveRetriever
+from langchain_utils.shards import ShardedRetriever, group_documents_by_shard
+
+EMBEDDINGS = DeterministicFakeEmbeddings(size=16)
+
+
+def test_region_from_newcold_entity():
+    assert find_region_automatically("NewCold Melbourne No.2 Pty Ltd (ACN 123)") == "AU"
+    assert find_region_automatically("NEWCOLD BURLEY OPERATIONS, LLC") == "US"
+    assert find_region_automatically("Some other warehouse") == "Unknown Region"
+
+
+def test_router_loads_only_the_shards_a_query_needs(tmp_path):
+    docs = [Document(page_content=f"{customer} storage clause {i}.", metadata={"customer": customer, "region": region})
+            for customer, region in (("Acme", "AU"), ("Initech", "AU"), ("Globex", "US")) for i in range(3)]
+    shards = {name: FAISS.from_documents(group, EMBEDDINGS)
+              for name, group in group_documents_by_shard(docs, "region").items()}
+    version = write_snapshot(str(tmp_path), None, ["Acme", "Globex", "Initech"], FactsIndex(), shards=shards)
+    vectorstore, _, _, manifest = load_snapshot(str(tmp_path), version, EMBEDDINGS)
+    assert vectorstore is None and manifest == read_manifest(str(tmp_path), version)
+    assert manifest["shards"]["au"] == {"chunks": 6, "customers": ["Acme", "Initech"], "regions": ["AU"]}
+
+    loads = []
+
+    def load(name):
+        loads.append(name)
+        return AdaptiveRetriever(load_shard(str(tmp_path), version, name, EMBEDDINGS), EMBEDDINGS, min_k=3, max_k=3)
+
+    router = ShardedRetriever(manifest["shards"], load, EMBEDDINGS, min_k=3, max_k=3, max_loaded=1)
+    chunks = router.retrieve("Globex storage clause 1.", customer="Globex")
+    assert loads == ["us"] and {c.document.metadata["customer"] for c in chunks} == {"Globex"}
+    assert {c.document.metadata["region"] for c in router.retrieve("storage in our Australian sites")} == {"AU"}
+    assert loads == ["us", "au"] and router.get_stats()["loaded"] == ["au"]  # "us" was evicted
+
+    assert len(router.retrieve("Acme storage clause 2.")) == 3  # no customer or region: every shard
+    assert loads == ["us", "au", "us"]
+
+
+def test_pinned_snapshot_survives_prune_while_its_shards_load_lazily(tmp_path):
+    docs = [Document(page_content=f"{customer} storage clause {i}.", metadata={"customer": customer, "region": region})
+            for customer, region in (("Acme", "AU"), ("Globex", "US")) for i in range(3)]
+    shards = {name: FAISS.from_documents(group, EMBEDDINGS)
+              for name, group in group_documents_by_shard(docs, "region").items()}
+    first = write_snapshot(str(tmp_path), None, ["Acme", "Globex"], FactsIndex(), shards=shards)
+    publish_snapshot(str(tmp_path), first)
+    pin = pin_snapshot(str(tmp_path), first)
+    manifest = read_manifest(str(tmp_path), first)
+    router = ShardedRetriever(
+        manifest["shards"],
+        lambda name: AdaptiveRetriever(load_shard(str(tmp_path), first, name, EMBEDDINGS), EMBEDDINGS, min_k=2, max_k=2),
+        EMBEDDINGS, min_k=2, max_k=2, max_loaded=1)
+    router.retrieve("Acme storage clause 1.", customer="Acme")
+
+    for _ in range(2):
+        publish_snapshot(str(tmp_path), write_snapshot(str(tmp_path), None, ["Acme", "Globex"], FactsIndex(),
+                                                       shards=shards))
+    prune_snapshots(str(tmp_path), keep=1)
+    assert first in list_snapshots(str(tmp_path))
+    # Shards still load on demand: the Globex shard evicts Acme's, which is then loaded again
+    assert {c.document.metadata["customer"] for c in router.retrieve("Globex clause", customer="Globex")} == {"Globex"}
+    assert {c.document.metadata["customer"] for c in router.retrieve("Acme clause", customer="Acme")} == {"Acme"}
+    assert router.get_stats()["loaded"] == ["au"]
+
+    unpin_snapshot(pin)
+    prune_snapshots(str(tmp_path), keep=1)
+    assert first not in list_snapshots(str(tmp_path))
+
+
+def test_pins_of_dead_processes_do_not_count(tmp_path):
+    version = write_snapshot(str(tmp_path), FAISS.from_documents([Document(page_content="Acme clause.")], EMBEDDINGS),
+                             ["Acme"], FactsIndex())
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    pins = os.path.join(str(tmp_path), "snapshots", version, ".pins")
+    os.makedirs(pins)
+    open(os.path.join(pins, f"{process.pid}.deadbeef@{socket.gethostname()}"), "w").close()
+    assert not is_pinned(str(tmp_path), version)
+    pin_snapshot(str(tmp_path), version)
+    assert is_pinned(str(tmp_path), version)
+
+
+def test_loaded_sharded_state_pins_its_snapshot_until_collected(tmp_path, monkeypatch):
+    import langchain_utils.qa_chain as qa_chain
+    docs = [Document(page_content="Acme storage clause.", metadata={"customer": "Acme", "region": "AU"})]
+    version = write_snapshot(str(tmp_path), None, ["Acme"], FactsIndex(),
+                             shards={"au": FAISS.from_documents(docs, EMBEDDINGS)},
+                             manifest_extra={"shard_by": "region", **qa_chain.index_compatibility()})
+    monkeypatch.setattr(qa_chain, "INDEX_ROOT", str(tmp_path))
+    monkeypatch.setattr(qa_chain, "embeddings", EMBEDDINGS)
+
+    state = qa_chain.load_index_state(version)
+    assert is_pinned(str(tmp_path), version) and state.adaptive_retriever.get_stats()["loaded"] == []
+    del state
+    gc.collect()
+    assert not is_pinned(str(tmp_path), version)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from langchain_utils.single_flight import SingleFlight, SQLiteFlightStore
+
+
+def _run_concurrently(flights, key, fn, n=8):
+    results = []
+    lock = threading.Lock()
+
+    def call(flight):
+        result = flight.do(key, fn)
+        with lock:
+            results.append(result)
+
+    threads = [threading.Thread(target=call, args=(flights[i % len(flights)],)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+def test_concurrent_duplicates_share_one_execution():
+    executions = []
+
+    def pipeline():
+        executions.append(1)
+        time.sleep(0.2)
+        return ["answer", ["source.pdf - Page 1"]]
+
+    flight = SingleFlight()
+    results = _run_concurrently([flight], "q", pipeline)
+    assert len(executions) == 1
+    assert all(value == ["answer", ["source.pdf - Page 1"]] for value, _ in results)
+    assert [role for _, role in results].count("leader") == 1
+    assert flight.get_stats()["dedup_rate"] == 7 / 8
+
+
+def test_workers_coalesce_through_sqlite(tmp_path):
+    executions = []
+
+    def pipeline():
+        executions.append(1)
+        time.sleep(0.3)
+        return ["answer", []]
+
+    path = str(tmp_path / "flights.sqlite")
+    # Two SingleFlight instances stand in for two worker processes sharing the store
+    workers = [SingleFlight(SQLiteFlightStore(path), poll_interval_s=0.01) for _ in range(2)]
+    results = _run_concurrently(workers, "q", pipeline)
+    assert len(executions) == 1
+    assert all(value == ["answer", []] for value, _ in results)
+    assert "remote_follower" in {role for _, role in results}
+
+
+def test_leader_error_is_shared_and_key_released():
+    flight = SingleFlight()
+
+    def failing():
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("q", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert len(errors) == 3
+    assert flight.do("q", lambda: "ok") == ("ok", "leader")
@@ -0,0 +1,45 @@
+import contextlib
+import io
+import time
+
+from langchain_core.documents import Document
+
+from email_tracer import EmailLangChainTracer
+from langchain_utils.fake_llm import DeterministicFakeChatModel
+from langchain_utils.qa_chain import setup_map_reduce_chain, prepare_docs_for_map
+from langchain_utils.trace_export import InMemoryTraceSink, TraceExporter
+
+
+def _run_chain(tracer, user_email="user@example.com"):
+    with contextlib.redirect_stdout(io.StringIO()):
+        chain = setup_map_reduce_chain(llm=DeterministicFakeChatModel())
+    docs = [Document(page_content=f"Clause {i} applies. More text.", metadata={"source": "a.pdf", "customer": "X"})
+            for i in range(3)]
+    chain.invoke({"input_documents": prepare_docs_for_map(docs), "question": "which clause applies?"},
+                 config={"callbacks": [tracer], "metadata": {"user_email": user_email}})
+
+
+def test_runs_are_exported_in_background_with_email_on_root():
+    sink = InMemoryTraceSink(delay_s=0.5)
+    tracer = EmailLangChainTracer(project_name="test", exporter=TraceExporter(sink, flush_interval_s=0.05))
+
+    start = time.perf_counter()
+    _run_chain(tracer)
+    assert time.perf_counter() - start < 0.5  # a slow backend does not delay the request
+
+    assert tracer.exporter.flush(timeout=5)
+    runs = sink.runs
+    roots = [run for run in runs if run["parent_run_id"] is None]
+    assert len(roots) == 1
+    assert "user:user@example.com" in roots[0]["tags"]
+    assert any(run["run_type"] == "llm" for run in runs)
+    assert all(run["end_time"] is not None for run in runs)
+
+
+def test_full_queue_drops_runs_instead_of_blocking():
+    sink = InMemoryTraceSink(fail=True)
+    exporter = TraceExporter(sink, max_queue_size=2, flush_interval_s=10)
+    exporter._ensure_worker = lambda: None  # no consumer: the queue stays full
+    results = [exporter.submit({"id": i}) for i in range(5)]
+    assert results == [True, True, False, False, False]
+    assert exporter.get_stats()["dropped"] == 3